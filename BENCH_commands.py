@@ -0,0 +1,296 @@
+"""End-to-end latency of every command in commands.py.
+
+	python BENCH_commands.py [-n RUNS] [--modes in-process,daemon,http,process]
+		[--pollers N] [--hardware] [--output results.json]
+
+For each command and mode it measures, over RUNS runs, the time from the
+command's start to the first GPIO write, to the servo's start() and the time
+spent persisting the lock state, and reports percentiles as JSON.
+
+Modes:
+	in-process	_control_lock.main, the per-command setup the scripts fall back to
+	daemon		a resident LockEngine, as used by the lock daemon
+	http		POSTs to the HTTP API on one kept-alive connection, while
+			--pollers other connections keep polling GET /state
+	process		a fresh Python process per command, like running lock.py
+
+By default the simulated GPIO backend is used and waits return at once, so
+only software latency is measured. --hardware drives the Pi's pins with real
+waits, which makes each run take as long as the command really does.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+MODES = ("in-process", "daemon", "http", "process")
+PERCENTILES = (50, 90, 99)
+
+class _NoWaitClock(object):
+	"""Wall-clock time whose sleeps return at once."""
+
+	virtual = False
+
+	def time(self):
+		return time.time()
+
+	def sleep(self, seconds):
+		pass
+
+class _RecordingGpio(object):
+	"""Wraps a GPIO module, noting the first output write and servo start."""
+
+	def __init__(self, gpio):
+		self._gpio = gpio
+		self.reset()
+
+	def __getattr__(self, name):
+		return getattr(self._gpio, name)
+
+	def reset(self):
+		self.first_write = None
+		self.servo_start = None
+
+	def _wrote(self, servo_start=False):
+		now = time.time()
+		if self.first_write is None:
+			self.first_write = now
+		if servo_start and self.servo_start is None:
+			self.servo_start = now
+
+	def output(self, channel, value):
+		self._wrote()
+		return self._gpio.output(channel, value)
+
+	def PWM(self, channel, frequency):
+		return _RecordingPwm(self, self._gpio.PWM(channel, frequency))
+
+class _RecordingPwm(object):
+
+	def __init__(self, recorder, pwm):
+		self._recorder = recorder
+		self._pwm = pwm
+
+	def __getattr__(self, name):
+		return getattr(self._pwm, name)
+
+	def start(self, dutycycle):
+		self._recorder._wrote(servo_start=True)
+		return self._pwm.start(dutycycle)
+
+class _TimedBackend(object):
+	"""Wraps a state backend, adding up the time spent saving."""
+
+	def __init__(self, backend):
+		self._backend = backend
+		self.save_time = 0.0
+
+	def load(self):
+		return self._backend.load()
+
+	def stale(self):
+		return self._backend.stale()
+
+	def save(self, state, changes):
+		started = time.time()
+		try:
+			self._backend.save(state, changes)
+		finally:
+			self.save_time += time.time() - started
+
+def _commands():
+	import commands
+	return sorted(commands.ALL)
+
+def _instrument():
+	"""Hooks the recorder and timed state backend into the lock modules."""
+	import _control_lock
+	import _lock_engine
+	import settings
+	from _state_store import StateStore, JsonStateFile
+	recorder = _RecordingGpio(_control_lock.GPIO)
+	_control_lock.GPIO = recorder
+	_lock_engine.GPIO = recorder
+	backend = _TimedBackend(JsonStateFile(settings.PERSISTENT_STATE_FILE))
+	_control_lock._state_store = StateStore(backend, settings.STATE_WRITE_DELAY)
+	return recorder, backend
+
+def _sample(recorder, backend, started):
+	def since(moment):
+		return None if moment is None else moment - started
+	return {
+		"first_gpio_write": since(recorder.first_write),
+		"servo_start": since(recorder.servo_start),
+		"persistence": backend.save_time,
+	}
+
+def _runInProcess(action, runs):
+	import _control_lock
+	recorder, backend = _instrument()
+	samples = []
+	for i in range(runs):
+		recorder.reset()
+		backend.save_time = 0.0
+		started = time.time()
+		_control_lock.main(action)
+		samples.append(_sample(recorder, backend, started))
+	return samples
+
+def _runDaemon(action, runs):
+	import _control_lock
+	from _lock_engine import LockEngine
+	recorder, backend = _instrument()
+	engine = LockEngine()
+	samples = []
+	try:
+		for i in range(runs):
+			recorder.reset()
+			backend.save_time = 0.0
+			started = time.time()
+			engine.execute(action)
+			_control_lock._getStateStore().flush() # count the write-behind too
+			samples.append(_sample(recorder, backend, started))
+	finally:
+		engine.close()
+	return samples
+
+def _runHttp(action, runs, pollers):
+	import threading
+	import _control_lock
+	import _http_api
+	from _lock_engine import LockEngine
+	try:
+		from http.client import HTTPConnection
+	except ImportError: # python 2
+		from httplib import HTTPConnection
+	recorder, backend = _instrument()
+	engine = LockEngine()
+	server = _http_api.serve(engine, "127.0.0.1", 0)
+	threading.Thread(target=server.serve_forever).start()
+	port = server.server_address[1]
+	done = threading.Event()
+	def poll():
+		connection = HTTPConnection("127.0.0.1", port)
+		while not done.is_set():
+			connection.request("GET", "/state")
+			connection.getresponse().read()
+		connection.close()
+	polling = [threading.Thread(target=poll) for i in range(pollers)]
+	for thread in polling:
+		thread.start()
+	connection = HTTPConnection("127.0.0.1", port)
+	samples = []
+	try:
+		for i in range(runs):
+			recorder.reset()
+			backend.save_time = 0.0
+			started = time.time()
+			connection.request("POST", "/commands/" + action)
+			connection.getresponse().read()
+			_control_lock._getStateStore().flush()
+			samples.append(_sample(recorder, backend, started))
+	finally:
+		connection.close()
+		done.set()
+		for thread in polling:
+			thread.join()
+		server.shutdown()
+		server.server_close()
+		engine.close()
+	return samples
+
+def _runProcesses(action, runs, arguments):
+	samples = []
+	for i in range(runs):
+		command = [sys.executable, os.path.abspath(__file__), "--child", action]
+		if arguments.hardware:
+			command.append("--hardware")
+		started = time.time()
+		output = subprocess.check_output(command + ["--started", repr(started)])
+		samples.append(json.loads(output.decode("utf-8")))
+	return samples
+
+def _child(action, started):
+	"""Runs one command in this fresh process, timed from the parent's start."""
+	import _control_lock
+	recorder, backend = _instrument()
+	_control_lock.main(action)
+	print(json.dumps(_sample(recorder, backend, started)))
+
+def _summarize(samples):
+	summary = {}
+	for metric in ("first_gpio_write", "servo_start", "persistence"):
+		values = sorted(sample[metric] for sample in samples if sample[metric] is not None)
+		if not values:
+			summary[metric] = None
+			continue
+		summary[metric] = dict(("p%d" % p, values[min(len(values) - 1, len(values) * p // 100)])
+			for p in PERCENTILES)
+		summary[metric]["max"] = values[-1]
+		summary[metric]["mean"] = sum(values) / len(values)
+	return summary
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("-n", "--runs", type=int, default=100)
+	parser.add_argument("--modes", default="in-process,daemon",
+		help="comma separated, from %s" % ", ".join(MODES))
+	parser.add_argument("--pollers", type=int, default=3, help="connections polling the state in http mode")
+	parser.add_argument("--hardware", action="store_true", help="drive the Pi's pins with real waits")
+	parser.add_argument("--output", help="JSON results file, printed when left out")
+	parser.add_argument("--child", help=argparse.SUPPRESS)
+	parser.add_argument("--started", type=float, help=argparse.SUPPRESS)
+	arguments = parser.parse_args()
+	modes = arguments.modes.split(",")
+	for mode in modes:
+		if mode not in MODES:
+			parser.error("unknown mode %r" % mode)
+
+	# must be settled before the lock modules import their GPIO backend
+	os.environ["DOOR_LOCK_GPIO"] = "rpi" if arguments.hardware else "sim"
+	import _clock
+	import settings
+	if not arguments.hardware:
+		_clock.use(_NoWaitClock())
+	directory = tempfile.mkdtemp()
+	settings.PERSISTENT_STATE_FILE = os.path.join(directory, "state.json")
+	try:
+		if arguments.child:
+			_child(arguments.child, arguments.started)
+			return
+		results = {
+			"backend": os.environ["DOOR_LOCK_GPIO"],
+			"runs": arguments.runs,
+			"python": platform.python_version(),
+			"machine": platform.machine(),
+			"time": time.time(),
+			"commands": {},
+		}
+		for action in _commands():
+			results["commands"][action] = {}
+			for mode in modes:
+				if mode == "in-process":
+					samples = _runInProcess(action, arguments.runs)
+				elif mode == "daemon":
+					samples = _runDaemon(action, arguments.runs)
+				elif mode == "http":
+					samples = _runHttp(action, arguments.runs, arguments.pollers)
+				else:
+					samples = _runProcesses(action, arguments.runs, arguments)
+				results["commands"][action][mode] = _summarize(samples)
+	finally:
+		shutil.rmtree(directory)
+	report = json.dumps(results, indent=2, sort_keys=True)
+	if arguments.output:
+		with open(arguments.output, "w") as f:
+			f.write(report + "\n")
+	else:
+		print(report)
+
+if __name__ == '__main__':
+	main()
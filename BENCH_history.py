@@ -0,0 +1,60 @@
+"""Times history queries over a large history: a two hour range, a week of
+one command and a month of daily counts.
+
+	python BENCH_history.py [-n EVENTS] [--directory DIR]
+
+Fills a fresh history with EVENTS commands spread over a year, written in
+batches of HISTORY_BATCH_SIZE like the daemon does.
+"""
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import _history
+import commands
+import settings
+from _history import History
+
+YEAR = 365 * 86400
+
+def _timed(name, query, repeats=20):
+	latencies = []
+	for i in range(repeats):
+		started = time.time()
+		result = query()
+		latencies.append(time.time() - started)
+	latencies.sort()
+	print("%-28s median %7.2f ms  max %7.2f ms  (%s)" % (name,
+		latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000, result))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("-n", "--events", type=int, default=1000000)
+	parser.add_argument("--directory", help="where to put the history, e.g. on the SD card")
+	arguments = parser.parse_args()
+	directory = tempfile.mkdtemp(dir=arguments.directory)
+	try:
+		history = History(os.path.join(directory, "history.sqlite"), 60, settings.HISTORY_BATCH_SIZE)
+		end = time.time()
+		start = end - YEAR
+		sources = ["button:11", "button:13", "script", "http:192.168.1.20", "http:192.168.1.21"]
+		started = time.time()
+		for at in sorted(random.uniform(start, end) for i in range(arguments.events)):
+			history.record(random.choice(commands.ALL), random.choice(sources), "ok", at=at)
+		history.flush()
+		print("%d events written in %.1f s" % (arguments.events, time.time() - started))
+		night = end - 30 * 86400
+		week = end - 7 * 86400
+		_timed("events, 2 hours", lambda: len(history.events(night, night + 7200)))
+		_timed("count unlocks, 2 hours", lambda: history.count(night, night + 7200, commands.UNLOCK))
+		_timed("count delay locks, week", lambda: history.count(week, end, commands.DELAY_LOCK))
+		_timed("daily counts, 30 days", lambda: len(history.daily(_history.day(end - 30 * 86400), _history.day(end))))
+		history.close()
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,122 @@
+"""Compares the servo PWM backends of _servo_pwm: pulse-width jitter and the
+CPU time it costs to hold the servo at the locked position.
+
+	python BENCH_servo_pwm.py --loopback PIN [--seconds S] [--load N]
+
+Runs on the Pi with pigpiod running (sudo pigpiod). Jitter is measured by
+pigpiod watching the pulses come back on --loopback, a board pin wired to
+the servo pin; leave it out to only compare CPU time. --load keeps N
+processes busy meanwhile, which is where software PWM starts to jitter.
+CPU time is this process's (RPi.GPIO's PWM thread runs in it) plus
+pigpiod's, which times the pulses for the pigpio backend.
+"""
+import os
+import math
+import time
+import argparse
+import multiprocessing
+
+import settings
+import pins
+import _servo_pwm
+from _gpio import GPIO
+
+BACKENDS = ("software", "pigpio")
+
+def _busy():
+	while True:
+		pass
+
+def _pigpiodCpuSeconds():
+	for pid in os.listdir("/proc"):
+		if not pid.isdigit():
+			continue
+		try:
+			with open("/proc/%s/comm" % pid) as f:
+				if f.read().strip() != "pigpiod":
+					continue
+			with open("/proc/%s/stat" % pid) as f:
+				fields = f.read().rsplit(")", 1)[1].split()
+		except IOError:
+			continue
+		# utime and stime, fields 14 and 15 of stat
+		return float(int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+	return 0.0
+
+def _ownCpuSeconds():
+	times = os.times()
+	return times[0] + times[1]
+
+class _PulseWidths(object):
+	"""High times seen by pigpiod on a BCM pin, in microseconds."""
+
+	def __init__(self, pi, gpio):
+		import pigpio
+		self.widths = []
+		self._rise = None
+		pi.set_mode(gpio, pigpio.INPUT)
+		self._callback = pi.callback(gpio, pigpio.EITHER_EDGE, self._edge)
+
+	def _edge(self, gpio, level, tick):
+		import pigpio
+		if level == 1:
+			self._rise = tick
+		elif level == 0 and self._rise is not None:
+			self.widths.append(pigpio.tickDiff(self._rise, tick))
+
+	def cancel(self):
+		self._callback.cancel()
+
+def _bench(backend, arguments):
+	settings.SERVO_PWM_BACKEND = backend
+	servo = _servo_pwm.open(GPIO, pins.SERVO_PIN, 50)
+	watcher = None
+	if arguments.loopback:
+		watcher = _PulseWidths(_servo_pwm._connect(), _servo_pwm.BOARD_TO_BCM[arguments.loopback])
+	servo.start(settings.SERVO_LOCKED_POSITION)
+	time.sleep(0.5) # settle
+	if watcher:
+		del watcher.widths[:]
+	own, pigpiod, started = _ownCpuSeconds(), _pigpiodCpuSeconds(), time.time()
+	time.sleep(arguments.seconds)
+	elapsed = time.time() - started
+	own, pigpiod = _ownCpuSeconds() - own, _pigpiodCpuSeconds() - pigpiod
+	servo.stop()
+	print("%-8s CPU %5.1f%% here, %5.1f%% in pigpiod" % (backend,
+		own / elapsed * 100, pigpiod / elapsed * 100))
+	if watcher:
+		watcher.cancel()
+		_printJitter(watcher.widths, settings.SERVO_LOCKED_POSITION * 10000.0 / 50)
+
+def _printJitter(widths, target):
+	if not widths:
+		print("%-8s no pulses seen on the loopback pin, is it wired to the servo pin?" % "")
+		return
+	mean = float(sum(widths)) / len(widths)
+	deviation = math.sqrt(sum((width - mean) ** 2 for width in widths) / len(widths))
+	errors = sorted(abs(width - target) for width in widths)
+	print("%-8s %d pulses, width mean %.1f us (target %.0f), stdev %.1f us, p99 error %.1f us, max error %.1f us" % ("",
+		len(widths), mean, target, deviation, errors[int(len(errors) * 0.99)], errors[-1]))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--seconds", type=float, default=10.0)
+	parser.add_argument("--loopback", type=int, help="board pin wired to the servo pin, for measuring jitter")
+	parser.add_argument("--load", type=int, default=0, help="busy processes running meanwhile")
+	arguments = parser.parse_args()
+	GPIO.setwarnings(False)
+	GPIO.setmode(GPIO.BOARD)
+	GPIO.setup(pins.SERVO_PIN, GPIO.OUT)
+	load = [multiprocessing.Process(target=_busy) for i in range(arguments.load)]
+	for process in load:
+		process.daemon = True
+		process.start()
+	try:
+		for backend in BACKENDS:
+			_bench(backend, arguments)
+	finally:
+		for process in load:
+			process.terminate()
+
+if __name__ == '__main__':
+	main()
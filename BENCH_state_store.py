@@ -0,0 +1,69 @@
+"""Compares saving the lock state as a rewritten JSON file against the
+append-only journal: write latency and bytes written per operation.
+
+	python BENCH_state_store.py [-n OPERATIONS] [--directory DIR]
+
+Run it with --directory on the Pi's SD card for meaningful numbers. Bytes
+written to storage come from /proc/self/io, so they are only reported on Linux.
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from _state_store import JsonStateFile
+from _state_journal import StateJournal
+
+def _storageBytesWritten():
+	try:
+		with open("/proc/self/io") as f:
+			for line in f:
+				if line.startswith("write_bytes:"):
+					return int(line.split()[1])
+	except IOError:
+		pass
+	return None
+
+def _bench(name, backend, operations):
+	state = backend.load()
+	state["locked"] = False
+	backend.save(state, {"locked": False}) # first save may set up the file
+	latencies = []
+	storage_before = _storageBytesWritten()
+	for i in range(operations):
+		state["locked"] = i % 2 == 0
+		started = time.time()
+		backend.save(state, {"locked": state["locked"]})
+		latencies.append(time.time() - started)
+	storage_after = _storageBytesWritten()
+	latencies.sort()
+	print("%-8s mean %7.3f ms  p50 %7.3f ms  p99 %7.3f ms" % (name,
+		sum(latencies) / len(latencies) * 1000,
+		latencies[len(latencies) // 2] * 1000,
+		latencies[int(len(latencies) * 0.99)] * 1000))
+	if storage_before is not None:
+		print("%-8s %.1f bytes written to storage per operation" % ("",
+			float(storage_after - storage_before) / operations))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("-n", "--operations", type=int, default=1000)
+	parser.add_argument("--directory", help="where to write, defaults to a temporary directory")
+	arguments = parser.parse_args()
+	directory = tempfile.mkdtemp(dir=arguments.directory)
+	try:
+		json_path = os.path.join(directory, "state.json")
+		_bench("json", JsonStateFile(json_path), arguments.operations)
+		journal = StateJournal(os.path.join(directory, "state.journal"),
+			compact_after=arguments.operations * 2)
+		_bench("journal", journal, arguments.operations)
+		journal.close()
+		print("file sizes: json %d bytes, journal %d bytes" % (
+			os.path.getsize(json_path),
+			os.path.getsize(os.path.join(directory, "state.journal"))))
+	finally:
+		shutil.rmtree(directory)
+
+if __name__ == '__main__':
+	main()
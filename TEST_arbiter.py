@@ -0,0 +1,241 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import json
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+import sys
+
+import _arbiter
+import _metrics
+import _sim_gpio as GPIO
+import _control_lock
+import _test_files
+import commands
+import pins
+from _arbiter import Arbiter, ProcessLock, Superseded, Preempted
+from _state_store import JsonStateFile
+
+
+def _waitFor(condition, timeout=2.0):
+	started = time.time()
+	while not condition():
+		if time.time() - started > timeout:
+			raise AssertionError("timed out")
+		time.sleep(0.001)
+
+
+class TestProcessLock(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "test.lock")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def test_uncontended(self):
+		lock = ProcessLock(self.path)
+		with lock:
+			assert not lock.contended
+		with lock: # released by the first
+			pass
+
+	def test_waiterAsksHolderToGiveUp(self):
+		holder = ProcessLock(self.path)
+		waiter = ProcessLock(self.path, preempt=True)
+		holder.acquire()
+		thread = threading.Thread(target=waiter.acquire)
+		thread.start()
+		_waitFor(lambda: _arbiter.preemptRequested(self.path))
+		holder.release()
+		thread.join(2.0)
+		assert waiter.contended
+		assert not _arbiter.preemptRequested(self.path) # withdrawn once granted
+		waiter.release()
+
+	def test_interruptedWaiterWithdraws(self):
+		holder = ProcessLock(self.path)
+		holder.acquire()
+		waiter = ProcessLock(self.path, preempt=True)
+		flock = _arbiter.fcntl.flock
+		def interrupted(fd, operation):
+			if operation == _arbiter.fcntl.LOCK_EX:
+				raise KeyboardInterrupt() # Ctrl-C while waiting
+			flock(fd, operation)
+		with mock.patch("_arbiter.fcntl.flock", side_effect=interrupted):
+			self.assertRaises(KeyboardInterrupt, waiter.acquire)
+		assert os.listdir(self.directory) == ["test.lock"]
+		holder.release()
+
+	def test_deadWaiterIgnored(self):
+		process = subprocess.Popen([sys.executable, "-c", "pass"])
+		process.wait()
+		marker = "%s.preempt.%d.0" % (self.path, process.pid)
+		open(marker, "w").close()
+		assert not _arbiter.preemptRequested(self.path)
+		assert not os.path.exists(marker)
+
+	def test_buzzWaitsWithoutPreempting(self):
+		with mock.patch("settings.ACTUATION_LOCK_FILE", self.path):
+			holder = _arbiter.actuationLock(commands.DELAY_LOCK)
+			holder.acquire()
+			waiter = _arbiter.actuationLock(commands.BUZZ)
+			thread = threading.Thread(target=waiter.acquire)
+			thread.start()
+			time.sleep(0.1)
+			assert not _arbiter.preemptRequested()
+			holder.release()
+			thread.join(2.0)
+			waiter.release()
+
+
+class TestArbiter(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self._lock_patch = mock.patch("settings.ACTUATION_LOCK_FILE",
+			os.path.join(self.directory, "actuation.lock"))
+		self._lock_patch.start()
+		self.arbiter = Arbiter()
+		self.ran = []
+
+	def tearDown(self):
+		self._lock_patch.stop()
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def _run(self, action):
+		# runs action, recording whether it ran
+		try:
+			self.arbiter.acquire(action)
+		except Superseded:
+			self.ran.append((action, "superseded"))
+			return
+		self.ran.append((action, "ran"))
+		self.arbiter.release()
+
+	def _start(self, action):
+		# queues action behind the current holder
+		waiting = len(self.arbiter._waiting)
+		thread = threading.Thread(target=self._run, args=(action,))
+		thread.start()
+		_waitFor(lambda: len(self.arbiter._waiting) > waiting or self.ran)
+		return thread
+
+	def _finish(self, threads):
+		self.arbiter.release()
+		for thread in threads:
+			thread.join(2.0)
+
+	def test_higherPriorityRunsFirst(self):
+		self.arbiter.acquire(commands.BUZZ)
+		threads = [self._start(commands.BUZZ), self._start(commands.TOGGLE)]
+		self._finish(threads)
+		assert self.ran == [(commands.TOGGLE, "ran"), (commands.BUZZ, "ran")]
+
+	def test_latestCommandSupersedesWaitingOnes(self):
+		self.arbiter.acquire(commands.DELAY_LOCK)
+		threads = [self._start(commands.TOGGLE), self._start(commands.BUZZ),
+			self._start(commands.UNLOCK)]
+		_waitFor(lambda: self.ran)
+		assert self.ran == [(commands.TOGGLE, "superseded")]
+		self._finish(threads)
+		assert self.ran[1:] == [(commands.UNLOCK, "ran"), (commands.BUZZ, "ran")]
+
+	def test_reconfigureGoesFirstAndStays(self):
+		self.arbiter.acquire(commands.TOGGLE)
+		threads = [self._start(commands.UNLOCK), self._start(_arbiter.RECONFIGURE),
+			self._start(commands.LOCK)]
+		_waitFor(lambda: self.ran)
+		assert self.ran == [(commands.UNLOCK, "superseded")]
+		self._finish(threads)
+		assert self.ran[1:] == [(_arbiter.RECONFIGURE, "ran"), (commands.LOCK, "ran")]
+
+	def test_withoutSupersedeWaitsItsTurn(self):
+		self.arbiter.acquire(commands.BUZZ)
+		thread = self._start(commands.UNLOCK)
+		self.arbiter.release()
+		thread.join(2.0)
+		self.arbiter.acquire(commands.LOCK, supersede=False)
+		self.arbiter.release()
+		assert self.ran == [(commands.UNLOCK, "ran")]
+
+	def test_contentionCounted(self):
+		contended = _metrics.ACTUATION_CONTENDED.value(holder="process")
+		waits = _metrics.ACTUATION_WAIT_SECONDS.count()
+		self.arbiter.acquire(commands.LOCK)
+		self._finish([self._start(commands.UNLOCK)])
+		assert _metrics.ACTUATION_CONTENDED.value(holder="process") == contended + 1
+		assert _metrics.ACTUATION_WAIT_SECONDS.count() == waits + 2
+
+	def test_waitsForOtherProcess(self):
+		contended = _metrics.ACTUATION_CONTENDED.value(holder="other_process")
+		other = _arbiter.actuationLock()
+		other.acquire()
+		thread = threading.Thread(target=self._run, args=(commands.LOCK,))
+		thread.start()
+		_waitFor(_arbiter.preemptRequested)
+		assert self.ran == []
+		other.release()
+		thread.join(2.0)
+		assert self.ran == [(commands.LOCK, "ran")]
+		assert _metrics.ACTUATION_CONTENDED.value(holder="other_process") == contended + 1
+
+
+class TestStateFileSharing(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "state.json")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def test_saveKeepsKeysSavedByOthers(self):
+		mine, theirs = JsonStateFile(self.path), JsonStateFile(self.path)
+		state = mine.load()
+		theirs.save({"back.locked": True}, {"back.locked": True})
+		state["locked"] = False
+		mine.save(state, {"locked": False})
+		with open(self.path) as f:
+			assert json.loads(f.read()) == {"locked": False, "back.locked": True}
+
+
+class TestPreemptedDelayLock(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start()
+		GPIO.setmode(GPIO.BOARD)
+		GPIO.setup(pins.LOCK_STATUS_LED_PIN, GPIO.OUT)
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_countdownGivesUpWhenAnotherProcessWaits(self):
+		self.clock.callAt(3.2, _arbiter.actuationLock()._request) # as if another process waited
+		self.assertRaises(Preempted, _control_lock._blinkingSleep, 20)
+		assert self.clock.time() == 4.0
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestProcessLock),
+		unittest.TestLoader().loadTestsFromTestCase(TestArbiter),
+		unittest.TestLoader().loadTestsFromTestCase(TestStateFileSharing),
+		unittest.TestLoader().loadTestsFromTestCase(TestPreemptedDelayLock),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,175 @@
+import unittest
+import mock
+import time
+
+import _auth
+import _clock
+import _config
+import _metrics
+import commands
+import settings
+from _auth import Authorizer, CredentialError, Unauthorized, Forbidden, TooManyAttempts
+from _clock import VirtualClock
+
+KEY = b"0123456789abcdef" * 4
+# noon on Friday 1 March 2024, local time
+FRIDAY_NOON = time.mktime((2024, 3, 1, 12, 0, 0, 0, 0, -1))
+ADDRESS = "192.168.1.20"
+
+def _token(name, role, **spec):
+	# the token and its spec
+	token, spec["token"] = _auth.newToken(name)
+	spec["role"] = role
+	return token, spec
+
+def _pin(pin, role, **spec):
+	spec["pin"] = _auth.hashPin(pin, KEY)
+	spec["role"] = role
+	return spec
+
+
+class TestParse(unittest.TestCase):
+
+	def test_token(self):
+		token, spec = _token("alice", _auth.UNLOCK, days="mon-fri", hours="07:00-22:30")
+		credential = _auth.parse("alice", spec)
+		assert credential.days == set(range(5))
+		assert credential.hours == (7 * 60, 22 * 60 + 30)
+		assert token.startswith("alice.")
+
+	def test_mistakes(self):
+		token, spec = _token("alice", _auth.UNLOCK)
+		for bad in [
+				"unlock",
+				{"role": _auth.UNLOCK},
+				dict(spec, pin=_auth.hashPin("1234", KEY)),
+				dict(spec, role="admin"),
+				dict(spec, token="1234"),
+				dict(spec, days="weekdays"),
+				dict(spec, hours="7-22"),
+				dict(spec, hours="07:00-24:00"),
+				dict(spec, hours="07:00-07:00"),
+				dict(spec, every="day"),
+				{"pin": "1234", "role": _auth.BUZZ},
+				]:
+			self.assertRaises(CredentialError, _auth.parse, "bad", bad, KEY)
+
+	def test_pinNeedsKey(self):
+		self.assertRaises(CredentialError, _auth.parse, "keypad", _pin("1234", _auth.BUZZ))
+
+
+class TestAuthorizer(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.clock = VirtualClock(FRIDAY_NOON)
+		self.old_clock = _clock.use(self.clock)
+		self.token, alice = _token("alice", _auth.UNLOCK)
+		self.specs = {"alice": alice, "keypad": _pin("4711", _auth.BUZZ)}
+		self.auth = Authorizer(self.specs, KEY)
+
+	def tearDown(self):
+		_clock.use(self.old_clock)
+	#endregion
+
+	def test_token(self):
+		assert self.auth.authorize("Bearer " + self.token, commands.UNLOCK, ADDRESS).name == "alice"
+
+	def test_pin(self):
+		assert self.auth.authorize("PIN 4711", commands.BUZZ, ADDRESS).name == "keypad"
+
+	def test_wrongSecrets(self):
+		name, _, secret = self.token.partition(".")
+		for authorization in [None, "", "Bearer", "Bearer " + secret, "Bearer bob." + secret,
+				"Bearer alice." + secret[:-1], "PIN 4712", "PIN ", "Basic YWxpY2U6c2VjcmV0"]:
+			self.assertRaises(Unauthorized, self.auth.authenticate, authorization, "10.0.0.%d" % len(authorization or ""))
+
+	def test_roles(self):
+		with mock.patch("settings.SEQUENCES", {"ring": "buzz 2s; wait 1s", "let_in": "buzz || unlock"}):
+			for action, allowed in [(commands.LOCK, True), ("ring", True), (commands.BUZZ, True),
+					(commands.UNLOCK, False), (commands.TOGGLE, False), (commands.DELAY_LOCK, False),
+					(commands.BUZZ_AND_UNLOCK, False), ("let_in", False)]:
+				if allowed:
+					self.auth.authorize("PIN 4711", action, ADDRESS)
+				else:
+					self.assertRaises(Forbidden, self.auth.authorize, "PIN 4711", action, ADDRESS)
+
+	def test_lockRole(self):
+		self.auth.update(dict(self.specs, porch=_pin("1111", _auth.LOCK)))
+		self.auth.authorize("PIN 1111", commands.LOCK, ADDRESS)
+		self.assertRaises(Forbidden, self.auth.authorize, "PIN 1111", commands.BUZZ, ADDRESS)
+
+	def test_hoursAndDays(self):
+		self.auth.update(dict(self.specs, night=_pin("2222", _auth.UNLOCK, hours="22:00-06:00", days="fri")))
+		self.assertRaises(Forbidden, self.auth.authorize, "PIN 2222", commands.UNLOCK, ADDRESS)
+		self.auth.authenticate("PIN 2222", ADDRESS) # reading the state is fine
+		self.clock.advanceTo(FRIDAY_NOON + 11 * 3600) # Friday 23:00
+		self.auth.authorize("PIN 2222", commands.UNLOCK, ADDRESS)
+		self.clock.advanceTo(FRIDAY_NOON + 15 * 3600) # Saturday 3:00, past midnight but not Friday
+		self.assertRaises(Forbidden, self.auth.authorize, "PIN 2222", commands.UNLOCK, ADDRESS)
+
+	def test_updateParsesChangedOnly(self):
+		alice = self.auth.authenticate("Bearer " + self.token, ADDRESS)
+		token, bob = _token("bob", _auth.LOCK)
+		specs = {"alice": dict(self.specs["alice"]), "bob": bob}
+		assert self.auth.update(specs) == (set(["bob"]), set(), set(["keypad"]))
+		assert self.auth.authenticate("Bearer " + self.token, ADDRESS) is alice
+		assert self.auth.authenticate("Bearer " + token, ADDRESS).name == "bob"
+		self.assertRaises(Unauthorized, self.auth.authenticate, "PIN 4711", ADDRESS)
+		assert len(self.auth) == 2
+
+	def test_badUpdateKeepsCredentials(self):
+		self.assertRaises(CredentialError, self.auth.update, dict(self.specs, bob={"role": "admin"}))
+		self.assertRaises(CredentialError, self.auth.update, dict(self.specs, other=_pin("4711", _auth.LOCK)))
+		self.auth.authorize("PIN 4711", commands.BUZZ, ADDRESS)
+		assert len(self.auth) == 2
+
+	def test_pinMovesToOtherName(self):
+		specs = {"alice": self.specs["alice"], "front": self.specs["keypad"]}
+		self.auth.update(specs)
+		assert self.auth.authenticate("PIN 4711", ADDRESS).name == "front"
+
+	def test_failedAttemptsLimited(self):
+		refused = _metrics.AUTH_REFUSED.value(reason="too_many_attempts")
+		for attempt in range(settings.AUTH_FAILURES):
+			self.assertRaises(Unauthorized, self.auth.authenticate, "PIN %04d" % attempt, ADDRESS)
+			self.clock.advance(1)
+		try:
+			self.auth.authenticate("PIN 4711", ADDRESS) # right, but too late
+			assert False
+		except TooManyAttempts as e:
+			assert e.retry_after == settings.AUTH_FAILURE_WINDOW - settings.AUTH_FAILURES
+		assert _metrics.AUTH_REFUSED.value(reason="too_many_attempts") == refused + 1
+		self.auth.authenticate("PIN 4711", "192.168.1.21") # other addresses go on
+		self.clock.advance(settings.AUTH_FAILURE_WINDOW - settings.AUTH_FAILURES + 1)
+		self.auth.authenticate("PIN 4711", ADDRESS) # the first failure aged out
+
+	def test_failureLimitsReloaded(self):
+		old = _config.use(_config.current.replace(AUTH_FAILURES=2, AUTH_FAILURE_WINDOW=10))
+		try:
+			for attempt in range(2):
+				self.assertRaises(Unauthorized, self.auth.authenticate, "PIN %04d" % attempt, ADDRESS)
+			self.assertRaises(TooManyAttempts, self.auth.authenticate, "PIN 4711", ADDRESS)
+			self.clock.advance(10)
+			self.auth.authenticate("PIN 4711", ADDRESS)
+		finally:
+			_config.use(old)
+
+	def test_manyCredentials(self):
+		specs = dict(("keypad%d" % i, _pin("%06d" % i, _auth.BUZZ)) for i in range(2000))
+		tokens = []
+		for i in range(2000):
+			token, specs["phone%d" % i] = _token("phone%d" % i, _auth.UNLOCK)
+			tokens.append(token)
+		self.auth.update(specs)
+		assert len(self.auth) == 4000
+		assert self.auth.authenticate("PIN 001999", ADDRESS).name == "keypad1999"
+		assert self.auth.authenticate("Bearer " + tokens[1234], ADDRESS).name == "phone1234"
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestParse),
+		unittest.TestLoader().loadTestsFromTestCase(TestAuthorizer),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
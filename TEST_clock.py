@@ -0,0 +1,114 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+
+import _sim_gpio as GPIO
+import _control_lock
+import _lock_engine
+import _test_files
+import commands
+import pins
+import settings
+from _clock import VirtualClock
+from _scheduler import Scheduler
+
+
+class TestVirtualClock(unittest.TestCase):
+
+	def test_sleepAdvancesTime(self):
+		clock = VirtualClock(100.0)
+		clock.sleep(2.5)
+		assert clock.time() == 102.5
+
+	def test_timersRunAtTheirDeadline(self):
+		clock = VirtualClock()
+		fired = []
+		clock.callAt(3.0, lambda: fired.append(clock.time()))
+		clock.callAt(1.0, lambda: fired.append(clock.time()))
+		clock.sleep(5)
+		assert fired == [1.0, 3.0]
+		assert clock.time() == 5.0
+
+	def test_forkedSleepsOverlap(self):
+		clock = VirtualClock()
+		end = clock.runForked(0.0, lambda: clock.sleep(4))
+		assert end == 4.0
+		assert clock.time() == 0.0
+
+	def test_schedulerOnVirtualClock(self):
+		clock = VirtualClock()
+		scheduler = Scheduler(clock)
+		fired = []
+		event = scheduler.schedule(5, lambda: fired.append(clock.time()))
+		scheduler.reschedule(event, 8)
+		clock.sleep(10)
+		assert fired == [8.0]
+
+
+class TestVirtualTimeline(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start()
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_buzzAndUnlockTimeline(self):
+		_control_lock.main(commands.BUZZ_AND_UNLOCK)
+		rotation = settings.SERVO_ROTATION_DURATION
+		locked_at = rotation + settings.DELAYED_LOCK_DELAY
+		assert GPIO.outputHistory(pins.BUZZER_PIN) == [
+			(0.0, GPIO.LOW), # setup
+			(0.0, GPIO.HIGH),
+			(settings.BUZZ_DURATION, GPIO.LOW),
+			(locked_at + rotation, GPIO.LOW), # _buzzAndUnlock making sure
+		]
+		assert GPIO.outputHistory(pins.SERVO_PIN, "duty") == [
+			(0.0, settings.SERVO_UNLOCKED_POSITION),
+			(locked_at, settings.SERVO_LOCKED_POSITION),
+			(locked_at + rotation, None),
+		]
+		led = GPIO.outputHistory(pins.LOCK_STATUS_LED_PIN)
+		assert led[1] == (rotation, GPIO.LOW) # first blink
+		assert led[2] == (rotation + 0.5, GPIO.HIGH)
+		assert led[-1] == (locked_at, GPIO.HIGH)
+		assert self.clock.time() == locked_at + rotation
+
+	def test_engineCountdownPreemptedByLock(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute(commands.DELAY_LOCK)
+		self.clock.sleep(5) # into the countdown
+		timings = engine.execute(commands.LOCK)
+		self.clock.sleep(60)
+		locks = [t for t, duty in GPIO.outputHistory(pins.SERVO_PIN, "duty")
+			if duty == settings.SERVO_LOCKED_POSITION]
+		assert locks == [settings.SERVO_ROTATION_DURATION + 5]
+		assert timings["dispatch_latency"] == 0.0
+		engine.close()
+
+	def test_engineDelayedLockFiresOnTime(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute(commands.DELAY_LOCK)
+		self.clock.sleep(60)
+		locks = [t for t, duty in GPIO.outputHistory(pins.SERVO_PIN, "duty")
+			if duty == settings.SERVO_LOCKED_POSITION]
+		assert locks == [settings.SERVO_ROTATION_DURATION + settings.DELAYED_LOCK_DELAY]
+		engine.close()
+
+	def test_thousandsOfSequencesInSimulatedTime(self):
+		for i in range(1000):
+			_control_lock.main(commands.DELAY_LOCK)
+		sequence = 2 * settings.SERVO_ROTATION_DURATION + settings.DELAYED_LOCK_DELAY
+		assert self.clock.time() == 1000 * sequence
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestVirtualClock),
+		unittest.TestLoader().loadTestsFromTestCase(TestVirtualTimeline),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
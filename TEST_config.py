@@ -0,0 +1,280 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+import _config
+import _sequences
+import _sim_gpio as GPIO
+import _control_lock
+import _lock_engine
+import _test_files
+import commands
+import pins
+import settings
+from _config import ConfigError
+
+# a board pin nothing uses by default
+FREE_PIN = 29
+
+
+class TestLoad(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "config.json")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def _write(self, overrides):
+		with open(self.path, "w") as f:
+			json.dump(overrides, f)
+
+	def _load(self, overrides):
+		self._write(overrides)
+		return _config.load(self.path)
+
+	def test_noFileIsDefaults(self):
+		config = _config.load(self.path)
+		assert config.BUZZ_DURATION == settings.BUZZ_DURATION
+		assert config.SERVO_PIN == pins.SERVO_PIN
+		assert config.changed(_config.defaults()) == set()
+
+	def test_overrides(self):
+		config = self._load({"BUZZ_DURATION": 2, "SERVO_LOCKED_POSITION": 8.5, "BUZZER_PIN": FREE_PIN})
+		assert (config.BUZZ_DURATION, config.SERVO_LOCKED_POSITION, config.BUZZER_PIN) == (2, 8.5, FREE_PIN)
+		assert config.changed(_config.defaults()) == set(["BUZZ_DURATION", "SERVO_LOCKED_POSITION", "BUZZER_PIN"])
+		assert config.pins[FREE_PIN] == "BUZZER_PIN"
+
+	def test_mistakes(self):
+		for overrides in [
+				{"BUZZ_DURATOIN": 2},
+				{"CONFIG_FILE": "/tmp/other.json"},
+				{"GPIO_BACKEND": "sim"},
+				{"BUZZ_DURATION": "2"},
+				{"BUZZ_DURATION": -1},
+				{"DELAYED_LOCK_DELAY": 1.5},
+				{"SERVO_LOCKED_POSITION": 12},
+				{"BUZZER_PIN": pins.SERVO_PIN},
+				{"BUZZER_PIN": 1},
+				{"BUZZER_PIN": None},
+				{"HTTP_API_PORT": 70000},
+				{"STATE_BACKEND": "sqlite"},
+				{"SEQUENCES": {"let_in": "unlock; wait soon"}},
+				{"RULES": {"night": {"at": "25:00", "command": "lock"}}},
+				{"RULES": {"morning": {"at": "8:00", "command": "let_in"}}},
+				{"HOLIDAYS": ["christmas"]},
+				]:
+			self.assertRaises(ConfigError, self._load, overrides)
+
+	def test_doorMistakes(self):
+		for doors in [
+				{"back": {"SERVO_PIN": pins.LOCK_STATUS_LED_PIN, "SERVO_LOCKED_POSITION": 55, "BOGUS": 1}},
+				{"back": {"BOGUS": 1}},
+				{"back": {"SERVO_LOCKED_POSITION": 55}},
+				{"back": {"BUZZ_DURATION": "2"}},
+				{"back": {"SERVO_PIN": pins.LOCK_STATUS_LED_PIN}},
+				{"back": {"SERVO_PIN": 1}},
+				{"back": {"SERVO_PIN": FREE_PIN, "BUZZER_PIN": FREE_PIN}},
+				{"back": {"SERVO_PIN": FREE_PIN}, "garage": {"BUZZER_PIN": FREE_PIN}},
+				{"back": 12},
+				{"a-very-long-door-name": {}},
+				]:
+			self.assertRaises(ConfigError, self._load, {"DOORS": doors})
+
+	def test_doorsShareUnchangedPins(self):
+		doors = {"main": {}, "back": {"SERVO_PIN": 12, "LOCK_STATUS_LED_PIN": 16}, "garage": {"SERVO_PIN": 22}}
+		assert self._load({"DOORS": doors}).DOORS == doors
+
+	def test_ruleUsesSequenceFromSameFile(self):
+		config = self._load({
+			"SEQUENCES": {"let_in": "unlock; wait 60; lock"},
+			"RULES": {"morning": {"at": "8:00", "command": "let_in"}},
+		})
+		assert "morning" in config.RULES
+
+	def test_notJson(self):
+		with open(self.path, "w") as f:
+			f.write("BUZZ_DURATION = 2")
+		self.assertRaises(ConfigError, _config.load, self.path)
+
+	def test_readOnly(self):
+		config = _config.defaults()
+		def change():
+			config.BUZZ_DURATION = 2
+		self.assertRaises(AttributeError, change)
+
+
+class TestUse(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.old = _config.current
+
+	def tearDown(self):
+		_config.use(self.old)
+	#endregion
+
+	def test_setsModules(self):
+		config = _config.defaults().replace(BUZZ_DURATION=2, BUZZER_PIN=FREE_PIN)
+		old = _config.use(config)
+		assert (settings.BUZZ_DURATION, pins.BUZZER_PIN) == (2, FREE_PIN)
+		assert _config.current is config
+		_config.use(old)
+		assert (settings.BUZZ_DURATION, pins.BUZZER_PIN) == (old.BUZZ_DURATION, old.BUZZER_PIN)
+
+	def test_leavesUnchangedNamesAlone(self):
+		with mock.patch("settings.HISTORY_FILE", "/tmp/patched.db"):
+			_config.use(_config.defaults().replace(BUZZ_DURATION=2))
+			assert settings.HISTORY_FILE == "/tmp/patched.db"
+
+	def test_readersSeeOneConfigOrTheOther(self):
+		first = _config.defaults().replace(BUZZ_DURATION=1, SERVO_ROTATION_DURATION=1)
+		second = _config.defaults().replace(BUZZ_DURATION=2, SERVO_ROTATION_DURATION=2)
+		seen = set()
+		done = threading.Event()
+		def read():
+			while not done.is_set():
+				config = _config.current
+				seen.add((config.BUZZ_DURATION, config.SERVO_ROTATION_DURATION))
+		_config.use(first)
+		reader = threading.Thread(target=read)
+		if hasattr(sys, "setswitchinterval"):
+			interval = sys.getswitchinterval()
+			sys.setswitchinterval(1e-6) # switch threads as often as possible
+		else: # python 2
+			interval = sys.getcheckinterval()
+			sys.setcheckinterval(1)
+		try:
+			reader.start()
+			for i in range(2000):
+				_config.use(first if i % 2 else second)
+		finally:
+			done.set()
+			reader.join()
+			if hasattr(sys, "setswitchinterval"):
+				sys.setswitchinterval(interval)
+			else:
+				sys.setcheckinterval(interval)
+		assert seen <= set([(1, 1), (2, 2)]), seen
+
+	def test_sequencesParsedByLoadOnly(self):
+		config = _config.defaults().replace(SEQUENCES={"let_in": "unlock; wait 60; lock"})
+		_config.check(config)
+		_config.use(config)
+		with mock.patch("_sequences.parse", side_effect=AssertionError("parsed again")):
+			assert _sequences.lookup("let_in") is _sequences.lookup("let_in")
+			_sequences.lookup(commands.LOCK)
+
+	def test_reloadKeepsRestartNames(self):
+		new = _config.defaults().replace(BUZZ_DURATION=2, HTTP_API_PORT=8081, TOGGLE_LOCK_PIN=FREE_PIN)
+		config, kept = _config.forReload(new)
+		assert kept == set(["HTTP_API_PORT", "TOGGLE_LOCK_PIN"])
+		assert (config.BUZZ_DURATION, config.HTTP_API_PORT) == (2, settings.HTTP_API_PORT)
+
+
+class TestWatcher(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "config.json")
+		self.changes = []
+		self.watcher = _config.Watcher(self.path, lambda: self.changes.append(time.time()))
+
+	def tearDown(self):
+		self.watcher.close()
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def _waitForChange(self, count):
+		deadline = time.time() + 5
+		while len(self.changes) < count and time.time() < deadline:
+			time.sleep(0.01)
+		return len(self.changes) >= count
+
+	def test_write(self):
+		with open(self.path, "w") as f:
+			f.write("{}")
+		assert self._waitForChange(1)
+
+	def test_renamedOver(self):
+		# how editors save
+		other = self.path + ".tmp"
+		with open(other, "w") as f:
+			f.write("{}")
+		count = len(self.changes)
+		os.rename(other, self.path)
+		assert self._waitForChange(count + 1)
+
+	def test_otherFilesIgnored(self):
+		with open(os.path.join(self.directory, "notes.txt"), "w") as f:
+			f.write("unrelated")
+		time.sleep(0.1)
+		assert self.changes == []
+
+
+class TestReconfigure(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start()
+		self.old_config = _config.current
+		self.engine = _lock_engine.LockEngine()
+
+	def tearDown(self):
+		self.engine.close()
+		_config.use(self.old_config)
+		self.lock.stop()
+	#endregion
+
+	def test_newDurationUsedByNextCommand(self):
+		changed = self.engine.reconfigure(_config.current.replace(BUZZ_DURATION=2))
+		assert changed == set(["BUZZ_DURATION"])
+		started = self.clock.time()
+		self.engine.execute(commands.BUZZ)
+		levels = GPIO.outputHistory(pins.BUZZER_PIN)
+		assert levels[-1][0] - started == 2
+
+	def test_ledMovesToNewPin(self):
+		old_pin = pins.LOCK_STATUS_LED_PIN
+		self.engine.reconfigure(_config.current.replace(LOCK_STATUS_LED_PIN=FREE_PIN))
+		self.engine.execute(commands.LOCK)
+		assert GPIO.input(FREE_PIN) == GPIO.HIGH
+		self.assertRaises(RuntimeError, GPIO.input, old_pin) # let go
+
+	def test_sensorMovesAsInput(self):
+		self.engine.reconfigure(_config.current.replace(DOOR_SENSOR_PIN=FREE_PIN))
+		assert GPIO.input(FREE_PIN) == GPIO.HIGH # pulled up, the door reads open
+		self.assertRaises(RuntimeError, GPIO.output, FREE_PIN, GPIO.LOW) # never driven
+		assert self.engine.state()["door_open"]
+
+	def test_rulesStartOver(self):
+		self.engine.reconfigure(_config.current.replace(RULES={
+			"auto_lock": {"after": "unlock", "delay": 60, "command": commands.LOCK},
+		}))
+		self.engine.execute(commands.LOCK)
+		self.engine.execute(commands.UNLOCK)
+		self.clock.sleep(61)
+		assert _control_lock._isCurrentlyLocked()
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestLoad),
+		unittest.TestLoader().loadTestsFromTestCase(TestUse),
+		unittest.TestLoader().loadTestsFromTestCase(TestWatcher),
+		unittest.TestLoader().loadTestsFromTestCase(TestReconfigure),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
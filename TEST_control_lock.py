@@ -2,8 +2,10 @@ import unittest
 import RPi.GPIO as GPIO
 import mock
 import _control_lock
+import _test_files
 import time
 import json
+import threading
 
 import commands
 import pins
@@ -14,6 +16,11 @@ class TestServoControls(unittest.TestCase):
 
 	#region setup and teardown
 	def setUp(self):
+		self.files = _test_files.TempFiles() # the history and actuation lock, the state file is mocked
+		self.files.start()
+		# RPi.GPIO whichever backend _gpio picked, other tests import the simulation
+		self._gpio_patch = mock.patch("_control_lock.GPIO", GPIO)
+		self._gpio_patch.start()
 		self._sleep_patch = mock.patch("time.sleep", autospec=True)
 		self.sleep_mock = self._sleep_patch.start()
 		self._output_patch = mock.patch("RPi.GPIO.output", autospec=True)
@@ -28,8 +35,15 @@ class TestServoControls(unittest.TestCase):
 		self.setmode_mock = self._setmode_patch.start()
 		self._open_patch = mock.patch("__builtin__.open", mock.mock_open(read_data="{}"))
 		self.open_mock = self._open_patch.start()
+		self._fsync_patch = mock.patch("os.fsync", autospec=True)
+		self.fsync_mock = self._fsync_patch.start()
+		self._rename_patch = mock.patch("os.rename", autospec=True)
+		self.rename_mock = self._rename_patch.start()
+		_control_lock._state_store = None # reload state from the mocked file
 
 	def tearDown(self):
+		_control_lock._getStateStore().flush() # no write-behind after the patches stop
+		_control_lock._state_store = None
 		self._sleep_patch.stop()
 		self._output_patch.stop()
 		self._PWM_patch.stop()
@@ -37,6 +51,10 @@ class TestServoControls(unittest.TestCase):
 		self._setwarnings_patch.stop()
 		self._setmode_patch.stop()
 		self._open_patch.stop()
+		self._fsync_patch.stop()
+		self._rename_patch.stop()
+		self._gpio_patch.stop()
+		self.files.stop()
 	#endregion
 
 	#region setup mocks
@@ -206,10 +224,13 @@ class TestServoControls(unittest.TestCase):
 		assert mock__setup is _control_lock._setup
 		# call tag under test
 		_control_lock.main(commands.BUZZ_AND_UNLOCK)
-		# test assertions
-		calls = [mock.call(pins.BUZZER_PIN, GPIO.HIGH),
-				 mock.call(pins.BUZZER_PIN, GPIO.LOW)]
-		self.output_mock.assert_has_calls(calls)
+		# test assertions, servo channel calls may come in between
+		high = mock.call(pins.BUZZER_PIN, GPIO.HIGH)
+		low = mock.call(pins.BUZZER_PIN, GPIO.LOW)
+		calls = self.output_mock.call_args_list
+		assert high in calls
+		assert calls.index(high) < calls.index(low)
+		assert calls[-1] == low
 
 	@mock.patch("_control_lock._setup", autospec=True)
 	@mock.patch("_control_lock._unlock", autospec=True)
@@ -222,22 +243,54 @@ class TestServoControls(unittest.TestCase):
 		# call tag under test
 		_control_lock.main(commands.BUZZ_AND_UNLOCK)
 		# test assertions
-		mock__unlock.assert_called_once_with(mock__setup.return_value)
+		mock__unlock.assert_called_once_with(mock__setup.return_value, None)
 
 	@mock.patch("_control_lock._setup", autospec=True)
-	def test_buzzAndUnlock_callsSleepInOrder(self, mock__setup):
+	def test_buzzAndUnlock_callsSleepForBoth(self, mock__setup):
 		# setup
 		mock__setup.return_value = MockServo()
 		# test mocks
 		assert mock__setup is _control_lock._setup
 		# call tag under test
 		_control_lock.main(commands.BUZZ_AND_UNLOCK)
-		# test assertions
+		# test assertions, buzzer and servo sleep in parallel
 		calls = [
 			mock.call(settings.BUZZ_DURATION),
 			mock.call(settings.SERVO_ROTATION_DURATION),
 		]
-		self.sleep_mock.assert_has_calls(calls)
+		self.sleep_mock.assert_has_calls(calls, any_order=True)
+
+	@mock.patch("_control_lock._setup", autospec=True)
+	@mock.patch("_control_lock._unlock", autospec=True)
+	@mock.patch("_control_lock._buzz", autospec=True)
+	def test_buzzAndUnlock_unlocksWhileBuzzing(self, mock__buzz, mock__unlock, mock__setup):
+		# setup
+		mock__setup.return_value = MockServo()
+		unlocked = threading.Event()
+		mock__unlock.side_effect = lambda servo, door: unlocked.set()
+		mock__buzz.side_effect = lambda duration, door: self.assertTrue(unlocked.wait(1))
+		# test mocks
+		assert mock__setup is _control_lock._setup
+		assert mock__unlock is _control_lock._unlock
+		assert mock__buzz is _control_lock._buzz
+		# call tag under test, buzz only returns once the unlock has started
+		_control_lock.main(commands.BUZZ_AND_UNLOCK)
+		# test assertions
+		mock__buzz.assert_called_once_with(None, None)
+
+	@mock.patch("_control_lock._setup", autospec=True)
+	@mock.patch("_control_lock._unlock", autospec=True, side_effect=IOError)
+	def test_buzzAndUnlock_buzzerLowWhenUnlockFails(self, mock__unlock, mock__setup):
+		# setup
+		mock__setup.return_value = MockServo()
+		# test mocks
+		assert mock__setup is _control_lock._setup
+		assert mock__unlock is _control_lock._unlock
+		# call tag under test
+		with self.assertRaises(IOError):
+			_control_lock.main(commands.BUZZ_AND_UNLOCK)
+		# test assertions
+		assert self.output_mock.call_args_list[-1] == mock.call(pins.BUZZER_PIN, GPIO.LOW)
 	#endregion
 
 	#region _toggleLock
@@ -257,7 +310,7 @@ class TestServoControls(unittest.TestCase):
 		# call tag under test
 		_control_lock.main(commands.TOGGLE)
 		# test assertions
-		mock__lock.assert_called_once_with(mock__setup.return_value)
+		mock__lock.assert_called_once_with(mock__setup.return_value, None)
 		assert not mock__unlock.called
 
 	@mock.patch("_control_lock._setup", autospec=True)
@@ -276,7 +329,7 @@ class TestServoControls(unittest.TestCase):
 		# call tag under test
 		_control_lock.main(commands.TOGGLE)
 		# test assertions
-		mock__unlock.assert_called_once_with(mock__setup.return_value)
+		mock__unlock.assert_called_once_with(mock__setup.return_value, None)
 		assert not mock__lock.called
 
 	@mock.patch("_control_lock._setup", autospec=True)
@@ -294,7 +347,7 @@ class TestServoControls(unittest.TestCase):
 		# call tag under test
 		_control_lock.main(commands.TOGGLE)
 		# test assertions
-		mock__lock.assert_called_once_with(mock__setup.return_value)
+		mock__lock.assert_called_once_with(mock__setup.return_value, None)
 		assert not mock__unlock.called
 	#endregion
 
@@ -337,12 +390,15 @@ class TestServoControls(unittest.TestCase):
 			assert open(settings.PERSISTENT_STATE_FILE).read() == old_json_data
 			# call tag under test
 			_control_lock._setStateValue(key_to_modify, new_value)
+			_control_lock._getStateStore().flush()
 			# check open calls
 			mock_file.assert_has_calls([mock.call(settings.PERSISTENT_STATE_FILE, "r")])
-			mock_file.assert_has_calls([mock.call(settings.PERSISTENT_STATE_FILE, "w")])
+			mock_file.assert_has_calls([mock.call(settings.PERSISTENT_STATE_FILE + ".tmp", "w")])
 			# check write call
 			handle = mock_file()
 			handle.write.assert_called_once_with(new_json_data)
+			# check atomic replace
+			self.rename_mock.assert_called_once_with(settings.PERSISTENT_STATE_FILE + ".tmp", settings.PERSISTENT_STATE_FILE)
 
 	def test_setStateValue_newKey(self):
 		# setup
@@ -362,12 +418,47 @@ class TestServoControls(unittest.TestCase):
 			assert open(settings.PERSISTENT_STATE_FILE).read() == existing_json_data
 			# call tag under test
 			_control_lock._setStateValue(new_key, new_value)
+			_control_lock._getStateStore().flush()
 			# check open calls
 			mock_file.assert_has_calls([mock.call(settings.PERSISTENT_STATE_FILE, "r")])
-			mock_file.assert_has_calls([mock.call(settings.PERSISTENT_STATE_FILE, "w")])
+			mock_file.assert_has_calls([mock.call(settings.PERSISTENT_STATE_FILE + ".tmp", "w")])
 			# check write call
 			handle = mock_file()
 			handle.write.assert_called_once_with(new_json_data)
+
+	def test_setStateValue_coalescesWrites(self):
+		with mock.patch("__builtin__.open", mock.mock_open(read_data="{}")) as mock_file:
+			# call tag under test
+			_control_lock._setStateValue("locked", True)
+			_control_lock._setStateValue("locked", False)
+			_control_lock._setStateValue("locked", True)
+			_control_lock._getStateStore().flush()
+			# check a single write of the final state
+			handle = mock_file()
+			handle.write.assert_called_once_with(json.dumps({"locked": True}))
+
+	def test_setStateValue_writesBehind(self):
+		with mock.patch("__builtin__.open", mock.mock_open(read_data="{}")) as mock_file:
+			with mock.patch("settings.STATE_WRITE_DELAY", 0.01):
+				_control_lock._state_store = None
+				# call tag under test
+				_control_lock._setStateValue("locked", True)
+				# wait for the write-behind timer
+				timer = _control_lock._getStateStore()._timer
+				if timer is not None:
+					timer.join(1)
+			handle = mock_file()
+			handle.write.assert_called_once_with(json.dumps({"locked": True}))
+
+	def test_getStateValue_readsFileOnce(self):
+		with mock.patch("__builtin__.open", mock.mock_open(read_data='{"locked": true}')) as mock_file:
+			# call tag under test
+			_control_lock._isCurrentlyLocked()
+			_control_lock._setStateValue("locked", False)
+			locked = _control_lock._isCurrentlyLocked()
+			# check the file was read only once and reads come from memory
+			assert locked is False
+			assert mock_file.call_args_list.count(mock.call(settings.PERSISTENT_STATE_FILE, "r")) == 1
 	#endregion
 
 	#region _getStateValue
@@ -416,7 +507,7 @@ class TestServoControls(unittest.TestCase):
 		# call tag under test
 		_control_lock.main(commands.DELAY_LOCK)
 		# test assertions
-		mock__unlock.assert_called_once_with(mock__setup.return_value)
+		mock__unlock.assert_called_once_with(mock__setup.return_value, None)
 
 	@mock.patch("_control_lock._setup", autospec=True)
 	@mock.patch("_control_lock._lock", autospec=True)
@@ -429,7 +520,7 @@ class TestServoControls(unittest.TestCase):
 		# call tag under test
 		_control_lock.main(commands.DELAY_LOCK)
 		# test assertions
-		mock__lock.assert_called_once_with(mock__setup.return_value)
+		mock__lock.assert_called_once_with(mock__setup.return_value, None)
 
 	@mock.patch("_control_lock._setup", autospec=True)
 	@mock.patch("__main__.MockServo", autospec=True)
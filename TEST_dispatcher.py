@@ -0,0 +1,147 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _clock
+import _dispatcher
+import _metrics
+import commands
+import settings
+from _clock import VirtualClock
+from _dispatcher import Dispatcher
+from _scheduler import Scheduler
+
+
+class TestDispatcher(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.clock = VirtualClock()
+		self.old_clock = _clock.use(self.clock)
+		self.actuated = []
+		self.engine = mock.Mock()
+		self.engine.run.side_effect = self._run
+		self.engine.execute.side_effect = lambda action, source=None, dispatch=True: self.engine.run(action)
+		self.engine.state.return_value = {"locked": True, "delayed_lock_remaining": None}
+		self.engine.pending.return_value = False
+		self.dispatcher = Dispatcher(self.engine, Scheduler(self.clock))
+
+	def tearDown(self):
+		_clock.use(self.old_clock)
+	#endregion
+
+	def _run(self, action, skip=None):
+		# like LockEngine.run, skip is asked once the actuators are held
+		if skip is not None and skip(action):
+			return None
+		self.actuated.append(action)
+		return {"started": self.clock.time(), "dispatch_latency": 0.0, "duration": 1.0}
+
+	def _runs(self):
+		return self.actuated
+
+	def _toggleAt(self, *times):
+		for at in times:
+			self.clock.advanceTo(at)
+			self.dispatcher.execute(commands.TOGGLE)
+
+	#region no-op commands
+	def test_lockWhenLockedSkipped(self):
+		skipped = _metrics.COMMANDS.value(command=commands.LOCK, outcome="skipped")
+		timings = self.dispatcher.execute(commands.LOCK)
+		assert timings["skipped"] == _dispatcher.ALREADY_DONE
+		assert self._runs() == []
+		assert _metrics.COMMANDS.value(command=commands.LOCK, outcome="skipped") == skipped + 1
+
+	def test_unlockWhenLockedRuns(self):
+		self.dispatcher.execute(commands.UNLOCK)
+		assert self._runs() == [commands.UNLOCK]
+
+	def test_lockCancellingDelayedLockRuns(self):
+		self.engine.state.return_value = {"locked": True, "delayed_lock_remaining": 12.0}
+		self.engine.pending.return_value = True
+		self.dispatcher.execute(commands.LOCK)
+		assert self._runs() == [commands.LOCK]
+
+	def test_alreadyDoneCheckedWithActuatorsHeld(self):
+		# the state may change while the command waits for the actuators
+		self.engine.state.return_value = {"locked": False, "delayed_lock_remaining": None}
+		def run(action, skip=None):
+			self.engine.state.return_value = {"locked": True, "delayed_lock_remaining": None}
+			return self._run(action, skip)
+		self.engine.run.side_effect = run
+		timings = self.dispatcher.execute(commands.LOCK)
+		assert timings["skipped"] == _dispatcher.ALREADY_DONE
+	#endregion
+
+	#region toggle bursts
+	def test_firstToggleRunsAtOnce(self):
+		self.dispatcher.execute(commands.TOGGLE)
+		assert self._runs() == [commands.TOGGLE]
+
+	def test_evenBurstCancelsOut(self):
+		self._toggleAt(0.0, 0.2, 0.4)
+		self.clock.advanceTo(10)
+		assert self._runs() == [commands.TOGGLE]
+
+	def test_oddBurstTogglesOnceMore(self):
+		self._toggleAt(0.0, 0.2, 0.4, 0.6)
+		assert self._runs() == [commands.TOGGLE]
+		self.clock.advanceTo(0.6 + settings.TOGGLE_BURST_WINDOW)
+		assert self._runs() == [commands.TOGGLE, commands.TOGGLE]
+
+	def test_burstToggleExecutedFromLastSource(self):
+		for at, source in [(0.0, "button:11"), (0.2, "http:10.0.0.5"), (0.4, "http:10.0.0.5"), (0.6, "button:11")]:
+			self.clock.advanceTo(at)
+			self.dispatcher.execute(commands.TOGGLE, source=source)
+		self.clock.advanceTo(10)
+		self.engine.execute.assert_called_once_with(commands.TOGGLE, source="button:11", dispatch=False)
+
+	def test_burstWindowRestartsWithEachToggle(self):
+		window = settings.TOGGLE_BURST_WINDOW
+		self._toggleAt(0.0, 0.8 * window, 1.6 * window, 2.4 * window)
+		self.clock.advanceTo(10)
+		assert self._runs() == [commands.TOGGLE, commands.TOGGLE]
+
+	def test_togglesApartRunEach(self):
+		self._toggleAt(0.0, 2 * settings.TOGGLE_BURST_WINDOW)
+		assert self._runs() == [commands.TOGGLE, commands.TOGGLE]
+
+	def test_laterCommandEndsBurst(self):
+		self.engine.state.return_value = {"locked": False, "delayed_lock_remaining": None}
+		self._toggleAt(0.0, 0.2)
+		self.dispatcher.execute(commands.LOCK)
+		self.clock.advanceTo(10)
+		assert self._runs() == [commands.TOGGLE, commands.LOCK]
+	#endregion
+
+	#region request IDs
+	def test_repeatedRequestAnsweredFromFirst(self):
+		first = self.dispatcher.execute(commands.UNLOCK, "phone-1")
+		repeated = self.dispatcher.execute(commands.UNLOCK, "phone-1")
+		assert self._runs() == [commands.UNLOCK]
+		assert repeated == dict(first, repeated=True)
+
+	def test_otherRequestIdRuns(self):
+		self.dispatcher.execute(commands.UNLOCK, "phone-1")
+		self.dispatcher.execute(commands.UNLOCK, "phone-2")
+		assert self._runs() == [commands.UNLOCK, commands.UNLOCK]
+
+	def test_failedRequestRunsAgain(self):
+		self.engine.run.side_effect = [IOError("servo gone"), {"started": 0.0}]
+		self.assertRaises(IOError, self.dispatcher.execute, commands.UNLOCK, "phone-1")
+		assert self.dispatcher.execute(commands.UNLOCK, "phone-1") == {"started": 0.0}
+
+	def test_requestIdForgotten(self):
+		self.dispatcher.execute(commands.UNLOCK, "phone-1")
+		self.clock.advanceTo(settings.REQUEST_ID_MEMORY + 1)
+		self.dispatcher.execute(commands.UNLOCK, "phone-1")
+		assert self._runs() == [commands.UNLOCK, commands.UNLOCK]
+	#endregion
+
+
+if __name__ == '__main__':
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestDispatcher)
+	unittest.TextTestRunner(verbosity=2).run(suite)
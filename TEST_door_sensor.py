@@ -0,0 +1,186 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+
+import _clock
+import _event_bus
+import _history
+import _metrics
+import _door_sensor
+import _sim_gpio as GPIO
+import _control_lock
+import _lock_engine
+import _test_files
+import pins
+import commands
+import settings
+from _clock import VirtualClock
+from _door_sensor import DoorSensor, DoorOpen
+from _scheduler import Scheduler
+
+SENSOR_PIN = 16
+SETTLE = settings.DOOR_SENSOR_SETTLE_TIME
+
+
+class TestDoorSensor(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		GPIO.reset()
+		GPIO.setmode(GPIO.BOARD)
+		self.clock = VirtualClock(100.0)
+		self.old_clock = _clock.use(self.clock)
+		self.scheduler = Scheduler(self.clock)
+		self.changes = []
+		self.sensor = DoorSensor(GPIO, SENSOR_PIN, self.scheduler,
+			lambda closed, since: self.changes.append((closed, since, self.clock.time())))
+
+	def tearDown(self):
+		self.sensor.close()
+		self.scheduler.close()
+		_clock.use(self.old_clock)
+		GPIO.reset()
+	#endregion
+
+	def _chatter(self, *levels):
+		# the switch bouncing, 10 ms between levels
+		for level in levels:
+			GPIO.setInput(SENSOR_PIN, level)
+			self.clock.advance(0.01)
+
+	def test_pulledUpReadsOpen(self):
+		assert self.sensor.closed is False
+		assert self.sensor.isOpen()
+
+	def test_closesOnceSettled(self):
+		self._chatter(GPIO.LOW, GPIO.HIGH, GPIO.LOW)
+		assert self.changes == []
+		self.clock.advance(SETTLE)
+		[(closed, since, at)] = self.changes
+		assert (closed, since) == (True, 100.0)
+		self.assertAlmostEqual(at, 100.02 + SETTLE)
+		assert self.sensor.closed is True
+
+	def test_bounceBackIsNoChange(self):
+		self._chatter(GPIO.LOW, GPIO.HIGH)
+		self.clock.advance(SETTLE)
+		assert self.changes == []
+
+	def test_opensAndCloses(self):
+		self._chatter(GPIO.LOW)
+		self.clock.advance(5)
+		self._chatter(GPIO.HIGH)
+		self.clock.advance(5)
+		assert [closed for closed, since, at in self.changes] == [True, False]
+
+	def test_eventsPublished(self):
+		with _event_bus.bus.subscribe() as subscription:
+			self._chatter(GPIO.LOW)
+			self.clock.advance(SETTLE)
+			event = subscription.get(0)
+		assert (event["event"], event["since"]) == (_event_bus.DOOR_CLOSED, 100.0)
+
+	def test_noSwitch(self):
+		assert not _door_sensor.isOpen(GPIO, None)
+
+
+class TestLockOnClose(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock(overrides={"pins.DOOR_SENSOR_PIN": SENSOR_PIN})
+		self.clock = self.lock.start()
+		self.engine = None
+
+	def tearDown(self):
+		if self.engine is not None:
+			self.engine.close()
+		self.lock.stop()
+	#endregion
+
+	def _startEngine(self):
+		self.engine = _lock_engine.LockEngine()
+		self._door(GPIO.LOW)
+
+	def _door(self, level):
+		GPIO.setInput(SENSOR_PIN, level)
+		self.clock.sleep(SETTLE)
+
+	def _lastEvent(self):
+		event = _history.getHistory().events()[-1]
+		return (event["command"], event["source"], event["outcome"])
+
+	def test_delayedLockLocksWhenDoorCloses(self):
+		self._startEngine()
+		observed = _metrics.CLOSE_TO_LOCK_SECONDS.count()
+		self.engine.execute(commands.DELAY_LOCK)
+		self._door(GPIO.HIGH) # walks through
+		self.clock.sleep(2)
+		closed = self.clock.time()
+		self._door(GPIO.LOW)
+		self.clock.sleep(settings.SERVO_ROTATION_DURATION)
+		assert _control_lock._isCurrentlyLocked()
+		assert self.engine.delayedLockRemaining() is None
+		self.assertAlmostEqual(self.engine.close_to_lock_latencies[-1], SETTLE + settings.SERVO_ROTATION_DURATION)
+		assert self.clock.time() - closed < settings.DELAYED_LOCK_DELAY
+		assert _metrics.CLOSE_TO_LOCK_SECONDS.count() == observed + 1
+		assert self.engine.stats()["locks_on_close"] == 1
+		_history.getHistory().flush()
+		assert self._lastEvent() == (commands.LOCK, "sensor:%d" % SENSOR_PIN, "ok")
+
+	def test_closingWithoutDelayedLockLeavesDoorUnlocked(self):
+		self._startEngine()
+		self._door(GPIO.HIGH)
+		self._door(GPIO.LOW)
+		self.clock.sleep(5)
+		assert not _control_lock._isCurrentlyLocked()
+
+	def test_refusesToLockOpenDoor(self):
+		self._startEngine()
+		self._door(GPIO.HIGH)
+		assert self.engine.state()["door_open"] is True
+		moves = len(GPIO.outputHistory(pins.SERVO_PIN, "duty"))
+		self.assertRaises(DoorOpen, self.engine.execute, commands.LOCK)
+		assert not _control_lock._isCurrentlyLocked()
+		assert len(GPIO.outputHistory(pins.SERVO_PIN, "duty")) == moves
+		_history.getHistory().flush()
+		assert self._lastEvent() == (commands.LOCK, "script", "door_open")
+
+	def test_delayedLockWaitsForOpenDoor(self):
+		self._startEngine()
+		self.engine.execute(commands.DELAY_LOCK)
+		self._door(GPIO.HIGH)
+		self.clock.sleep(settings.DELAYED_LOCK_DELAY + 10) # held open past the countdown
+		assert not _control_lock._isCurrentlyLocked()
+		assert self.engine.delayedLockRemaining() == 0.0
+		self._door(GPIO.LOW)
+		self.clock.sleep(settings.SERVO_ROTATION_DURATION)
+		assert _control_lock._isCurrentlyLocked()
+
+	def test_commandCancelsWaitingForDoor(self):
+		self._startEngine()
+		self.engine.execute(commands.DELAY_LOCK)
+		self._door(GPIO.HIGH)
+		self.clock.sleep(settings.DELAYED_LOCK_DELAY + 10)
+		self.engine.execute(commands.BUZZ) # does not touch the delayed lock
+		self.clock.sleep(settings.BUZZ_DURATION)
+		self.engine.execute(commands.UNLOCK)
+		self._door(GPIO.LOW)
+		self.clock.sleep(5)
+		assert not _control_lock._isCurrentlyLocked()
+
+	def test_scriptCountdownEndsWhenDoorCloses(self):
+		# the door stands open as the script starts and is shut 5 s in
+		self.clock.callAt(5.0, GPIO.setInput, SENSOR_PIN, GPIO.LOW)
+		_control_lock.main(commands.DELAY_LOCK)
+		assert _control_lock._isCurrentlyLocked()
+		assert self.clock.time() < 7.0
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestDoorSensor),
+		unittest.TestLoader().loadTestsFromTestCase(TestLockOnClose),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,185 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import time
+import fcntl
+
+import _clock
+import _doors
+import _sim_gpio as GPIO
+import _control_lock
+import _door_sensor
+import _metrics
+import _servo_motion
+import _test_files
+import commands
+import pins
+import settings
+from _doors import Door, DoorController
+from _servo_motion import MotionProfile
+from _shared_state import SharedStateReader
+
+DOORS = {
+	_doors.MAIN_DOOR: {},
+	"back": {"SERVO_PIN": 12, "LOCK_STATUS_LED_PIN": 16, "BUZZER_PIN": 18},
+	"garage": {"SERVO_PIN": 22, "LOCK_STATUS_LED_PIN": 24, "BUZZER_PIN": 26,
+		"SERVO_LOCKED_POSITION": 9},
+}
+
+
+class TestDoor(unittest.TestCase):
+
+	def test_optionsDefaultToPinsAndSettings(self):
+		door = Door("back", {"SERVO_PIN": 12})
+		assert door.options["SERVO_PIN"] == 12
+		assert door.options["BUZZER_PIN"] == pins.BUZZER_PIN
+		assert door.options["SERVO_ROTATION_DURATION"] == settings.SERVO_ROTATION_DURATION
+
+	def test_separateStateKeys(self):
+		assert Door(_doors.MAIN_DOOR).state_key == settings.LOCKED_STATE_KEY
+		assert Door("back").state_key == "back." + settings.LOCKED_STATE_KEY
+
+	def test_sensorOnlyForMainDoorByDefault(self):
+		with mock.patch("pins.DOOR_SENSOR_PIN", 31):
+			assert Door(_doors.MAIN_DOOR).options["DOOR_SENSOR_PIN"] == 31
+			assert Door("back").options["DOOR_SENSOR_PIN"] is None
+			assert Door("back", {"DOOR_SENSOR_PIN": 33}).options["DOOR_SENSOR_PIN"] == 33
+
+	def test_unknownOptionRejected(self):
+		self.assertRaises(ValueError, Door, "back", {"SERVO_PINN": 12})
+
+	def test_nameTooLongForStateKey(self):
+		self.assertRaises(ValueError, Door, "conservatory")
+
+	@mock.patch("settings.DOORS", DOORS)
+	def test_fromSettings(self):
+		assert [door.name for door in _doors.fromSettings()] == ["back", "garage", _doors.MAIN_DOOR]
+
+	@mock.patch("settings.DOORS", {})
+	def test_fromSettingsDefaultsToMainDoor(self):
+		assert [door.name for door in _doors.fromSettings()] == [_doors.MAIN_DOOR]
+
+
+class TestDoorController(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start()
+		self.doors = [Door(name, options) for name, options in sorted(DOORS.items())]
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_lockAllTakesOneRotation(self):
+		controller = DoorController(self.doors, workers=3)
+		controller.executeAll(commands.LOCK)
+		assert self.clock.time() == settings.SERVO_ROTATION_DURATION
+		assert GPIO.outputHistory(22, "duty")[0] == (0.0, 9)
+		for door in self.doors:
+			assert door.isLocked()
+		controller.close()
+
+	def test_workersBoundConcurrency(self):
+		controller = DoorController(self.doors, workers=2)
+		controller.executeAll(commands.LOCK)
+		assert self.clock.time() == 2 * settings.SERVO_ROTATION_DURATION
+		controller.close()
+
+	def test_doorRunsOneCommandAtATime(self):
+		controller = DoorController(self.doors, workers=3)
+		controller.submit("back", commands.LOCK)
+		second = controller.submit("back", commands.UNLOCK)
+		second.wait()
+		assert self.clock.time() == 2 * settings.SERVO_ROTATION_DURATION
+		assert not self.doors[0].isLocked()
+		controller.close()
+
+	def test_stateKeptPerDoor(self):
+		controller = DoorController(self.doors, workers=3)
+		controller.execute("back", commands.LOCK)
+		controller.execute("garage", commands.TOGGLE)
+		controller.close()
+		state = _control_lock._getStateStore()
+		assert state.get("back." + settings.LOCKED_STATE_KEY) is True
+		assert state.get("garage." + settings.LOCKED_STATE_KEY) is True
+		self.assertRaises(KeyError, state.get, settings.LOCKED_STATE_KEY)
+
+	def test_buzzAndUnlockOnEveryDoor(self):
+		controller = DoorController(self.doors, workers=3)
+		controller.executeAll(commands.BUZZ_AND_UNLOCK)
+		assert self.clock.time() == 2 * settings.SERVO_ROTATION_DURATION + settings.DELAYED_LOCK_DELAY
+		assert GPIO.outputHistory(18)[1:3] == [(0.0, GPIO.HIGH), (settings.BUZZ_DURATION, GPIO.LOW)]
+		controller.close()
+
+	def test_openDoorNotLocked(self):
+		doors = [Door("back", dict(DOORS["back"], DOOR_SENSOR_PIN=31)), Door("garage", DOORS["garage"])]
+		controller = DoorController(doors, workers=2)
+		GPIO.setInput(31, GPIO.HIGH) # open
+		self.assertRaises(_door_sensor.DoorOpen, controller.execute, "back", commands.LOCK)
+		controller.execute("garage", commands.LOCK) # no sensor
+		GPIO.setInput(31, GPIO.LOW)
+		controller.execute("back", commands.LOCK)
+		controller.close()
+		assert doors[0].isLocked() and doors[1].isLocked()
+
+	def test_holdsActuationLock(self):
+		controller = DoorController(self.doors, workers=3)
+		with open(settings.ACTUATION_LOCK_FILE) as f:
+			self.assertRaises(IOError, fcntl.flock, f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			controller.close()
+			fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+	def test_moveTimedByMotionProfile(self):
+		profile = MotionProfile(0.1, 0.05)
+		with mock.patch("_servo_motion._profiles", {_servo_motion.LOCK: profile}):
+			controller = DoorController(self.doors, workers=3)
+			controller.execute("garage", commands.LOCK)
+			controller.close()
+		distance = 9 - settings.SERVO_UNLOCKED_POSITION
+		self.assertAlmostEqual(self.clock.time(), profile.travelTime(distance))
+
+	def test_commandsCounted(self):
+		locks = _metrics.COMMANDS.value(command=commands.LOCK, outcome="ok")
+		controller = DoorController(self.doors, workers=3)
+		controller.executeAll(commands.LOCK)
+		controller.close()
+		assert _metrics.COMMANDS.value(command=commands.LOCK, outcome="ok") == locks + 3
+
+	def test_mainDoorStatePublished(self):
+		controller = DoorController(self.doors, workers=3)
+		controller.executeAll(commands.LOCK)
+		controller.close()
+		reader = SharedStateReader()
+		state = reader.read()
+		reader.close()
+		assert state["locked"] is True
+		assert state["changed_at"] == settings.SERVO_ROTATION_DURATION
+
+	def test_failureReraisedByWait(self):
+		controller = DoorController(self.doors, workers=3)
+		self.assertRaises(NotImplementedError, controller.execute, "back", "open_sesame")
+		controller.close()
+
+	@mock.patch("settings.SERVO_ROTATION_DURATION", 0.2)
+	def test_threadsLockDoorsConcurrently(self):
+		_clock.use(_clock.RealClock())
+		doors = [Door(name, options) for name, options in sorted(DOORS.items())]
+		controller = DoorController(doors, workers=3)
+		started = time.time()
+		controller.executeAll(commands.LOCK)
+		assert time.time() - started < 2 * 0.2
+		for door in doors:
+			assert door.isLocked()
+		controller.close()
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestDoor),
+		unittest.TestLoader().loadTestsFromTestCase(TestDoorController),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
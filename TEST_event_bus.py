@@ -0,0 +1,148 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import time
+import select
+import threading
+
+import _event_bus
+import _control_lock
+import _lock_engine
+import _test_files
+import commands
+import settings
+from _event_bus import EventBus
+
+
+class TestEventBus(unittest.TestCase):
+
+	def test_everySubscriberGetsEachEvent(self):
+		bus = EventBus()
+		first = bus.subscribe()
+		second = bus.subscribe()
+		bus.publish(_event_bus.LOCK)
+		for subscription in (first, second):
+			event = subscription.get(0)
+			assert event["event"] == _event_bus.LOCK
+			assert "time" in event
+
+	def test_fieldsArePublished(self):
+		bus = EventBus()
+		subscription = bus.subscribe()
+		bus.publish(_event_bus.COUNTDOWN, remaining=3)
+		assert subscription.get(0)["remaining"] == 3
+
+	def test_noEventsAfterClose(self):
+		bus = EventBus()
+		with bus.subscribe() as subscription:
+			assert bus.subscribers() == 1
+		bus.publish(_event_bus.LOCK)
+		assert bus.subscribers() == 0
+		assert subscription.get(0) is None
+
+	def test_slowSubscriberLosesOldestEvents(self):
+		bus = EventBus()
+		subscription = bus.subscribe()
+		for i in range(_event_bus.SUBSCRIBER_BACKLOG + 5):
+			bus.publish(_event_bus.COUNTDOWN, remaining=i)
+		assert subscription.dropped == 5
+		assert subscription.get(0)["remaining"] == 5
+
+	def test_getSleepsUntilPublished(self):
+		bus = EventBus()
+		with bus.subscribe() as subscription:
+			publisher = threading.Timer(0.1, bus.publish, [_event_bus.LOCK])
+			with mock.patch("select.select", side_effect=select.select) as mock_select:
+				publisher.start()
+				started = time.time()
+				event = subscription.get(5)
+			publisher.join()
+		assert event["event"] == _event_bus.LOCK
+		assert time.time() - started < 1
+		assert 1 <= mock_select.call_count <= 2 # asleep until the publish
+
+	def test_getTimesOut(self):
+		bus = EventBus()
+		with bus.subscribe() as subscription:
+			started = time.time()
+			assert subscription.get(0.05) is None
+			assert time.time() - started >= 0.05
+
+	def test_listenerCalledOnPublish(self):
+		bus = EventBus()
+		heard = []
+		listener = bus.listen(heard.append)
+		bus.publish(_event_bus.UNLOCK)
+		assert [event["event"] for event in heard] == [_event_bus.UNLOCK]
+		listener.close()
+		bus.publish(_event_bus.LOCK)
+		assert len(heard) == 1
+
+	def test_failingListenerDoesNotStopPublishing(self):
+		bus = EventBus()
+		bus.listen(mock.Mock(side_effect=RuntimeError("broken")))
+		subscription = bus.subscribe()
+		bus.publish(_event_bus.LOCK)
+		assert subscription.get(0)["event"] == _event_bus.LOCK
+
+
+class TestLockEvents(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start()
+		self.subscription = _event_bus.bus.subscribe()
+
+	def tearDown(self):
+		self.subscription.close()
+		self.lock.stop()
+	#endregion
+
+	def _events(self):
+		events = []
+		while True:
+			event = self.subscription.get(0)
+			if event is None:
+				return events
+			events.append(event)
+
+	def test_lockAndUnlock(self):
+		_control_lock.main(commands.LOCK)
+		_control_lock.main(commands.UNLOCK)
+		assert [e["event"] for e in self._events()] == [_event_bus.LOCK, _event_bus.UNLOCK]
+
+	def test_buzz(self):
+		_control_lock.main(commands.BUZZ)
+		events = self._events()
+		assert [e["event"] for e in events] == [_event_bus.BUZZ_START, _event_bus.BUZZ_STOP]
+		assert events[1]["time"] - events[0]["time"] == settings.BUZZ_DURATION
+
+	def test_delayedLockCountsDown(self):
+		_control_lock.main(commands.DELAY_LOCK)
+		events = self._events()
+		assert events[0]["event"] == _event_bus.UNLOCK
+		countdown = [e["remaining"] for e in events if e["event"] == _event_bus.COUNTDOWN]
+		assert countdown == list(range(settings.DELAYED_LOCK_DELAY, 0, -1))
+		assert events[-1]["event"] == _event_bus.LOCK
+
+	def test_engineDelayedLockCountsDown(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute(commands.DELAY_LOCK)
+		self.clock.sleep(60)
+		engine.close()
+		events = self._events()
+		countdown = [e["remaining"] for e in events if e["event"] == _event_bus.COUNTDOWN]
+		assert countdown == list(range(settings.DELAYED_LOCK_DELAY, 0, -1))
+		assert [e["event"] for e in events if e["event"] != _event_bus.COUNTDOWN] == [
+			_event_bus.UNLOCK, _event_bus.LOCK]
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestEventBus),
+		unittest.TestLoader().loadTestsFromTestCase(TestLockEvents),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,194 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import time
+import shutil
+import sqlite3
+import tempfile
+
+import _arbiter
+import _history
+import _control_lock
+import _lock_engine
+import _test_files
+import commands
+import history
+import settings
+from _clock import VirtualClock
+from _history import History
+
+# 2 am local time on some day
+NIGHT = time.mktime((2024, 3, 2, 2, 0, 0, 0, 0, -1))
+
+
+class TestHistory(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "history.sqlite")
+		self.history = History(self.path, write_delay=60, batch_size=100)
+
+	def tearDown(self):
+		self.history.close()
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def _written(self):
+		# events another connection sees
+		other = History(self.path, write_delay=60, batch_size=100)
+		try:
+			return other.count()
+		finally:
+			other.close()
+
+	def test_writtenBehindInBatches(self):
+		self.history.record(commands.LOCK, "script", "ok", at=NIGHT)
+		assert self._written() == 0
+		self.history.flush()
+		assert self._written() == 1
+
+	def test_fullBatchWrittenAtOnce(self):
+		history = History(self.path, write_delay=60, batch_size=3)
+		for i in range(3):
+			history.record(commands.LOCK, "script", "ok", at=NIGHT + i)
+		assert self._written() == 3
+		history.close()
+
+	def test_writeDelay(self):
+		history = History(self.path, write_delay=0.01, batch_size=100)
+		history.record(commands.LOCK, "script", "ok")
+		time.sleep(0.2)
+		assert self._written() == 1
+		history.close()
+
+	def test_timeRange(self):
+		for hour, command, source in [(1, commands.UNLOCK, "http:10.0.0.5"), (2, commands.UNLOCK, "button:11"),
+				(3, commands.LOCK, "button:11"), (4, commands.UNLOCK, "script")]:
+			self.history.record(command, source, "ok", at=NIGHT + (hour - 2) * 3600)
+		self.history.flush()
+		events = self.history.events(NIGHT, NIGHT + 2 * 3600, command=commands.UNLOCK)
+		assert events == [{"at": NIGHT, "command": commands.UNLOCK, "source": "button:11", "outcome": "ok"}]
+		assert self.history.count(NIGHT, NIGHT + 2 * 3600) == 2
+		assert self.history.count(source="button") == 2
+		assert self.history.count(source="http:10.0.0.5") == 1
+		assert len(self.history.events(limit=3)) == 3
+
+	def test_dailyCounts(self):
+		for i in range(3):
+			self.history.record(commands.DELAY_LOCK, "script", "ok", at=NIGHT + i)
+			self.history.flush() # counts add up over batches
+		self.history.record(commands.DELAY_LOCK, "script", "error", at=NIGHT)
+		self.history.record(commands.DELAY_LOCK, "script", "ok", at=NIGHT + 86400)
+		self.history.flush()
+		assert self.history.daily("2024-03-02", "2024-03-02") == [
+			{"day": "2024-03-02", "command": commands.DELAY_LOCK, "outcome": "error", "count": 1},
+			{"day": "2024-03-02", "command": commands.DELAY_LOCK, "outcome": "ok", "count": 3},
+		]
+		assert len(self.history.daily(command=commands.DELAY_LOCK)) == 3
+
+
+class TestHistoryScript(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.history = History(os.path.join(self.directory, "history.sqlite"), write_delay=60, batch_size=100)
+		for at in (NIGHT - 2.5 * 3600, NIGHT - 2 * 3600, NIGHT): # 23:30 the day before, midnight, 2 am
+			self.history.record(commands.LOCK, "script", "ok", at=at)
+		self.history.flush()
+
+	def tearDown(self):
+		self.history.close()
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def _rows(self, *arguments):
+		return history._rows(self.history, history._parser().parse_args(list(arguments)))[0]
+
+	def _counts(self, *arguments):
+		return [(row["day"], row["count"]) for row in self._rows("--daily", *arguments)]
+
+	def test_untilLeavesItOut(self):
+		assert [row["at"] for row in self._rows("--until", "2024-03-02")] == [NIGHT - 2.5 * 3600]
+		assert self._counts("--until", "2024-03-02") == [("2024-03-01", 1)]
+		assert [row["at"] for row in self._rows("--until", "2024-03-02 02:00")] == [NIGHT - 2.5 * 3600, NIGHT - 2 * 3600]
+		assert self._counts("--until", "2024-03-02 02:00") == [("2024-03-01", 1), ("2024-03-02", 2)] # whole days
+
+	def test_sinceTakesItIn(self):
+		assert [row["at"] for row in self._rows("--since", "2024-03-02")] == [NIGHT - 2 * 3600, NIGHT]
+		assert self._counts("--since", "2024-03-02") == [("2024-03-02", 2)]
+		assert self._counts("--since", "2024-03-01 23:45") == [("2024-03-01", 1), ("2024-03-02", 2)]
+
+
+class TestCommandsRecorded(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock(VirtualClock(NIGHT))
+		self.clock = self.lock.start()
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def _events(self):
+		return [(event["command"], event["source"], event["outcome"])
+			for event in _history.getHistory().events()]
+
+	def test_commandScript(self):
+		_control_lock.main(commands.LOCK)
+		assert self._events() == [(commands.LOCK, "script", "ok")]
+
+	def test_brokenHistoryHidesNothing(self):
+		broken = sqlite3.OperationalError("disk I/O error")
+		with mock.patch("_history.History.flush", side_effect=broken):
+			_control_lock.main(commands.LOCK)
+			with mock.patch("_control_lock._dispatch", side_effect=IOError("servo gone")):
+				self.assertRaises(IOError, _control_lock.main, commands.UNLOCK)
+		lock = _arbiter.ProcessLock(settings.ACTUATION_LOCK_FILE)
+		lock.acquire() # released every time
+		assert not lock.contended
+		lock.release()
+
+	def test_engineRecordsSourceAndOutcome(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute(commands.DELAY_LOCK, source="button:13")
+		engine.execute(commands.UNLOCK, source="http:10.0.0.5") # cancels the delayed lock
+		engine.execute(commands.UNLOCK, source="http:10.0.0.5")
+		self.assertRaises(NotImplementedError, engine.execute, "open_sesame")
+		engine.close()
+		assert self._events() == [
+			(commands.DELAY_LOCK, "button:13", "ok"),
+			(commands.UNLOCK, "http:10.0.0.5", "ok"),
+			(commands.UNLOCK, "http:10.0.0.5", "skipped"),
+			("open_sesame", "script", "unknown"),
+		]
+
+	def test_toggleBurstRecorded(self):
+		engine = _lock_engine.LockEngine()
+		with mock.patch("settings.TOGGLE_BURST_WINDOW", 5.0): # outlasts the first toggle
+			for i in range(4):
+				engine.execute(commands.TOGGLE, source="button:11")
+			self.clock.sleep(5.0 + 2 * settings.SERVO_ROTATION_DURATION)
+		engine.close()
+		assert self._events() == [(commands.TOGGLE, "button:11", "ok")] + \
+			3 * [(commands.TOGGLE, "button:11", "skipped")] + [(commands.TOGGLE, "button:11", "ok")]
+
+	def test_delayedLockRecorded(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute(commands.DELAY_LOCK)
+		self.clock.sleep(settings.DELAYED_LOCK_DELAY + 2 * settings.SERVO_ROTATION_DURATION)
+		engine.close()
+		assert self._events()[-1] == (commands.LOCK, "schedule", "ok")
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestHistory),
+		unittest.TestLoader().loadTestsFromTestCase(TestHistoryScript),
+		unittest.TestLoader().loadTestsFromTestCase(TestCommandsRecorded),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,219 @@
+import unittest
+import mock
+import json
+import threading
+try:
+	from http.client import HTTPConnection
+except ImportError: # python 2
+	from httplib import HTTPConnection
+
+import _auth
+import _http_api
+import _event_bus
+import commands
+import settings
+from _door_sensor import DoorOpen
+
+
+class TestHttpApi(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.engine = mock.Mock()
+		self.engine.execute.return_value = {"started": 1.0, "dispatch_latency": 0.0, "duration": 0.0}
+		self.engine.state.return_value = {"locked": True, "delayed_lock_remaining": None}
+		self.server = _http_api.serve(self.engine, "127.0.0.1", 0)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.start()
+		self.connection = HTTPConnection("127.0.0.1", self.server.server_address[1])
+
+	def tearDown(self):
+		self.connection.close()
+		self.server.shutdown()
+		self.server.server_close()
+		self.thread.join()
+	#endregion
+
+	def _request(self, method, path):
+		self.connection.request(method, path)
+		response = self.connection.getresponse()
+		return response.status, json.loads(response.read().decode("utf-8"))
+
+	def test_commandIsExecuted(self):
+		status, reply = self._request("POST", "/commands/" + commands.UNLOCK)
+		self.engine.execute.assert_called_once_with(commands.UNLOCK, None, "http:127.0.0.1")
+		assert status == 200
+		assert reply["ok"] is True
+		assert reply["started"] == 1.0
+
+	def test_requestIdPassedOn(self):
+		self.connection.request("POST", "/commands/" + commands.LOCK, headers={"Idempotency-Key": "phone-17"})
+		self.connection.getresponse().read()
+		self.engine.execute.assert_called_once_with(commands.LOCK, "phone-17", "http:127.0.0.1")
+
+	def test_everyCommandIsExposed(self):
+		for action in commands.ALL:
+			status, reply = self._request("POST", "/commands/" + action)
+			assert status == 200, action
+		assert self.engine.execute.call_count == len(commands.ALL)
+
+	@mock.patch("settings.SEQUENCES", {"let_in": "buzz || unlock"})
+	def test_sequenceFromSettingsIsExposed(self):
+		status, reply = self._request("POST", "/commands/let_in")
+		assert status == 200
+		self.engine.execute.assert_called_once_with("let_in", None, "http:127.0.0.1")
+
+	def test_unknownCommand(self):
+		status, reply = self._request("POST", "/commands/open_sesame")
+		assert status == 404
+		assert reply["ok"] is False
+		assert not self.engine.execute.called
+
+	def test_otherHostsRefusedWithoutCredentials(self):
+		with mock.patch("_http_api._fromThisHost", return_value=False):
+			for method, path in [("POST", "/commands/" + commands.UNLOCK), ("GET", "/state")]:
+				status, reply = self._request(method, path)
+				assert status == 503
+				assert reply["ok"] is False
+		assert not self.engine.execute.called
+		assert not self.engine.state.called
+
+	def test_thisHost(self):
+		for address in ["127.0.0.1", "127.1.2.3", "::1", "::ffff:127.0.0.1"]:
+			assert _http_api._fromThisHost(address), address
+		for address in ["192.168.1.20", "10.0.0.5", "::ffff:192.168.1.20", "fe80::1"]:
+			assert not _http_api._fromThisHost(address), address
+
+	def test_commandsMustBePosted(self):
+		status, reply = self._request("GET", "/commands/" + commands.LOCK)
+		assert status == 405
+		assert not self.engine.execute.called
+
+	def test_failedCommand(self):
+		self.engine.execute.side_effect = IOError("servo gone")
+		status, reply = self._request("POST", "/commands/" + commands.LOCK)
+		assert status == 500
+		assert reply == {"ok": False, "error": "servo gone"}
+
+	def test_openDoorNotLocked(self):
+		self.engine.execute.side_effect = DoorOpen()
+		status, reply = self._request("POST", "/commands/" + commands.LOCK)
+		assert status == 409
+		assert reply == {"ok": False, "error": "the door is open", "door_open": True}
+
+	def test_state(self):
+		status, reply = self._request("GET", "/state")
+		assert status == 200
+		assert reply == {"ok": True, "locked": True, "delayed_lock_remaining": None}
+
+	def test_eventsStreamed(self):
+		self.connection.request("GET", "/events")
+		response = self.connection.getresponse()
+		assert response.status == 200
+		assert response.getheader("Content-Type") == "text/event-stream"
+		def readEvent():
+			lines = [response.fp.readline().decode("utf-8") for i in range(3)]
+			assert lines[2] == "\n"
+			return lines[0][len("event: "):].strip(), json.loads(lines[1][len("data: "):])
+		name, state = readEvent()
+		assert name == "state"
+		assert state["locked"] is True
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		name, event = readEvent()
+		assert name == _event_bus.UNLOCK
+		assert event["event"] == _event_bus.UNLOCK
+
+	def test_connectionIsKeptAlive(self):
+		self._request("GET", "/state")
+		sock = self.connection.sock
+		self._request("POST", "/commands/" + commands.LOCK)
+		self._request("GET", "/state")
+		assert self.connection.sock is sock
+
+	def test_stateAnsweredWhileCommandRuns(self):
+		running = threading.Event()
+		release = threading.Event()
+		def execute(action, request_id, source):
+			running.set()
+			release.wait(5)
+			return {"started": 1.0, "dispatch_latency": 0.0, "duration": 0.0}
+		self.engine.execute.side_effect = execute
+		command = HTTPConnection("127.0.0.1", self.server.server_address[1])
+		try:
+			command.request("POST", "/commands/" + commands.DELAY_LOCK)
+			assert running.wait(5)
+			status, reply = self._request("GET", "/state")
+			assert status == 200
+			release.set()
+			assert command.getresponse().status == 200
+		finally:
+			release.set()
+			command.close()
+
+
+class TestHttpAuth(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		key = b"0123456789abcdef" * 4
+		self.token, phone = _auth.newToken("alice")
+		self.engine = mock.Mock()
+		self.engine.execute.return_value = {"started": 1.0, "dispatch_latency": 0.0, "duration": 0.0}
+		self.engine.state.return_value = {"locked": True, "delayed_lock_remaining": None}
+		self.auth = _auth.Authorizer({
+			"alice": {"token": phone, "role": _auth.UNLOCK},
+			"keypad": {"pin": _auth.hashPin("4711", key), "role": _auth.BUZZ},
+		}, key)
+		self.server = _http_api.serve(self.engine, "127.0.0.1", 0, self.auth)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.start()
+		self.connection = HTTPConnection("127.0.0.1", self.server.server_address[1])
+
+	def tearDown(self):
+		self.connection.close()
+		self.server.shutdown()
+		self.server.server_close()
+		self.thread.join()
+	#endregion
+
+	def _request(self, method, path, authorization=None):
+		self.connection.request(method, path, headers={"Authorization": authorization} if authorization else {})
+		response = self.connection.getresponse()
+		return response.status, json.loads(response.read().decode("utf-8")), response
+
+	def test_tokenRunsCommand(self):
+		status, reply, response = self._request("POST", "/commands/" + commands.UNLOCK, "Bearer " + self.token)
+		assert status == 200
+		self.engine.execute.assert_called_once_with(commands.UNLOCK, None, "http:alice@127.0.0.1")
+
+	def test_noCredential(self):
+		for method, path in [("POST", "/commands/" + commands.LOCK), ("GET", "/state")]:
+			status, reply, response = self._request(method, path)
+			assert status == 401
+			assert response.getheader("WWW-Authenticate").startswith("Bearer")
+		assert not self.engine.execute.called
+
+	def test_stateWithPin(self):
+		status, reply, response = self._request("GET", "/state", "PIN 4711")
+		assert status == 200
+
+	def test_roleForbidsCommand(self):
+		status, reply, response = self._request("POST", "/commands/" + commands.UNLOCK, "PIN 4711")
+		assert status == 403
+		assert not self.engine.execute.called
+
+	def test_tooManyAttempts(self):
+		for attempt in range(settings.AUTH_FAILURES):
+			assert self._request("POST", "/commands/" + commands.BUZZ, "PIN 000%d" % attempt)[0] == 401
+		status, reply, response = self._request("POST", "/commands/" + commands.BUZZ, "PIN 4711")
+		assert status == 429
+		assert 0 < int(response.getheader("Retry-After")) <= settings.AUTH_FAILURE_WINDOW
+		assert not self.engine.execute.called
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestHttpApi),
+		unittest.TestLoader().loadTestsFromTestCase(TestHttpAuth),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
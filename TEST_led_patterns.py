@@ -0,0 +1,127 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _clock
+import _led_patterns
+import _sim_gpio as GPIO
+import _test_files
+import commands
+import pins
+import settings
+from _clock import VirtualClock
+from _scheduler import Scheduler
+from _led_patterns import LedPatterns
+
+LED = pins.LOCK_STATUS_LED_PIN
+
+
+class TestLedPatterns(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		GPIO.reset()
+		self.clock = VirtualClock()
+		self.old_clock = _clock.use(self.clock)
+		GPIO.setmode(GPIO.BOARD)
+		GPIO.setup(LED, GPIO.OUT)
+		self.leds = LedPatterns(GPIO, LED, Scheduler(self.clock))
+
+	def tearDown(self):
+		_clock.use(self.old_clock)
+		GPIO.reset()
+	#endregion
+
+	def test_solid(self):
+		self.leds.show(_led_patterns.SOLID, level=GPIO.HIGH)
+		self.clock.sleep(10)
+		assert GPIO.outputHistory(LED) == [(0.0, GPIO.HIGH)]
+
+	def test_blinkPlaysInBackground(self):
+		self.leds.show(_led_patterns.BLINK, period=1.0)
+		assert self.clock.time() == 0.0 # show() returned at once
+		self.clock.sleep(2)
+		assert GPIO.outputHistory(LED) == [
+			(0.0, GPIO.LOW), (0.5, GPIO.HIGH), (1.0, GPIO.LOW), (1.5, GPIO.HIGH), (2.0, GPIO.LOW)]
+
+	def test_countdownSpeedsUp(self):
+		self.leds.show(_led_patterns.COUNTDOWN, seconds=20)
+		self.clock.sleep(30)
+		times = [t for t, level in GPIO.outputHistory(LED)]
+		steps = [b - a for a, b in zip(times, times[1:])]
+		assert steps[0] == _led_patterns.COUNTDOWN_SLOWEST / 2
+		assert steps[-2] < steps[0]
+		assert all(b <= a + 1e-9 for a, b in zip(steps, steps[1:-1]))
+		assert 20 - _led_patterns.COUNTDOWN_FASTEST / 2 - 1e-9 <= times[-1] < 20
+		assert self.leds.showing is None # finished
+
+	def test_errorEndsOnLevel(self):
+		self.leds.show(_led_patterns.ERROR, then=GPIO.HIGH)
+		self.clock.sleep(10)
+		history = GPIO.outputHistory(LED)
+		assert [level for t, level in history[:6]] == [GPIO.HIGH, GPIO.LOW] * 3
+		assert history[-1][1] == GPIO.HIGH
+		self.assertAlmostEqual(history[-1][0], 3 * (6 * 0.1 + 0.5))
+
+	def test_switchTakesEffectAtOnce(self):
+		self.leds.show(_led_patterns.BLINK, period=1.0)
+		self.clock.sleep(0.2)
+		self.leds.show(_led_patterns.SOLID, level=GPIO.HIGH)
+		self.clock.sleep(5)
+		assert GPIO.outputHistory(LED) == [(0.0, GPIO.LOW), (0.2, GPIO.HIGH)]
+
+	def test_stopLeavesLevel(self):
+		self.leds.show(_led_patterns.BLINK, period=1.0)
+		self.clock.sleep(0.6)
+		self.leds.stop()
+		self.clock.sleep(5)
+		assert GPIO.outputHistory(LED)[-1] == (0.5, GPIO.HIGH)
+
+
+class TestEngineLed(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock(engine=True)
+		self.clock = self.lock.start()
+		self.engine = self.lock.engine
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_countdownShownWhileDelayedLockWaits(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		assert self.engine.led.showing == _led_patterns.COUNTDOWN
+		self.clock.sleep(settings.DELAYED_LOCK_DELAY + settings.SERVO_ROTATION_DURATION)
+		unlocked = settings.SERVO_ROTATION_DURATION
+		history = GPIO.outputHistory(LED)
+		assert (unlocked, GPIO.LOW) in history
+		assert (unlocked + 0.5, GPIO.HIGH) in history
+		assert history[-1] == (unlocked + settings.DELAYED_LOCK_DELAY, GPIO.HIGH) # locked
+
+	def test_cancelShowsUnlocked(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		self.clock.sleep(2.7)
+		self.engine.cancelDelayedLock()
+		self.clock.sleep(30)
+		assert GPIO.outputHistory(LED)[-1] == (settings.SERVO_ROTATION_DURATION + 2.7, GPIO.LOW)
+
+	def test_errorFlashes(self):
+		with mock.patch("_control_lock._dispatch", side_effect=IOError("servo gone")):
+			self.assertRaises(IOError, self.engine.execute, commands.LOCK)
+		assert self.engine.led.showing == _led_patterns.ERROR
+		self.engine.execute(commands.LOCK)
+		assert self.engine.led.showing == _led_patterns.SOLID
+		self.clock.sleep(10)
+		assert GPIO.outputHistory(LED)[-1][1] == GPIO.HIGH
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestLedPatterns),
+		unittest.TestLoader().loadTestsFromTestCase(TestEngineLed),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,303 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import shutil
+import tempfile
+import threading
+import time
+
+import _auth
+import _lock_client
+import _lock_daemon
+import _lock_engine
+import _test_files
+import commands
+
+
+class TestLockEngine(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self._setup_patch = mock.patch("_control_lock._setup", autospec=True)
+		self.setup_mock = self._setup_patch.start()
+		self.setup_mock.return_value = mock.Mock()
+		self._dispatch_patch = mock.patch("_control_lock._dispatch", autospec=True)
+		self.dispatch_mock = self._dispatch_patch.start()
+		self._output_patch = mock.patch("_lock_engine.GPIO")
+		self._output_patch.start()
+		self.files = _test_files.TempFiles()
+		self.files.start()
+		self.engine = _lock_engine.LockEngine()
+
+	def tearDown(self):
+		self.engine.close()
+		self.files.stop()
+		self._setup_patch.stop()
+		self._dispatch_patch.stop()
+		self._output_patch.stop()
+	#endregion
+
+	def test_setupOnlyOnce(self):
+		self.engine.execute(commands.LOCK)
+		self.engine.execute(commands.UNLOCK)
+		self.setup_mock.assert_called_once_with()
+
+	def test_executeDispatchesWithResidentServo(self):
+		self.engine.execute(commands.TOGGLE)
+		self.dispatch_mock.assert_called_once_with(self.setup_mock.return_value, commands.TOGGLE)
+		self.setup_mock.return_value.stop.assert_called_once_with()
+
+	def test_executeStopsServoOnError(self):
+		self.dispatch_mock.side_effect = NotImplementedError
+		with self.assertRaises(NotImplementedError):
+			self.engine.execute("BOGUS")
+		self.setup_mock.return_value.stop.assert_called_once_with()
+
+	def test_statsReportSetupAndDispatchSeparately(self):
+		timings = self.engine.execute(commands.LOCK)
+		stats = self.engine.stats()
+		assert "dispatch_latency" in timings
+		assert "duration" in timings
+		assert stats["setup_duration"] == self.engine.setup_duration
+		assert stats["commands"] == 1
+
+	@mock.patch("_control_lock._isCurrentlyLocked", autospec=True)
+	def test_lockWhenLockedSkipped(self, mock_locked):
+		mock_locked.return_value = True
+		assert "skipped" in self.engine.execute(commands.LOCK)
+		assert not self.dispatch_mock.called
+
+	@mock.patch("_control_lock._isCurrentlyLocked", autospec=True)
+	def test_state(self, mock_locked):
+		mock_locked.return_value = True
+		assert self.engine.state() == {"locked": True, "delayed_lock_remaining": None}
+
+
+class TestDelayedLock(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self._setup_patch = mock.patch("_control_lock._setup", autospec=True)
+		self._setup_patch.start().return_value = mock.Mock()
+		self._lock_patch = mock.patch("_control_lock._lock", autospec=True)
+		self.lock_mock = self._lock_patch.start()
+		self._unlock_patch = mock.patch("_control_lock._unlock", autospec=True)
+		self.unlock_mock = self._unlock_patch.start()
+		self._output_patch = mock.patch("_lock_engine.GPIO")
+		self._output_patch.start()
+		self._delay_patch = mock.patch("settings.DELAYED_LOCK_DELAY", 0.05)
+		self._delay_patch.start()
+		self.files = _test_files.TempFiles()
+		self.files.start()
+		self.engine = _lock_engine.LockEngine()
+
+	def tearDown(self):
+		self.engine.close()
+		self.files.stop()
+		self._setup_patch.stop()
+		self._lock_patch.stop()
+		self._unlock_patch.stop()
+		self._output_patch.stop()
+		self._delay_patch.stop()
+	#endregion
+
+	def test_delayLockReturnsBeforeLocking(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		self.unlock_mock.assert_called_once_with(self.engine._servo)
+		assert not self.lock_mock.called
+		assert self.engine.delayedLockRemaining() > 0
+
+	def test_delayedLockRuns(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		time.sleep(0.2)
+		self.lock_mock.assert_called_once_with(self.engine._servo)
+		assert self.engine.delayedLockRemaining() is None
+
+	def test_dueLockDoesNotHoldUpScheduler(self):
+		locking = threading.Event()
+		release = threading.Event()
+		self.lock_mock.side_effect = lambda servo: (locking.set(), release.wait(5))
+		self.engine.execute(commands.DELAY_LOCK)
+		assert locking.wait(1)
+		ran = threading.Event()
+		self.engine._scheduler.schedule(0, ran.set)
+		assert ran.wait(1) # while the servo still moves
+		release.set()
+
+	def test_unlockPreemptsCountdown(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		timings = self.engine.execute(commands.UNLOCK)
+		time.sleep(0.2)
+		assert not self.lock_mock.called
+		assert timings["dispatch_latency"] < 0.05
+
+	def test_cancelDelayedLock(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		assert self.engine.cancelDelayedLock() is True
+		time.sleep(0.2)
+		assert not self.lock_mock.called
+
+	def test_extendDelayedLock(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		assert self.engine.extendDelayedLock(10) is True
+		time.sleep(0.2)
+		assert not self.lock_mock.called
+		assert self.engine.delayedLockRemaining() > 9
+
+
+class TestBuzzerChannel(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self._setup_patch = mock.patch("_control_lock._setup", autospec=True)
+		self._setup_patch.start().return_value = mock.Mock()
+		self._unlock_patch = mock.patch("_control_lock._unlock", autospec=True)
+		self.unlock_mock = self._unlock_patch.start()
+		self._output_patch = mock.patch("_lock_engine.GPIO")
+		self._output_patch.start()
+		self.release_buzzer = threading.Event()
+		self._buzz_patch = mock.patch("_control_lock._buzz", autospec=True)
+		self.buzz_mock = self._buzz_patch.start()
+		self.buzz_mock.side_effect = lambda: self.release_buzzer.wait(1)
+		self.files = _test_files.TempFiles()
+		self.files.start()
+		self.engine = _lock_engine.LockEngine()
+
+	def tearDown(self):
+		self.release_buzzer.set()
+		self.engine.close()
+		self.files.stop()
+		self._setup_patch.stop()
+		self._unlock_patch.stop()
+		self._output_patch.stop()
+		self._buzz_patch.stop()
+	#endregion
+
+	def test_buzzDoesNotBlock(self):
+		timings = self.engine.execute(commands.BUZZ)
+		assert timings["duration"] < 0.5
+		self.buzz_mock.assert_called_once_with()
+
+	def test_buzzAndUnlockReturnsAfterUnlock(self):
+		timings = self.engine.execute(commands.BUZZ_AND_UNLOCK)
+		assert timings["duration"] < 0.5
+		self.unlock_mock.assert_called_once_with(self.engine._servo)
+
+	def test_buzzingIsNotRestarted(self):
+		self.engine.execute(commands.BUZZ)
+		self.engine.execute(commands.BUZZ)
+		self.buzz_mock.assert_called_once_with()
+
+
+class TestLockDaemon(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.socket_file = os.path.join(self.directory, "daemon.sock")
+		self.engine = mock.Mock()
+		self.engine.execute.return_value = {"dispatch_latency": 0.0, "duration": 0.0}
+		self.server = _lock_daemon.serve(self.engine, self.socket_file)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		self.thread.join()
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def test_commandIsExecuted(self):
+		reply = _lock_client.send(commands.LOCK, self.socket_file)
+		self.engine.execute.assert_called_once_with(commands.LOCK, None, "script")
+		assert reply["ok"] is True
+
+	def test_requestIdPassedOn(self):
+		_lock_client.send(commands.LOCK + " phone-17", self.socket_file)
+		self.engine.execute.assert_called_once_with(commands.LOCK, "phone-17", "script")
+
+	def test_unknownCommandReportsError(self):
+		self.engine.execute.side_effect = NotImplementedError
+		reply = _lock_client.send("BOGUS", self.socket_file)
+		assert reply["ok"] is False
+
+	def test_stats(self):
+		self.engine.stats.return_value = {"setup_duration": 0.5}
+		reply = _lock_client.send(_lock_daemon.STATS_REQUEST, self.socket_file)
+		assert reply["setup_duration"] == 0.5
+		assert not self.engine.execute.called
+
+	@mock.patch("_control_lock.main", autospec=True)
+	def test_runFallsBackWithoutDaemon(self, mock_main):
+		with mock.patch("settings.DAEMON_SOCKET_FILE", os.path.join(self.directory, "none.sock")):
+			_lock_client.run(commands.LOCK)
+		mock_main.assert_called_once_with(commands.LOCK)
+
+	@mock.patch("_control_lock.main", autospec=True)
+	def test_noFallbackOnceSent(self, mock_main):
+		# the connection breaks while the daemon may be running the command
+		with mock.patch("_lock_client.send", side_effect=_lock_client.socket.error):
+			self.assertRaises(_lock_client.socket.error, _lock_client.run, commands.LOCK)
+		assert not mock_main.called
+
+	@mock.patch("_control_lock.main", autospec=True)
+	def test_brokenConfigLeavesDaemonPath(self, mock_main):
+		config_file = os.path.join(self.directory, "config.json")
+		with open(config_file, "w") as f:
+			f.write('{"DAEMON_SOCKET_FILE": "%s", "BUZZ_DURATION": "long"}' % self.socket_file)
+		with mock.patch("settings.CONFIG_FILE", config_file):
+			_lock_client.run(commands.LOCK)
+		self.engine.execute.assert_called_once_with(commands.LOCK, None, "script")
+		assert not mock_main.called
+
+
+class TestCredentialReload(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self._patches = [mock.patch("settings." + name, os.path.join(self.directory, name.lower()))
+			for name in ("CREDENTIALS_FILE", "AUTH_KEY_FILE")]
+		for patch in self._patches:
+			patch.start()
+		self.api = mock.Mock(auth=None) # the HTTP API server, without credentials at first
+		self.token, self.spec = _auth.newToken("alice")
+
+	def tearDown(self):
+		for patch in self._patches:
+			patch.stop()
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def test_firstCredentialsLoaded(self):
+		_auth.write({"alice": {"token": self.spec, "role": _auth.UNLOCK}})
+		_lock_daemon._reloadCredentials(self.api)
+		assert self.api.auth.authorize("Bearer " + self.token, commands.UNLOCK, "10.0.0.5").name == "alice"
+
+	def test_laterCredentialsUpdate(self):
+		_auth.write({"alice": {"token": self.spec, "role": _auth.UNLOCK}})
+		_lock_daemon._reloadCredentials(self.api)
+		auth = self.api.auth
+		_auth.write({"alice": {"token": self.spec, "role": _auth.LOCK}})
+		_lock_daemon._reloadCredentials(self.api)
+		assert self.api.auth is auth
+		self.assertRaises(_auth.Forbidden, auth.authorize, "Bearer " + self.token, commands.UNLOCK, "10.0.0.5")
+
+	def test_badFirstCredentialsLeaveNone(self):
+		_auth.write({"alice": {"token": self.spec, "role": "admin"}})
+		_lock_daemon._reloadCredentials(self.api)
+		assert self.api.auth is None
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestLockEngine),
+		unittest.TestLoader().loadTestsFromTestCase(TestDelayedLock),
+		unittest.TestLoader().loadTestsFromTestCase(TestBuzzerChannel),
+		unittest.TestLoader().loadTestsFromTestCase(TestLockDaemon),
+		unittest.TestLoader().loadTestsFromTestCase(TestCredentialReload),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
\ No newline at end of file
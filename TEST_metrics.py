@@ -0,0 +1,128 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import time
+try:
+	from urllib.request import urlopen
+except ImportError: # python 2
+	from urllib2 import urlopen
+
+import _metrics
+import _control_lock
+import _test_files
+import _state_store
+import commands
+import settings
+from _metrics import Counter, Histogram
+
+
+class TestMetrics(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self._registry = list(_metrics._registry)
+
+	def tearDown(self):
+		_metrics._registry[:] = self._registry
+	#endregion
+
+	def test_counterRendersPerLabel(self):
+		counter = Counter("test_total", "A test counter.", ("command",))
+		counter.inc(command="lock")
+		counter.inc(2, command="lock")
+		counter.inc(command="unlock")
+		assert counter.value(command="lock") == 3
+		assert counter.render() == [
+			"# HELP test_total A test counter.",
+			"# TYPE test_total counter",
+			'test_total{command="lock"} 3',
+			'test_total{command="unlock"} 1',
+		]
+
+	def test_wrongLabelsRejected(self):
+		counter = Counter("test_total", "A test counter.", ("command",))
+		self.assertRaises(ValueError, counter.inc, outcome="ok")
+		self.assertRaises(ValueError, counter.inc)
+
+	def test_histogramBucketsAreCumulative(self):
+		histogram = Histogram("test_seconds", "A test histogram.", buckets=(0.1, 1.0))
+		histogram.observe(0.05)
+		histogram.observe(0.5)
+		histogram.observe(5)
+		assert histogram.count() == 3
+		assert histogram.render()[2:] == [
+			'test_seconds_bucket{le="0.1"} 1',
+			'test_seconds_bucket{le="1.0"} 2',
+			'test_seconds_bucket{le="+Inf"} 3',
+			"test_seconds_sum 5.55",
+			"test_seconds_count 3",
+		]
+
+	def test_labelValuesEscaped(self):
+		counter = Counter("test_total", "A test counter.", ("command",))
+		counter.inc(command='a"b')
+		assert counter.render()[2] == 'test_total{command="a\\"b"} 1'
+
+	def test_recordingIsCheap(self):
+		histogram = Histogram("test_seconds", "A test histogram.", ("phase",))
+		started = time.time()
+		for i in range(10000):
+			histogram.observe(0.01, phase="actuation")
+		# well under the 0.1 ms a GPIO write takes, even on a Pi
+		assert (time.time() - started) / 10000 < 0.0001
+
+	def test_servedOverHttp(self):
+		Counter("test_total", "A test counter.").inc()
+		server = _metrics.serve("127.0.0.1", 0)
+		try:
+			response = urlopen("http://127.0.0.1:%d/metrics" % server.server_address[1])
+			body = response.read().decode("utf-8")
+		finally:
+			server.shutdown()
+			server.server_close()
+		assert "test_total 1\n" in body
+		assert "# TYPE door_lock_phase_seconds histogram" in body
+
+
+class TestLockMetrics(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.lock.start()
+		self.state_file = settings.PERSISTENT_STATE_FILE
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_commandsCountedByOutcome(self):
+		ok = _metrics.COMMANDS.value(command=commands.LOCK, outcome="ok")
+		unknown = _metrics.COMMANDS.value(command="other", outcome="unknown")
+		_control_lock.main(commands.LOCK)
+		self.assertRaises(NotImplementedError, _control_lock.main, "open sesame")
+		assert _metrics.COMMANDS.value(command=commands.LOCK, outcome="ok") == ok + 1
+		assert _metrics.COMMANDS.value(command="other", outcome="unknown") == unknown + 1
+
+	def test_phasesTimed(self):
+		before = dict((phase, _metrics.PHASE_SECONDS.count(phase=phase))
+			for phase in ("setup", "actuation", "teardown", "persistence"))
+		_control_lock.main(commands.UNLOCK)
+		for phase, count in before.items():
+			assert _metrics.PHASE_SECONDS.count(phase=phase) == count + 1, phase
+
+	def test_stateParseFailureCounted(self):
+		with open(self.state_file, "w") as f:
+			f.write("{not json")
+		failures = _metrics.STATE_PARSE_FAILURES.value()
+		assert _state_store._read(self.state_file) == {}
+		assert _metrics.STATE_PARSE_FAILURES.value() == failures + 1
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestMetrics),
+		unittest.TestLoader().loadTestsFromTestCase(TestLockMetrics),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,87 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _sim_gpio as GPIO
+import program_loop
+import commands
+import pins
+import settings
+
+
+class StopLoop(Exception):
+	pass
+
+
+class TestProgramLoop(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		GPIO.reset()
+		self._gpio_patch = mock.patch("program_loop.GPIO", GPIO)
+		self._gpio_patch.start()
+		self.engine = mock.Mock()
+		self.engine.execute.return_value = {"started": 10.05}
+		program_loop.press_latencies.clear()
+
+	def tearDown(self):
+		self._gpio_patch.stop()
+		GPIO.reset()
+	#endregion
+
+	def _runPresses(self, presses):
+		with mock.patch("program_loop._presses") as mock_presses:
+			mock_presses.get.side_effect = presses + [StopLoop]
+			with self.assertRaises(StopLoop):
+				program_loop._loop(self.engine)
+
+	#region _setup
+	def test_setup_edgeDetectOnEveryButton(self):
+		program_loop._setup()
+		for pin in [pins.TOGGLE_LOCK_PIN, pins.DELAY_LOCK_PIN]:
+			assert GPIO.input(pin) == GPIO.HIGH # pulled up
+			edge, callbacks, bouncetime, last = GPIO._edge_detects[pin]
+			assert edge == GPIO.FALLING
+			assert callbacks == [program_loop._onPress]
+			assert bouncetime == settings.BUTTON_BOUNCE_TIME / 1000.0
+
+	def test_setup_pressQueuesPin(self):
+		program_loop._setup()
+		GPIO.press(pins.DELAY_LOCK_PIN)
+		pin, pressed = program_loop._presses.get(timeout=1)
+		assert pin == pins.DELAY_LOCK_PIN
+	#endregion
+
+	#region _loop
+	def test_loop_togglePinLocks(self):
+		self._runPresses([(pins.TOGGLE_LOCK_PIN, 10.0)])
+		self.engine.execute.assert_called_once_with(commands.LOCK, source="button:%d" % pins.TOGGLE_LOCK_PIN)
+
+	def test_loop_delayPinUnlocksThenSchedulesLock(self):
+		self._runPresses([(pins.DELAY_LOCK_PIN, 10.0)])
+		self.engine.execute.assert_called_once_with(commands.UNLOCK, source="button:%d" % pins.DELAY_LOCK_PIN)
+		self.engine.scheduleLock.assert_called_once_with(program_loop.DELAY_BUTTON_LOCK_DELAY)
+
+	def test_loop_recordsPressLatency(self):
+		self._runPresses([(pins.TOGGLE_LOCK_PIN, 10.0)])
+		assert abs(program_loop.press_latencies[0] - 0.05) < 1e-9
+		assert program_loop.pressLatencyStats()["presses"] == 1
+
+	def test_loop_skippedPressHasNoLatency(self):
+		self.engine.execute.return_value = {"started": 10.0, "skipped": "already done"}
+		self._runPresses([(pins.TOGGLE_LOCK_PIN, 10.0)])
+		assert program_loop.pressLatencyStats()["presses"] == 0
+
+	def test_loop_survivesFailingCommand(self):
+		self.engine.execute.side_effect = [IOError("servo gone"), {"started": 10.05}]
+		self._runPresses([(pins.TOGGLE_LOCK_PIN, 10.0), (pins.TOGGLE_LOCK_PIN, 10.0)])
+		assert self.engine.execute.call_count == 2
+		assert program_loop.pressLatencyStats()["presses"] == 1
+	#endregion
+
+
+if __name__ == '__main__':
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestProgramLoop)
+	unittest.TextTestRunner(verbosity=2).run(suite)
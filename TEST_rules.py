@@ -0,0 +1,236 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import time
+import datetime
+import threading
+
+import _clock
+import _event_bus
+import _history
+import _rules
+import _control_lock
+import _lock_engine
+import _test_files
+import commands
+from _clock import VirtualClock
+from _rules import Rules, RuleError
+from _scheduler import Scheduler
+
+# noon on Friday 1 March 2024, local time
+FRIDAY_NOON = time.mktime((2024, 3, 1, 12, 0, 0, 0, 0, -1))
+
+def _at(day, hour, minute=0):
+	# local time on day of March 2024
+	return time.mktime((2024, 3, day, hour, minute, 0, 0, 0, -1))
+
+
+class TestParse(unittest.TestCase):
+
+	def test_atRule(self):
+		rule = _rules.parse("night", {"at": "23:05", "command": commands.LOCK})
+		assert (rule.at, rule.after, rule.command) == ((23, 5), None, commands.LOCK)
+
+	def test_afterRule(self):
+		rule = _rules.parse("auto_lock", {"after": "unlock", "delay": 300, "command": commands.LOCK})
+		assert (rule.after, rule.delay) == (_event_bus.UNLOCK, 300)
+
+	def test_days(self):
+		assert _rules.parse("r", {"at": "7:00", "command": "unlock", "days": "mon-fri"}).days == set(range(5))
+		assert _rules.parse("r", {"at": "7:00", "command": "unlock", "days": "Sat, sun"}).days == set([5, 6])
+		assert _rules.parse("r", {"at": "7:00", "command": "unlock", "days": "fri-mon"}).days == set([4, 5, 6, 0])
+
+	def test_mistakes(self):
+		for spec in [
+				"lock at 23:00",
+				{"at": "23:00"},
+				{"at": "23:00", "command": "open_sesame"},
+				{"command": "lock"},
+				{"at": "23:00", "after": "unlock", "delay": 1, "command": "lock"},
+				{"at": "24:00", "command": "lock"},
+				{"at": "23:00", "delay": 5, "command": "lock"},
+				{"after": "countdown", "delay": 5, "command": "lock"},
+				{"after": "unlock", "command": "lock"},
+				{"after": "unlock", "delay": -1, "command": "lock"},
+				{"at": "23:00", "command": "lock", "days": "weekdays"},
+				{"at": "23:00", "command": "lock", "holidays": "never"},
+				{"at": "23:00", "command": "lock", "every": "day"},
+				]:
+			self.assertRaises(RuleError, _rules.parse, "bad", spec)
+
+	def test_sequenceCommand(self):
+		with mock.patch("settings.SEQUENCES", {"let_in": "unlock; wait 60; lock"}):
+			assert _rules.parse("r", {"at": "8:00", "command": "let_in"}).command == "let_in"
+
+	def test_holidays(self):
+		holidays = _rules.Holidays(["2024-03-04", "12-25", "02-29"])
+		assert datetime.date(2024, 3, 4) in holidays
+		assert datetime.date(2025, 3, 4) not in holidays
+		assert datetime.date(2031, 12, 25) in holidays
+		for text in ["2024-3-4", "12-32", "christmas"]:
+			self.assertRaises(RuleError, _rules.Holidays, [text])
+
+
+class TestRules(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.clock = VirtualClock(FRIDAY_NOON)
+		self.old_clock = _clock.use(self.clock)
+		self.scheduler = Scheduler(self.clock)
+		self.runs = [] # (time, command, source) the rules ran
+		self.engine = mock.Mock()
+		self.engine.execute.side_effect = lambda command, source: self.runs.append(
+			(self.clock.time(), command, source))
+		self.rules = None
+
+	def tearDown(self):
+		if self.rules is not None:
+			self.rules.close()
+		self.scheduler.close()
+		_clock.use(self.old_clock)
+	#endregion
+
+	def _start(self, rules, holidays=()):
+		self.rules = Rules(self.engine, self.scheduler, rules, list(holidays))
+		self.rules.start()
+
+	def _times(self):
+		return [at for at, command, source in self.runs]
+
+	def test_atRuleRunsEveryDay(self):
+		self._start({"night": {"at": "23:00", "command": commands.LOCK}})
+		self.clock.advanceTo(_at(3, 12))
+		assert self.runs == [(_at(1, 23), commands.LOCK, "rule:night"), (_at(2, 23), commands.LOCK, "rule:night")]
+		assert self.rules.upcoming() == [(_at(3, 23), "night")]
+
+	def test_weekdays(self):
+		self._start({"morning": {"at": "7:30", "command": commands.UNLOCK, "days": "mon-fri"}})
+		self.clock.advanceTo(_at(5, 12))
+		assert self._times() == [_at(4, 7, 30), _at(5, 7, 30)] # Monday and Tuesday
+
+	def test_holidaysSkipped(self):
+		self._start({
+			"night": {"at": "23:00", "command": commands.LOCK, "holidays": "skip"},
+			"late": {"at": "23:30", "command": commands.LOCK, "holidays": "only"},
+		}, holidays=["2024-03-01"])
+		self.clock.advanceTo(_at(3, 0))
+		assert [(at, source) for at, command, source in self.runs] == [
+			(_at(1, 23, 30), "rule:late"), (_at(2, 23), "rule:night")]
+
+	def test_ruleThatNeverRuns(self):
+		self._start({"holiday": {"at": "9:00", "command": commands.LOCK, "holidays": "only"}})
+		assert self.rules.upcoming() == []
+
+	def test_afterRuleRestartsOnEachEvent(self):
+		self._start({"auto_lock": {"after": "unlock", "delay": 300, "command": commands.LOCK}})
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		self.clock.advance(100)
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		_event_bus.bus.publish(_event_bus.LOCK)
+		self.clock.advance(1000)
+		assert self.runs == [(FRIDAY_NOON + 400, commands.LOCK, "rule:auto_lock")]
+		_event_bus.bus.publish(_event_bus.UNLOCK) # and again after it ran
+		self.clock.advance(1000)
+		assert self._times() == [FRIDAY_NOON + 400, FRIDAY_NOON + 1400]
+
+	def test_afterRuleOnOtherDays(self):
+		self._start({"auto_lock": {"after": "unlock", "delay": 60, "command": commands.LOCK, "days": "sat,sun"}})
+		_event_bus.bus.publish(_event_bus.UNLOCK) # Friday
+		self.clock.advanceTo(_at(2, 12))
+		assert self.runs == []
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		self.clock.advance(60)
+		assert self._times() == [_at(2, 12, 1)]
+
+	def test_doorEventsIgnored(self):
+		self._start({"auto_lock": {"after": "unlock", "delay": 60, "command": commands.LOCK}})
+		_event_bus.bus.publish(_event_bus.UNLOCK, door="back")
+		self.clock.advance(120)
+		assert self.runs == []
+
+	def test_closeCancels(self):
+		self._start({
+			"night": {"at": "23:00", "command": commands.LOCK},
+			"auto_lock": {"after": "unlock", "delay": 60, "command": commands.LOCK},
+		})
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		self.rules.close()
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		self.clock.advance(86400)
+		assert self.runs == []
+
+	def test_failingCommandKeepsRuleGoing(self):
+		self.engine.execute.side_effect = RuntimeError("servo stuck")
+		self._start({"night": {"at": "23:00", "command": commands.LOCK}})
+		self.clock.advanceTo(_at(3, 0))
+		assert self.engine.execute.call_count == 2
+
+	def test_commandDoesNotHoldUpScheduler(self):
+		scheduler = Scheduler(_clock.RealClock()) # real threads
+		release = threading.Event()
+		self.engine.execute.side_effect = lambda command, source: release.wait(5)
+		rules = Rules(self.engine, scheduler, {"auto_lock": {"after": "unlock", "delay": 0, "command": commands.LOCK}}, [])
+		rules.start()
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		ran = threading.Event()
+		scheduler.schedule(0.01, ran.set)
+		assert ran.wait(1) # while the rule's command still runs
+		assert self.engine.execute.called
+		release.set()
+		rules.close()
+		scheduler.close()
+
+	def test_manyRules(self):
+		rules = dict(("rule%d" % i, {"at": "%d:%02d" % (i // 60 % 24, i % 60), "command": commands.LOCK})
+			for i in range(500))
+		self._start(rules)
+		assert len(self.rules.upcoming()) == 500
+		self.clock.advanceTo(_at(2, 12))
+		assert len(self.runs) == 500
+		assert self._times() == sorted(self._times())
+
+
+class TestEngineRules(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock(VirtualClock(FRIDAY_NOON), overrides={"settings.RULES": {
+			"auto_lock": {"after": "unlock", "delay": 300, "command": commands.LOCK},
+		}})
+		self.clock = self.lock.start()
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_autoLockAfterUnlock(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute(commands.LOCK)
+		engine.execute(commands.UNLOCK)
+		self.clock.sleep(299)
+		assert not _control_lock._isCurrentlyLocked()
+		self.clock.sleep(3)
+		assert _control_lock._isCurrentlyLocked()
+		engine.close()
+		events = _history.getHistory().events()
+		assert (events[-1]["command"], events[-1]["source"], events[-1]["outcome"]) == (
+			commands.LOCK, "rule:auto_lock", "ok")
+
+	def test_noRulesAfterClose(self):
+		engine = _lock_engine.LockEngine()
+		engine.close()
+		_event_bus.bus.publish(_event_bus.UNLOCK)
+		self.clock.sleep(600)
+		assert _history.getHistory().count(source="rule") == 0
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestParse),
+		unittest.TestLoader().loadTestsFromTestCase(TestRules),
+		unittest.TestLoader().loadTestsFromTestCase(TestEngineRules),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,98 @@
+import unittest
+import threading
+import select
+import time
+import mock
+
+from _scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.scheduler = Scheduler()
+		self.calls = []
+		self.done = threading.Event()
+
+	def tearDown(self):
+		self.scheduler.close()
+	#endregion
+
+	def _record(self, name):
+		self.calls.append(name)
+		self.done.set()
+
+	def test_runsInDeadlineOrder(self):
+		self.scheduler.schedule(0.04, self._record, "late")
+		self.scheduler.schedule(0.02, self.calls.append, "early")
+		self.done.wait(1)
+		assert self.calls == ["early", "late"]
+
+	def test_cancelledEventDoesNotRun(self):
+		event = self.scheduler.schedule(0.02, self._record, "cancelled")
+		self.scheduler.cancel(event)
+		self.scheduler.schedule(0.04, self._record, "kept")
+		self.done.wait(1)
+		assert self.calls == ["kept"]
+		assert not event.pending
+
+	def test_rescheduleLater(self):
+		event = self.scheduler.schedule(0.02, self._record, "moved")
+		self.scheduler.schedule(0.04, self.calls.append, "fixed")
+		self.scheduler.reschedule(event, 0.08)
+		self.done.wait(1)
+		assert self.calls == ["fixed", "moved"]
+
+	def test_rescheduleEarlierWakesWorker(self):
+		event = self.scheduler.schedule(10, self._record, "moved")
+		started = time.time()
+		self.scheduler.reschedule(event, 0.01)
+		self.done.wait(1)
+		assert self.calls == ["moved"]
+		assert time.time() - started < 0.5
+
+	def test_sleepsUntilDeadline(self):
+		self.scheduler.close()
+		with mock.patch("select.select", side_effect=select.select) as mock_select:
+			self.scheduler = Scheduler()
+			self.scheduler.schedule(0.2, self._record, "due")
+			self.done.wait(1)
+		assert self.calls == ["due"]
+		assert 1 <= mock_select.call_count <= 3 # asleep, woken by the push, asleep until due
+
+	def test_rescheduleRunEventFails(self):
+		event = self.scheduler.schedule(0, self._record, "ran")
+		self.done.wait(1)
+		with self.assertRaises(ValueError):
+			self.scheduler.reschedule(event, 1)
+
+	def test_failingCallbackDoesNotStopWorker(self):
+		self.scheduler.schedule(0, lambda: 1 / 0)
+		self.scheduler.schedule(0.01, self._record, "after")
+		self.done.wait(1)
+		assert self.calls == ["after"]
+
+	def test_workDoesNotHoldUpEvents(self):
+		release = threading.Event()
+		self.scheduler.scheduleWork(0, release.wait, 5)
+		self.scheduler.schedule(0.01, self._record, "after")
+		self.done.wait(1)
+		assert self.calls == ["after"] # while the work still waits
+		release.set()
+
+	def test_closeWaitsForWork(self):
+		started = threading.Event()
+		def work():
+			started.set()
+			time.sleep(0.05)
+			self.calls.append("work")
+		self.scheduler.scheduleWork(0, work)
+		started.wait(1)
+		self.scheduler.close()
+		assert self.calls == ["work"]
+
+
+if __name__ == '__main__':
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestScheduler)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,154 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _sequences
+import _sim_gpio as GPIO
+import _control_lock
+import _lock_engine
+import _test_files
+import commands
+import pins
+import settings
+from _sequences import SequenceError
+
+LET_IN = "buzz 2s || unlock; wait 500ms; blink 3; lock"
+
+
+class TestParse(unittest.TestCase):
+
+	def test_channelsAndSteps(self):
+		sequence = _sequences.parse("buzz 4s || unlock; blink 20s; lock")
+		assert [[step.name for step in channel] for channel in sequence.channels] == [
+			["buzz"], ["unlock", "blink", "lock"]]
+		assert sequence.channels[0][0].seconds == 4.0
+		assert sequence.channels[1][1].seconds == 20
+
+	def test_doubleBarSeparatesChannels(self):
+		sequence = _sequences.parse(u"buzz \u2016 unlock".encode("utf-8"))
+		assert len(sequence.channels) == 2
+		assert len(_sequences.parse(u"buzz \u2016 unlock").channels) == 2
+
+	def test_durations(self):
+		steps = _sequences.parse("wait 2; wait 1.5s; wait 250ms; wait .5").channels[0]
+		assert [step.seconds for step in steps] == [2.0, 1.5, 0.25, 0.5]
+
+	def test_defaultsFromSettings(self):
+		buzz, blink = _sequences.parse("buzz; blink").channels[0]
+		assert buzz.seconds is None and buzz.duration() == settings.BUZZ_DURATION
+		assert blink.duration() == settings.DELAYED_LOCK_DELAY
+
+	def test_errors(self):
+		for text in ("open", "lock 2s", "wait", "buzz soon", "unlock;; lock", "blink 1.5", "buzz 1 2", ""):
+			self.assertRaises(SequenceError, _sequences.parse, text)
+
+	def test_channelsShareNoOutput(self):
+		for text in ("lock || unlock", "buzz || wait 1; buzz 2s", "blink || toggle", "unlock; lock || blink 3"):
+			self.assertRaises(SequenceError, _sequences.parse, text)
+		_sequences.parse("buzz || unlock; blink; lock || wait 2")
+
+	def test_builtinsParse(self):
+		_sequences.check()
+		for action in commands.ALL:
+			_sequences.lookup(action)
+
+	@mock.patch("settings.SEQUENCES", {"let_in": LET_IN, commands.BUZZ: "buzz 1s"})
+	def test_settingsAddAndRedefine(self):
+		assert "let_in" in _sequences.names()
+		assert _sequences.lookup(commands.BUZZ).channels[0][0].seconds == 1.0
+
+	@mock.patch("settings.SEQUENCES", {"bad": "lock; open"})
+	def test_checkNamesBadSequence(self):
+		with self.assertRaises(SequenceError) as raised:
+			_sequences.check()
+		assert "bad" in str(raised.exception)
+
+	@mock.patch("settings.SEQUENCES", {"let_in": LET_IN})
+	def test_parsedOnce(self):
+		_sequences.check()
+		with mock.patch("_sequences.parse", side_effect=AssertionError("parsed again")):
+			assert _sequences.lookup("let_in") is _sequences.lookup("let_in")
+
+	def test_unknownCommand(self):
+		self.assertRaises(NotImplementedError, _sequences.lookup, "open_sesame")
+
+
+class TestRunSequence(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock(overrides={"settings.SEQUENCES": {"let_in": LET_IN}})
+		self.clock = self.lock.start()
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def _assertLetInTimeline(self):
+		rotation = settings.SERVO_ROTATION_DURATION
+		locked_at = rotation + 3.5
+		assert GPIO.outputHistory(pins.BUZZER_PIN)[1:3] == [(0.0, GPIO.HIGH), (2.0, GPIO.LOW)]
+		moves = [entry for entry in GPIO.outputHistory(pins.SERVO_PIN, "duty") if entry[1] is not None]
+		assert moves[:2] == [
+			(0.0, settings.SERVO_UNLOCKED_POSITION),
+			(locked_at, settings.SERVO_LOCKED_POSITION),
+		]
+		led = GPIO.outputHistory(pins.LOCK_STATUS_LED_PIN)
+		assert (rotation + 0.5, GPIO.LOW) in led # first blink
+		assert led[-1] == (locked_at, GPIO.HIGH)
+
+	def test_commandScriptRunsSequence(self):
+		_control_lock.main("let_in")
+		self._assertLetInTimeline()
+		assert _control_lock._isCurrentlyLocked()
+
+	def test_engineRunsSequence(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute("let_in")
+		assert self.clock.time() == settings.SERVO_ROTATION_DURATION # the rest is scheduled
+		self.clock.advance(10)
+		engine.close()
+		self._assertLetInTimeline()
+		assert _control_lock._isCurrentlyLocked()
+
+	def test_commandRunsDuringWait(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute("let_in")
+		self.clock.advance(1.0) # blinking
+		engine.execute(commands.BUZZ)
+		assert self.clock.time() == settings.SERVO_ROTATION_DURATION + 1.0 # did not wait
+		self.clock.advance(10)
+		engine.close()
+		self._assertLetInTimeline()
+
+	def test_unlockDropsTail(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute("let_in")
+		self.clock.advance(1.0)
+		engine.execute(commands.UNLOCK)
+		self.clock.advance(10)
+		engine.close()
+		assert not _control_lock._isCurrentlyLocked()
+		assert GPIO.outputHistory(pins.LOCK_STATUS_LED_PIN)[-1][1] == GPIO.LOW
+
+	@mock.patch("pins.DOOR_SENSOR_PIN", 29)
+	def test_closingDoorCutsBlinkShort(self):
+		engine = _lock_engine.LockEngine()
+		engine.execute("let_in")
+		self.clock.advance(1.0)
+		GPIO.setInput(29, GPIO.HIGH) # open
+		self.clock.advance(0.5)
+		GPIO.setInput(29, GPIO.LOW)
+		self.clock.advance(0.5)
+		assert _control_lock._isCurrentlyLocked()
+		engine.close()
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestParse),
+		unittest.TestLoader().loadTestsFromTestCase(TestRunSequence),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,105 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _servo_motion
+import _sim_gpio as GPIO
+import _control_lock
+import _test_files
+import commands
+import pins
+import settings
+from _servo_motion import MotionProfile
+
+DISTANCE = settings.SERVO_LOCKED_POSITION - settings.SERVO_UNLOCKED_POSITION
+SWITCH_PIN = 37
+
+
+class TestServoMotion(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start()
+		self.profile_file = os.path.join(self.lock.files.directory, "profile.json")
+		self._profile_patch = mock.patch("settings.SERVO_PROFILE_FILE", self.profile_file)
+		self._profile_patch.start()
+		_servo_motion._profiles = None
+		GPIO.setmode(GPIO.BOARD)
+		GPIO.setup(pins.SERVO_PIN, GPIO.OUT)
+		self.servo = GPIO.PWM(pins.SERVO_PIN, 50)
+
+	def tearDown(self):
+		_servo_motion._profiles = None
+		self._profile_patch.stop()
+		self.lock.stop()
+	#endregion
+
+	def _saveProfiles(self, lock_seconds, unlock_seconds):
+		_servo_motion.saveProfiles(self.profile_file, {
+			_servo_motion.LOCK: MotionProfile.fromTravelTime(lock_seconds, DISTANCE, 0.05),
+			_servo_motion.UNLOCK: MotionProfile.fromTravelTime(unlock_seconds, DISTANCE, 0.05),
+		})
+
+	def test_travelTimeGrowsWithDistance(self):
+		profile = MotionProfile(0.1, 0.05)
+		assert profile.travelTime(2) == 0.25
+		assert profile.travelTime(-2) == 0.25
+
+	def test_profilesRoundTrip(self):
+		self._saveProfiles(0.4, 0.3)
+		profiles = _servo_motion.loadProfiles(self.profile_file)
+		self.assertAlmostEqual(profiles[_servo_motion.LOCK].travelTime(DISTANCE), 0.45)
+		self.assertAlmostEqual(profiles[_servo_motion.UNLOCK].travelTime(DISTANCE), 0.35)
+
+	def test_unknownDirectionRejected(self):
+		with open(self.profile_file, "w") as f:
+			f.write('{"sideways": {"seconds_per_duty": 0.1, "settle": 0}}')
+		self.assertRaises(ValueError, _servo_motion.loadProfiles, self.profile_file)
+
+	def test_fixedDurationWithoutProfile(self):
+		_control_lock.main(commands.LOCK)
+		assert self.clock.time() == settings.SERVO_ROTATION_DURATION
+
+	def test_lockWaitsForCalibratedTime(self):
+		self._saveProfiles(0.4, 0.3)
+		_control_lock.main(commands.LOCK)
+		self.assertAlmostEqual(self.clock.time(), 0.45)
+		_control_lock.main(commands.UNLOCK)
+		self.assertAlmostEqual(self.clock.time(), 0.45 + 0.35)
+
+	@mock.patch("settings.SERVO_RAMP_STEPS", 4)
+	def test_rampedMove(self):
+		_servo_motion.move(self.servo, _servo_motion.LOCK)
+		history = GPIO.outputHistory(pins.SERVO_PIN, "duty")
+		step = DISTANCE / 4.0
+		interval = settings.SERVO_ROTATION_DURATION / 4
+		assert history == [(interval * i, settings.SERVO_UNLOCKED_POSITION + step * (i + 1)) for i in range(4)]
+		assert self.clock.time() == settings.SERVO_ROTATION_DURATION
+
+	def test_measureWithSwitch(self):
+		GPIO.setup(SWITCH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+		thrown_at = settings.SERVO_ROTATION_DURATION + 0.4
+		self.clock.callAt(thrown_at, GPIO.setInput, SWITCH_PIN, GPIO.LOW)
+		seconds = _servo_motion.measureWithSwitch(self.servo, GPIO, SWITCH_PIN, _servo_motion.LOCK)
+		self.assertAlmostEqual(seconds, 0.4, places=2)
+		assert self.servo.duty_cycle is None # stopped
+
+	def test_measureWithSwitchTimesOut(self):
+		GPIO.setup(SWITCH_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+		self.assertRaises(IOError, _servo_motion.measureWithSwitch,
+			self.servo, GPIO, SWITCH_PIN, _servo_motion.LOCK, 0.5)
+
+	def test_bisectTravelTime(self):
+		seconds = _servo_motion.bisectTravelTime(self.servo, _servo_motion.UNLOCK,
+			lambda trial: trial >= 0.3, tolerance=0.01)
+		assert 0.3 <= seconds < 0.31
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestServoMotion),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,99 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _servo_pwm
+import _sim_pigpio
+import _sim_gpio as GPIO
+import _control_lock
+import _test_files
+import commands
+import pins
+import settings
+from _servo_pwm import PigpioServo
+
+
+class TestServoPwm(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		GPIO.reset()
+		_sim_pigpio.reset()
+		_servo_pwm._pi = None
+		GPIO.setmode(GPIO.BOARD)
+		GPIO.setup(pins.SERVO_PIN, GPIO.OUT)
+
+	def tearDown(self):
+		_servo_pwm._pi = None
+		_sim_pigpio.reset()
+		GPIO.reset()
+	#endregion
+
+	@mock.patch("settings.SERVO_PWM_BACKEND", "software")
+	def test_softwareBackendIsGpioPwm(self):
+		servo = _servo_pwm.open(GPIO, pins.SERVO_PIN, 50)
+		assert isinstance(servo, GPIO.PWM)
+
+	@mock.patch("settings.SERVO_PWM_BACKEND", "pigpio")
+	def test_pigpioBackendUsesStandIn(self):
+		servo = _servo_pwm.open(GPIO, pins.SERVO_PIN, 50)
+		assert isinstance(servo, PigpioServo)
+		assert servo.gpio == 4 # board pin 7
+
+	@mock.patch("settings.SERVO_PWM_BACKEND", "dma")
+	def test_unknownBackend(self):
+		self.assertRaises(ValueError, _servo_pwm.open, GPIO, pins.SERVO_PIN, 50)
+
+	def test_dutyCycleBecomesPulseWidth(self):
+		servo = PigpioServo(_sim_pigpio.pi(), pins.SERVO_PIN, 50)
+		servo.start(settings.SERVO_LOCKED_POSITION)
+		servo.ChangeDutyCycle(settings.SERVO_UNLOCKED_POSITION)
+		servo.stop()
+		assert [width for t, gpio, width in _sim_pigpio.events] == [1600, 700, 0]
+
+	def test_onlyServoFrequency(self):
+		self.assertRaises(ValueError, PigpioServo, _sim_pigpio.pi(), pins.SERVO_PIN, 60)
+
+	def test_boardPinWithoutGpio(self):
+		self.assertRaises(ValueError, PigpioServo, _sim_pigpio.pi(), 1, 50) # 3.3V
+
+	@mock.patch("_sim_pigpio.pi", autospec=True)
+	@mock.patch("settings.SERVO_PWM_BACKEND", "pigpio")
+	def test_daemonNotRunning(self, mock_pi):
+		mock_pi.return_value.connected = False
+		self.assertRaises(IOError, _servo_pwm.open, GPIO, pins.SERVO_PIN, 50)
+
+
+class TestLockOnPigpio(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		_sim_pigpio.reset()
+		_servo_pwm._pi = None
+		self.lock = _test_files.SimulatedLock(overrides={"settings.SERVO_PWM_BACKEND": "pigpio"})
+		self.lock.start()
+
+	def tearDown(self):
+		self.lock.stop()
+		_servo_pwm._pi = None
+		_sim_pigpio.reset()
+	#endregion
+
+	def test_lockThroughSameApi(self):
+		_control_lock.main(commands.LOCK)
+		assert _sim_pigpio.events == [
+			(0.0, 4, 1600),
+			(settings.SERVO_ROTATION_DURATION, 4, 0),
+		]
+		assert _control_lock._isCurrentlyLocked()
+		assert GPIO.outputHistory(pins.SERVO_PIN, "duty") == [] # no software PWM
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestServoPwm),
+		unittest.TestLoader().loadTestsFromTestCase(TestLockOnPigpio),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
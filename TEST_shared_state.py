@@ -0,0 +1,157 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+import shutil
+import tempfile
+import multiprocessing
+
+import _clock
+import _shared_state
+import _state_store
+import _control_lock
+import _test_files
+import commands
+import settings
+import status
+from _clock import VirtualClock
+from _shared_state import SharedStateWriter, SharedStateReader
+
+
+def _publishLocked(path):
+	writer = SharedStateWriter(path)
+	writer.publish(True, 123.0)
+	writer.close()
+
+
+class TestSharedState(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.clock = VirtualClock(1000.0)
+		self.old_clock = _clock.use(self.clock)
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "state")
+
+	def tearDown(self):
+		_clock.use(self.old_clock)
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def test_nothingPublishedYet(self):
+		assert SharedStateReader(self.path).read() is None
+		open(self.path, "w").close()
+		assert SharedStateReader(self.path).read() is None
+
+	def test_readsWhatWasPublished(self):
+		writer = SharedStateWriter(self.path)
+		reader = SharedStateReader(self.path)
+		writer.publish(True)
+		assert reader.read() == {"locked": True, "changed_at": None,
+			"delayed_lock_deadline": None, "pid": os.getpid(), "sequence": 2}
+		writer.publish(False, 1025.0, 1005.0) # seen through the same mapping
+		state = reader.read()
+		assert (state["locked"], state["changed_at"], state["delayed_lock_deadline"]) == (False, 1005.0, 1025.0)
+		assert state["sequence"] == 4
+		writer.close()
+		reader.close()
+
+	def test_readerRetriesDuringWrite(self):
+		writer = SharedStateWriter(self.path)
+		writer.publish(True)
+		_shared_state.SEQUENCE.pack_into(writer._map, _shared_state.SEQUENCE_OFFSET, 3) # writer half way
+		self.assertRaises(IOError, SharedStateReader(self.path).read)
+		writer.close()
+
+	def test_otherProcessPublishes(self):
+		process = multiprocessing.Process(target=_publishLocked, args=(self.path,))
+		process.start()
+		process.join()
+		state = SharedStateReader(self.path).read()
+		assert state["locked"] is True
+		assert state["delayed_lock_deadline"] == 123.0
+		assert state["pid"] == process.pid
+
+
+class TestEnginePublishes(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.lock = _test_files.SimulatedLock(engine=True)
+		self.clock = self.lock.start()
+		self.engine = self.lock.engine
+		self.reader = SharedStateReader()
+
+	def tearDown(self):
+		self.reader.close()
+		self.lock.stop()
+	#endregion
+
+	def test_publishedAtStart(self):
+		state = self.reader.read()
+		assert state["locked"] is False
+		assert state["changed_at"] is None # not when the engine started
+
+	def test_lockPublished(self):
+		self.clock.sleep(100)
+		self.engine.execute(commands.LOCK)
+		state = self.reader.read()
+		assert state["locked"] is True
+		assert state["changed_at"] == 100 + settings.SERVO_ROTATION_DURATION
+
+	def test_changedAtIsWhenStateWritten(self):
+		with mock.patch("settings.SEQUENCES", {"lock_later": "wait 30; lock; wait 30"}):
+			self.engine.execute("lock_later")
+			self.clock.advanceTo(60 + settings.SERVO_ROTATION_DURATION)
+		assert self.reader.read()["changed_at"] == 30 + settings.SERVO_ROTATION_DURATION
+		self.clock.sleep(10)
+		self.engine.run(commands.LOCK) # locked already, not a change
+		assert self.reader.read()["changed_at"] == 30 + settings.SERVO_ROTATION_DURATION
+
+	def test_lockByScriptSeen(self):
+		# lock_all.py and the other command scripts save the state file themselves
+		assert self.engine.state()["locked"] is False
+		self.clock.sleep(5)
+		_state_store.JsonStateFile(settings.PERSISTENT_STATE_FILE).save({"locked": True}, {"locked": True})
+		assert self.engine.state()["locked"] is True
+		timings = self.engine.execute(commands.UNLOCK)
+		assert "skipped" not in timings # was dropped as already done
+		state = self.reader.read()
+		assert state["locked"] is False
+		assert state["changed_at"] == 5 + settings.SERVO_ROTATION_DURATION
+
+	def test_delayedLockDeadlinePublished(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		deadline = settings.SERVO_ROTATION_DURATION + settings.DELAYED_LOCK_DELAY
+		assert self.reader.read()["delayed_lock_deadline"] == deadline
+		self.clock.advanceTo(deadline + settings.SERVO_ROTATION_DURATION)
+		state = self.reader.read()
+		assert state["locked"] is True
+		assert state["delayed_lock_deadline"] is None
+
+	def test_cancelPublished(self):
+		self.engine.execute(commands.DELAY_LOCK)
+		self.engine.cancelDelayedLock()
+		assert self.reader.read()["delayed_lock_deadline"] is None
+
+	def test_statusReadsPublishedState(self):
+		self.engine.execute(commands.LOCK)
+		current = status.state()
+		assert current["pid"] == os.getpid()
+		assert status.describe(current, 0.0).startswith("locked since ")
+
+	def test_statusFallsBackToStateFile(self):
+		self.engine.execute(commands.LOCK)
+		_control_lock._getStateStore().flush()
+		with mock.patch("status._alive", return_value=False):
+			assert status.state() == {"locked": True, "changed_at": None,
+				"delayed_lock_deadline": None, "pid": None, "sequence": None}
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestSharedState),
+		unittest.TestLoader().loadTestsFromTestCase(TestEnginePublishes),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
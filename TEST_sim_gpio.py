@@ -0,0 +1,104 @@
+import os
+os.environ.setdefault("DOOR_LOCK_GPIO", "sim") # runs without a Pi attached
+
+import unittest
+import mock
+
+import _clock
+import _sim_gpio as GPIO
+import _control_lock
+import program_loop
+import _test_files
+import commands
+import pins
+import settings
+
+
+class TestSimulatedGpio(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		GPIO.reset()
+		GPIO.setmode(GPIO.BOARD)
+
+	def tearDown(self):
+		GPIO.reset()
+	#endregion
+
+	def test_outputRecordsLevels(self):
+		GPIO.setup(pins.LOCK_STATUS_LED_PIN, GPIO.OUT)
+		GPIO.output(pins.LOCK_STATUS_LED_PIN, GPIO.HIGH)
+		GPIO.output(pins.LOCK_STATUS_LED_PIN, GPIO.LOW)
+		levels = [level for t, level in GPIO.outputHistory(pins.LOCK_STATUS_LED_PIN)]
+		assert levels == [GPIO.HIGH, GPIO.LOW]
+		assert GPIO.levels[pins.LOCK_STATUS_LED_PIN] == GPIO.LOW
+
+	def test_outputRequiresSetup(self):
+		with self.assertRaises(RuntimeError):
+			GPIO.output(pins.BUZZER_PIN, GPIO.HIGH)
+
+	def test_setupRequiresMode(self):
+		GPIO.reset()
+		with self.assertRaises(RuntimeError):
+			GPIO.setup(pins.BUZZER_PIN, GPIO.OUT)
+
+	def test_pwmRecordsDutyCycles(self):
+		GPIO.setup(pins.SERVO_PIN, GPIO.OUT)
+		servo = GPIO.PWM(pins.SERVO_PIN, 50)
+		servo.start(settings.SERVO_LOCKED_POSITION)
+		servo.stop()
+		duties = [duty for t, duty in GPIO.outputHistory(pins.SERVO_PIN, "duty")]
+		assert duties == [settings.SERVO_LOCKED_POSITION, None]
+
+	def test_pressRunsFallingEdgeCallbackWithBounce(self):
+		callback = mock.Mock()
+		GPIO.setup(pins.TOGGLE_LOCK_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+		GPIO.add_event_detect(pins.TOGGLE_LOCK_PIN, GPIO.FALLING, callback=callback, bouncetime=10000)
+		GPIO.press(pins.TOGGLE_LOCK_PIN)
+		GPIO.press(pins.TOGGLE_LOCK_PIN) # bounces
+		callback.assert_called_once_with(pins.TOGGLE_LOCK_PIN)
+
+
+class TestLockOnSimulatedGpio(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		# real time, without waiting for it
+		self.lock = _test_files.SimulatedLock(_clock.RealClock(), overrides={"time.sleep": mock.Mock()})
+		self.lock.start()
+
+	def tearDown(self):
+		self.lock.stop()
+	#endregion
+
+	def test_lockDrivesServoAndLed(self):
+		_control_lock.main(commands.LOCK)
+		duties = [duty for t, duty in GPIO.outputHistory(pins.SERVO_PIN, "duty")]
+		assert duties == [settings.SERVO_LOCKED_POSITION, None]
+		assert GPIO.levels[pins.LOCK_STATUS_LED_PIN] == GPIO.HIGH
+		assert GPIO.levels[pins.BUZZER_PIN] == GPIO.LOW
+		assert _control_lock._isCurrentlyLocked() is True
+
+	def test_toggleAlternates(self):
+		_control_lock.main(commands.TOGGLE)
+		_control_lock.main(commands.TOGGLE)
+		duties = [duty for t, duty in GPIO.outputHistory(pins.SERVO_PIN, "duty") if duty is not None]
+		assert duties == [settings.SERVO_LOCKED_POSITION, settings.SERVO_UNLOCKED_POSITION]
+
+	def test_buttonPressReachesEngine(self):
+		engine = mock.Mock()
+		engine.execute.return_value = {"started": 0.0}
+		program_loop._setup()
+		GPIO.press(pins.TOGGLE_LOCK_PIN)
+		with mock.patch("program_loop._presses.get", side_effect=[program_loop._presses.get(), KeyboardInterrupt]):
+			with self.assertRaises(KeyboardInterrupt):
+				program_loop._loop(engine)
+		engine.execute.assert_called_once_with(commands.LOCK, source="button:%d" % pins.TOGGLE_LOCK_PIN)
+
+
+if __name__ == '__main__':
+	suite = unittest.TestSuite([
+		unittest.TestLoader().loadTestsFromTestCase(TestSimulatedGpio),
+		unittest.TestLoader().loadTestsFromTestCase(TestLockOnSimulatedGpio),
+	])
+	unittest.TextTestRunner(verbosity=2).run(suite)
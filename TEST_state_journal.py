@@ -0,0 +1,155 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+import _state_journal
+from _state_journal import StateJournal, RECORD
+
+def _count(path, key, times):
+	# saves key as 0 up to times - 1, like a process of its own
+	journal = StateJournal(path, compact_after=20)
+	state = journal.load()
+	for i in range(times):
+		state[key] = i
+		journal.save(state, {key: i})
+	journal.close()
+
+
+class TestStateJournal(unittest.TestCase):
+
+	#region setup and teardown
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, "state.journal")
+		self.json_path = os.path.join(self.directory, "state.json")
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+	#endregion
+
+	def _reopen(self, journal):
+		journal.close()
+		reopened = StateJournal(self.path, self.json_path, compact_after=100)
+		return reopened, reopened.load()
+
+	def _records(self):
+		return os.path.getsize(self.path) // RECORD.size
+
+	def test_newJournalIsEmpty(self):
+		journal = StateJournal(self.path, self.json_path)
+		assert journal.load() == {}
+		assert self._records() == 1 # just the header
+
+	def test_migratesFromJson(self):
+		with open(self.json_path, "w") as f:
+			f.write(json.dumps({"locked": True}))
+		journal = StateJournal(self.path, self.json_path)
+		assert journal.load() == {"locked": True}
+		journal, state = self._reopen(journal)
+		assert state == {"locked": True}
+
+	def test_appendsFixedSizeRecords(self):
+		journal = StateJournal(self.path, self.json_path, compact_after=100)
+		state = journal.load()
+		state["locked"] = True
+		journal.save(state, {"locked": True}) # new key, compacts
+		before = self._records()
+		for locked in [False, True, False]:
+			state["locked"] = locked
+			journal.save(state, {"locked": locked})
+		assert self._records() == before + 3
+		journal, state = self._reopen(journal)
+		assert state == {"locked": False}
+
+	def test_valueKinds(self):
+		journal = StateJournal(self.path, self.json_path)
+		state = {"flag": True, "count": 3, "deadline": 1.5, "empty": None}
+		journal.compact(state)
+		journal, loaded = self._reopen(journal)
+		assert loaded == state
+
+	def test_compactsAfterLimit(self):
+		journal = StateJournal(self.path, self.json_path, compact_after=5)
+		state = {"locked": False}
+		journal.compact(state)
+		for i in range(10):
+			state["locked"] = i % 2 == 0
+			journal.save(state, {"locked": state["locked"]})
+		assert self._records() <= 5
+		journal, loaded = self._reopen(journal)
+		assert loaded == state
+
+	def test_recoversFromTornRecord(self):
+		journal = StateJournal(self.path, self.json_path, compact_after=100)
+		state = {"locked": False}
+		journal.compact(state)
+		journal.save(state, {"locked": True})
+		journal.close()
+		with open(self.path, "ab") as f:
+			f.write(b"\x01" * (RECORD.size + 7)) # garbage record and a partial one
+		journal, loaded = self._reopen(journal)
+		assert loaded == {"locked": True}
+		assert os.path.getsize(self.path) % RECORD.size == 0
+		journal.save(loaded, {"locked": False})
+		journal, loaded = self._reopen(journal)
+		assert loaded == {"locked": False}
+
+	def test_corruptHeaderRaises(self):
+		with open(self.path, "wb") as f:
+			f.write(b"\x00" * RECORD.size)
+		with self.assertRaises(_state_journal.CorruptJournalError):
+			StateJournal(self.path).load()
+
+	def test_keepsWhatOthersSaved(self):
+		mine, theirs = StateJournal(self.path), StateJournal(self.path)
+		state = mine.load()
+		state["locked"] = True
+		mine.save(state, {"locked": True}) # a new key, compacts
+		theirs_state = theirs.load()
+		theirs_state["back.locked"] = True
+		theirs.save(theirs_state, {"back.locked": True})
+		state["locked"] = False
+		mine.save(state, {"locked": False}) # appends to the file theirs compacted
+		theirs_state["back.locked"] = False
+		theirs.save(theirs_state, {"back.locked": False})
+		state["front.locked"] = True
+		mine.save(state, {"front.locked": True}) # compacts again
+		mine.close()
+		theirs.close()
+		assert StateJournal(self.path).load() == {"locked": False, "back.locked": False, "front.locked": True}
+
+	def test_staleOnceOthersSaved(self):
+		mine, theirs = StateJournal(self.path), StateJournal(self.path)
+		state = mine.load()
+		theirs.load()
+		assert not mine.stale()
+		theirs.save({"locked": True}, {"locked": True})
+		assert mine.stale()
+		mine.load()
+		assert not mine.stale()
+		state["locked"] = False
+		mine.save(state, {"locked": False})
+		assert not mine.stale()
+		mine.close()
+		theirs.close()
+
+	def test_processesSavingAtOnceLoseNothing(self):
+		processes = [multiprocessing.Process(target=_count, args=(self.path, "door%d" % i, 50)) for i in range(4)]
+		for process in processes:
+			process.start()
+		for process in processes:
+			process.join()
+		assert StateJournal(self.path).load() == dict(("door%d" % i, 49) for i in range(4))
+
+	def test_rejectsStrings(self):
+		journal = StateJournal(self.path)
+		with self.assertRaises(TypeError):
+			journal.compact({"name": "front door"})
+
+
+if __name__ == '__main__':
+	suite = unittest.TestLoader().loadTestsFromTestCase(TestStateJournal)
+	unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,88 @@
+import threading
+
+import _clock
+
+class Actuation(object):
+	"""Channels started together by start(), each on its own thread. A channel
+	waits only for the channels it is declared to run after, and is skipped
+	if one of those failed.
+
+	On a virtual clock the channels run one after another as forks of
+	simulated time, each starting when its dependencies end, so their
+	timestamps overlap exactly as the threads would.
+	"""
+
+	def __init__(self, steps, after, clock):
+		for name, dependencies in after.items():
+			unknown = set([name]).union(dependencies).difference(steps)
+			if unknown:
+				raise ValueError("unknown channels: %s" % ", ".join(sorted(unknown)))
+		self._clock = clock
+		self._finished = dict((name, threading.Event()) for name in steps)
+		self._errors = {}
+		self._ends = {} # channel -> simulated time it finished, virtual clock only
+		if clock.virtual:
+			self._runForked(steps, after)
+			return
+		for name, step in steps.items():
+			dependencies = after.get(name, ())
+			thread = threading.Thread(target=self._run, args=(name, step, dependencies))
+			thread.daemon = True
+			thread.start()
+
+	def _runForked(self, steps, after):
+		started = self._clock.time()
+		waiting = sorted(steps) # fixed order keeps simulations repeatable
+		while waiting:
+			for name in waiting:
+				dependencies = after.get(name, ())
+				if all(dependency in self._ends for dependency in dependencies):
+					break
+			else:
+				raise ValueError("circular channel order: %s" % ", ".join(waiting))
+			waiting.remove(name)
+			start = max([started] + [self._ends[dependency] for dependency in dependencies])
+			self._ends[name] = self._clock.runForked(start,
+				lambda: self._run(name, steps[name], dependencies))
+
+	def _run(self, name, step, dependencies):
+		try:
+			for dependency in dependencies:
+				self._finished[dependency].wait()
+				if dependency in self._errors:
+					raise self._errors[dependency]
+			step()
+		except Exception as e:
+			self._errors[name] = e
+		finally:
+			self._finished[name].set()
+
+	def finished(self, name):
+		if self._clock.virtual:
+			return self._clock.time() >= self._ends[name]
+		return self._finished[name].is_set()
+
+	def wait(self, *names):
+		"""Blocks until the named channels, or all channels when none are
+		named, have finished, then re-raises the first of their failures.
+		"""
+		names = names or list(self._finished)
+		if self._clock.virtual and names:
+			# a sleep, so waiting inside a fork moves only the fork's time
+			end = max(self._ends[name] for name in names)
+			self._clock.sleep(max(0, end - self._clock.time()))
+		for name in names:
+			self._finished[name].wait()
+		for name in names:
+			if name in self._errors:
+				raise self._errors[name]
+
+def start(steps, after=None):
+	"""Starts steps, a dict of channel name -> callable, in parallel. after
+	maps a channel name to the channel names that must finish before it starts.
+	"""
+	return Actuation(steps, after or {}, _clock.clock)
+
+def run(steps, after=None):
+	"""Like start, but returns only once every channel has finished."""
+	start(steps, after).wait()
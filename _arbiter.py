@@ -0,0 +1,215 @@
+"""Decides which command gets the servo, buzzer and status LED when several
+want them at once.
+
+Within a process an Arbiter queues waiting commands by priority, locks
+first, and a command that sets the door to a definite state (anything but
+toggle and buzz) supersedes the servo commands still waiting: the latest
+one wins, since it decides how the door ends up. A reconfiguration, see
+LockEngine.reconfigure, goes ahead of every waiting command and is never
+superseded, so a steady stream of commands cannot hold it off.
+
+Across processes the actuators are guarded by a lock on
+settings.ACTUATION_LOCK_FILE. A process that has to wait for it asks the
+holder to give up, which a delayed lock counting down does, see
+preemptRequested. The ask is a marker file named after the waiter's pid,
+removed however the wait ends, and one left by a waiter that died is
+ignored. A buzz leaves the door as it is and waits its turn instead, and
+so does a reconfiguration.
+"""
+import os
+import errno
+import heapq
+import fcntl
+import itertools
+import threading
+
+import _clock
+import _metrics
+import commands
+import settings
+
+# what a reconfiguration waits for the actuators as
+RECONFIGURE = "reconfigure"
+# lower runs first among waiting commands
+PRIORITIES = {
+	RECONFIGURE: -1, # changes no output by itself and is over quickly
+	commands.LOCK: 0,
+	commands.UNLOCK: 1,
+	commands.TOGGLE: 1,
+	commands.DELAY_LOCK: 1,
+	commands.BUZZ_AND_UNLOCK: 1,
+	commands.BUZZ: 2,
+}
+# commands taking the door to a state of their own, which supersede waiting servo commands
+ABSOLUTE = (commands.LOCK, commands.UNLOCK, commands.DELAY_LOCK, commands.BUZZ_AND_UNLOCK)
+# waiting for the actuators without moving the servo, never superseded
+KEPT = (commands.BUZZ, RECONFIGURE)
+# commands that wait for another process's countdown instead of making it give up
+PATIENT = (commands.BUZZ, RECONFIGURE)
+
+# tells apart the preempt markers of this process's waiters
+_markers = itertools.count()
+
+class Superseded(Exception):
+	"""A later command took the place of this one while it waited."""
+
+class Preempted(Exception):
+	"""Another process asked for the actuators while this one held them."""
+
+	def __init__(self):
+		Exception.__init__(self, "gave up for a command from another process before locking")
+
+class ProcessLock(object):
+	"""Exclusive flock on path, held by one process (or thread) at a time.
+	With preempt, waiting for it asks the holder to give up, see preemptRequested.
+	"""
+
+	def __init__(self, path, preempt=False):
+		self._path = path
+		self._preempt = preempt
+		self._fd = None
+		self.contended = False # whether the last acquire had to wait
+
+	def acquire(self):
+		fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+				self.contended = False
+			except (IOError, OSError):
+				self.contended = True
+				marker = self._request() if self._preempt else None
+				try:
+					fcntl.flock(fd, fcntl.LOCK_EX)
+				finally:
+					if marker is not None:
+						_withdraw(marker)
+		except BaseException:
+			os.close(fd)
+			raise
+		self._fd = fd
+
+	def release(self):
+		fd, self._fd = self._fd, None
+		fcntl.flock(fd, fcntl.LOCK_UN)
+		os.close(fd)
+
+	def _request(self):
+		marker = "%s.preempt.%d.%d" % (self._path, os.getpid(), next(_markers))
+		os.close(os.open(marker, os.O_WRONLY | os.O_CREAT, 0o644))
+		return marker
+
+	def __enter__(self):
+		self.acquire()
+		return self
+
+	def __exit__(self, *exc_info):
+		self.release()
+		return False
+
+def _withdraw(marker):
+	try:
+		os.remove(marker)
+	except OSError:
+		pass # removed as stale by a holder meanwhile
+
+def _alive(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		return e.errno == errno.EPERM # running as another user
+	return True
+
+def actuationLock(action=None):
+	"""The cross-process lock on the actuators, for running action."""
+	return ProcessLock(settings.ACTUATION_LOCK_FILE, preempt=action not in PATIENT)
+
+def preemptRequested(path=None):
+	"""Whether a live process is waiting for the lock on path,
+	settings.ACTUATION_LOCK_FILE by default, and wants the holder to give
+	up. Removes the markers of waiters that died.
+	"""
+	path = settings.ACTUATION_LOCK_FILE if path is None else path
+	directory, name = os.path.split(path)
+	prefix = name + ".preempt."
+	for entry in os.listdir(directory or "."):
+		if not entry.startswith(prefix):
+			continue
+		pid = entry[len(prefix):].split(".")[0]
+		if pid.isdigit() and _alive(int(pid)):
+			return True
+		_withdraw(os.path.join(directory, entry))
+	return False
+
+class _Ticket(object):
+
+	def __init__(self, action, order):
+		self.action = action
+		self.order = order
+		self.granted = False
+		self.superseded = False
+
+	def key(self):
+		return (PRIORITIES.get(self.action, len(PRIORITIES)), self.order)
+
+class Arbiter(object):
+	"""Grants the actuators to one command of this process at a time, and
+	takes the cross-process actuation lock for it.
+	"""
+
+	def __init__(self):
+		self._condition = threading.Condition()
+		self._waiting = [] # heap of (ticket.key(), ticket)
+		self._order = itertools.count()
+		self._busy = False
+		self._process_lock = None
+
+	def acquire(self, action, supersede=True):
+		"""Blocks until action may run. Raises Superseded when a later command
+		replaced it meanwhile. supersede=False keeps action from replacing the
+		commands waiting, for commands the lock runs by itself.
+		"""
+		waited_from = _clock.clock.time()
+		with self._condition:
+			ticket = _Ticket(action, next(self._order))
+			if supersede and action in ABSOLUTE:
+				for key, waiting in self._waiting:
+					if waiting.action not in KEPT:
+						waiting.superseded = True
+				self._condition.notify_all()
+			if not self._busy:
+				self._busy = True
+				ticket.granted = True
+			else:
+				_metrics.ACTUATION_CONTENDED.inc(holder="process")
+				heapq.heappush(self._waiting, (ticket.key(), ticket))
+				while not ticket.granted and not ticket.superseded:
+					self._condition.wait()
+				if not ticket.granted:
+					raise Superseded()
+		try:
+			process_lock = actuationLock(action)
+			process_lock.acquire()
+		except BaseException:
+			self._grantNext()
+			raise
+		if process_lock.contended:
+			_metrics.ACTUATION_CONTENDED.inc(holder="other_process")
+		self._process_lock = process_lock
+		_metrics.ACTUATION_WAIT_SECONDS.observe(_clock.clock.time() - waited_from)
+
+	def release(self):
+		process_lock, self._process_lock = self._process_lock, None
+		process_lock.release()
+		self._grantNext()
+
+	def _grantNext(self):
+		with self._condition:
+			while self._waiting:
+				key, ticket = heapq.heappop(self._waiting)
+				if not ticket.superseded:
+					ticket.granted = True
+					break
+			else:
+				self._busy = False
+			self._condition.notify_all()
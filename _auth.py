@@ -0,0 +1,336 @@
+"""Who may run which commands over the HTTP API.
+
+settings.CREDENTIALS_FILE, written by credentials.py, names the
+credentials, each a dict:
+
+	{"token": "<salt>$<hash>", "role": "unlock", "hours": "06:30-23:00", "days": "mon-fri"}
+	{"pin": "<hash>", "role": "buzz"}
+
+A phone sends its token as "Authorization: Bearer <name>.<secret>", a
+keypad its PIN as "Authorization: PIN <digits>". Only hashes are stored: a
+token's secret as an HMAC-SHA256 under a salt of its own, found by the name
+in front of it; a PIN, which comes without a name, as an HMAC-SHA256 under
+the key in settings.AUTH_KEY_FILE and found by that hash, so the
+credentials file alone gives away no PIN. Either way a request costs one
+hash and one dict lookup, however many credentials there are.
+
+The role says which steps, see _sequences, a credential's commands may
+take: "lock" lock, blink and wait, "buzz" those and buzz, "unlock" all of
+them. "hours" and "days" limit commands to a daily window, which may run
+past midnight, and to some weekdays like in _rules; reading the state is
+allowed any time.
+
+Authorizer.update parses only the credentials that changed since the last
+update, so the lock daemon reloads the file as it is saved. After
+AUTH_FAILURES failed attempts from one address within AUTH_FAILURE_WINDOW
+seconds, that address is refused without checking until they age out;
+nothing sleeps, and other addresses are served as before.
+"""
+import os
+import re
+import hmac
+import json
+import time
+import base64
+import errno
+import hashlib
+import binascii
+import logging
+import threading
+
+import _clock
+import _config
+import _metrics
+import _rules
+import _sequences
+import settings
+
+log = logging.getLogger(__name__)
+
+LOCK = "lock"
+BUZZ = "buzz"
+UNLOCK = "unlock"
+# role -> the sequence steps its commands may take
+ROLES = {
+	LOCK: frozenset([_sequences.LOCK, _sequences.BLINK, _sequences.WAIT]),
+	BUZZ: frozenset([_sequences.LOCK, _sequences.BLINK, _sequences.WAIT, _sequences.BUZZ]),
+	UNLOCK: frozenset(_sequences.STEPS),
+}
+BEARER = "bearer"
+PIN = "pin"
+# addresses with failures remembered before the ones that aged out are dropped
+MAX_FAILING_SOURCES = 1024
+
+_KEYS = ("token", "pin", "role", "hours", "days")
+_TOKEN_HASH = re.compile(r"^[0-9a-f]+\$[0-9a-f]{64}$")
+_PIN_HASH = re.compile(r"^[0-9a-f]{64}$")
+_HOURS = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$")
+
+class CredentialError(ValueError):
+	pass
+
+class AuthError(Exception):
+	pass
+
+class Unauthorized(AuthError):
+	"""No credential, or one that matches none."""
+
+class Forbidden(AuthError):
+	"""A credential whose role or hours do not allow the command."""
+
+class TooManyAttempts(AuthError):
+
+	def __init__(self, retry_after):
+		AuthError.__init__(self, "too many failed attempts, retry in %d s" % retry_after)
+		self.retry_after = retry_after
+
+def _bytes(text):
+	return text if isinstance(text, bytes) else text.encode("utf-8")
+
+def hashToken(secret, salt):
+	return hmac.new(_bytes(salt), _bytes(secret), hashlib.sha256).hexdigest()
+
+def hashPin(pin, key):
+	return hmac.new(key, b"pin:" + _bytes(pin), hashlib.sha256).hexdigest()
+
+def newToken(name):
+	"""A new token for name and the hash to store for it, as (token, hash)."""
+	secret = base64.urlsafe_b64encode(os.urandom(18)).decode("ascii") # no "." or padding
+	salt = binascii.hexlify(os.urandom(16)).decode("ascii")
+	return "%s.%s" % (name, secret), "%s$%s" % (salt, hashToken(secret, salt))
+
+class Credential(object):
+
+	def __init__(self, name, role, token=None, pin=None, days=None, hours=None):
+		self.name = name
+		self.role = role
+		self.token = token # (salt, hash) of a token
+		self.pin = pin # hash of a PIN
+		self.days = days # weekdays it may run commands on, 0 is Monday, None for all
+		self.hours = hours # (start, end) minutes into the day, None for all day
+
+	def within(self, now):
+		"""Whether now is in the credential's days and hours."""
+		local = time.localtime(now)
+		if self.days is not None and local.tm_wday not in self.days:
+			return False
+		if self.hours is None:
+			return True
+		minute = local.tm_hour * 60 + local.tm_min
+		start, end = self.hours
+		if start < end:
+			return start <= minute < end
+		return minute >= start or minute < end # past midnight
+
+	def mayRun(self, action):
+		"""Whether the role allows every step of action. Raises
+		NotImplementedError for an unknown command.
+		"""
+		allowed = ROLES[self.role]
+		return all(step.name in allowed for channel in _sequences.lookup(action).channels for step in channel)
+
+	def __repr__(self):
+		return "%s (%s)" % (self.name, self.role)
+
+def parse(name, spec, key=None):
+	"""The Credential called name written as spec, raises CredentialError when
+	it is not one. key is the PIN key, needed for PINs.
+	"""
+	if not isinstance(spec, dict):
+		raise CredentialError("credential %s is not a dict" % name)
+	unknown = set(spec).difference(_KEYS)
+	if unknown:
+		raise CredentialError("credential %s: unknown keys %s" % (name, ", ".join(sorted(unknown))))
+	if ("token" in spec) == ("pin" in spec):
+		raise CredentialError("credential %s needs either token or pin" % name)
+	if spec.get("role") not in ROLES:
+		raise CredentialError("credential %s: role is one of %s" % (name, ", ".join(sorted(ROLES))))
+	credential = Credential(name, spec["role"])
+	if "token" in spec:
+		if not _TOKEN_HASH.match(str(spec["token"])):
+			raise CredentialError("credential %s: token is not <salt>$<hash>" % name)
+		salt, digest = str(spec["token"]).split("$")
+		credential.token = (salt, digest)
+	else:
+		if not _PIN_HASH.match(str(spec["pin"])):
+			raise CredentialError("credential %s: pin is not a hash" % name)
+		if key is None:
+			raise CredentialError("credential %s: PINs need the key in %s" % (name, settings.AUTH_KEY_FILE))
+		credential.pin = str(spec["pin"])
+	if "days" in spec:
+		try:
+			credential.days = _rules.parseDays(spec["days"])
+		except _rules.RuleError as e:
+			raise CredentialError("credential %s: %s" % (name, e))
+	if "hours" in spec:
+		match = _HOURS.match(str(spec["hours"]))
+		if not match or int(match.group(1)) > 23 or int(match.group(3)) > 23 or \
+				int(match.group(2)) > 59 or int(match.group(4)) > 59:
+			raise CredentialError("credential %s: hours %r is not HH:MM-HH:MM" % (name, spec["hours"]))
+		hours = [int(part) for part in match.groups()]
+		credential.hours = (hours[0] * 60 + hours[1], hours[2] * 60 + hours[3])
+		if credential.hours[0] == credential.hours[1]:
+			raise CredentialError("credential %s: hours %r is empty" % (name, spec["hours"]))
+	return credential
+
+def read(path=None):
+	"""The credentials in path, settings.CREDENTIALS_FILE by default, as
+	written. Raises CredentialError.
+	"""
+	path = settings.CREDENTIALS_FILE if path is None else path
+	try:
+		with open(path) as f:
+			specs = json.load(f)
+	except IOError as e:
+		raise CredentialError("cannot read %s: %s" % (path, e))
+	except ValueError as e:
+		raise CredentialError("%s is not JSON: %s" % (path, e))
+	if not isinstance(specs, dict):
+		raise CredentialError("%s holds a JSON object of names and credentials" % path)
+	return specs
+
+def write(specs, path=None):
+	"""Replaces the credentials in path, settings.CREDENTIALS_FILE by default,
+	with specs, readable by the owner alone.
+	"""
+	path = settings.CREDENTIALS_FILE if path is None else path
+	temporary_path = path + ".tmp"
+	with os.fdopen(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+		f.write(json.dumps(specs, indent=2, sort_keys=True))
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(temporary_path, path) # atomic replace, the daemon sees the whole file
+
+def readKey(path=None, create=False):
+	"""The PIN key in path, settings.AUTH_KEY_FILE by default, None when there
+	is none. create makes one, readable by the owner alone, when there is none.
+	"""
+	path = settings.AUTH_KEY_FILE if path is None else path
+	try:
+		with open(path, "rb") as f:
+			return f.read().strip()
+	except IOError as e:
+		if e.errno != errno.ENOENT:
+			raise
+	if not create:
+		return None
+	key = binascii.hexlify(os.urandom(32))
+	with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as f:
+		f.write(key)
+	return key
+
+class Authorizer(object):
+	"""Checks the Authorization header of requests against the credentials,
+	name -> spec as in the file, key being the PIN key.
+	"""
+
+	def __init__(self, specs=None, key=None):
+		self._key = key
+		self._lock = threading.Lock()
+		self._specs = {} # name -> spec as of the last update
+		self._credentials = {} # name -> Credential
+		self._pins = {} # PIN hash -> Credential
+		self._failures = {} # address -> times of its failed attempts in the window
+		if specs:
+			self.update(specs)
+
+	def __len__(self):
+		with self._lock:
+			return len(self._credentials)
+
+	def update(self, specs):
+		"""Makes specs the credentials, parsing the ones that differ from the
+		last update alone. Raises CredentialError and keeps the credentials
+		when one does not parse. Returns the names added, changed and removed.
+		"""
+		with self._lock:
+			parsed = dict((name, parse(name, spec, self._key)) for name, spec in specs.items()
+				if self._specs.get(name) != spec)
+			removed = set(self._specs).difference(specs)
+			claimed = {} # PIN hash -> name, of the parsed ones
+			for credential in parsed.values():
+				if credential.pin is None:
+					continue
+				holder = self._pins.get(credential.pin)
+				if holder is not None and holder.name not in parsed and holder.name not in removed:
+					claimed.setdefault(credential.pin, holder.name)
+				if credential.pin in claimed:
+					raise CredentialError("%s and %s have the same PIN" % (claimed[credential.pin], credential.name))
+				claimed[credential.pin] = credential.name
+			added = set(parsed).difference(self._specs)
+			for name in removed.union(parsed):
+				old = self._credentials.pop(name, None)
+				if old is not None and old.pin is not None:
+					del self._pins[old.pin]
+				self._specs.pop(name, None)
+			for name, credential in parsed.items():
+				self._specs[name] = specs[name]
+				self._credentials[name] = credential
+				if credential.pin is not None:
+					self._pins[credential.pin] = credential
+		return added, set(parsed).difference(added), removed
+
+	def authenticate(self, authorization, source):
+		"""The Credential the Authorization header value authorization
+		matches, for a request from address source. Raises Unauthorized or
+		TooManyAttempts.
+		"""
+		now = _clock.clock.time()
+		config = _config.current # both limits from one config, however it reloads
+		with self._lock:
+			failures = self._recentFailures(source, now, config.AUTH_FAILURE_WINDOW)
+			if len(failures) >= config.AUTH_FAILURES:
+				_metrics.AUTH_REFUSED.inc(reason="too_many_attempts")
+				raise TooManyAttempts(failures[-config.AUTH_FAILURES] + config.AUTH_FAILURE_WINDOW - now)
+		credential = self._match(authorization or "")
+		if credential is None:
+			with self._lock:
+				self._failures.setdefault(source, []).append(now)
+				if len(self._failures) > MAX_FAILING_SOURCES:
+					for address in list(self._failures):
+						self._recentFailures(address, now, config.AUTH_FAILURE_WINDOW)
+			_metrics.AUTH_REFUSED.inc(reason="unauthorized")
+			log.warning("%s: credential not accepted", source)
+			raise Unauthorized("a valid token or PIN is needed")
+		return credential
+
+	def authorize(self, authorization, action, source):
+		"""The Credential allowed to run action now, see authenticate. Raises
+		Forbidden as well, and NotImplementedError for an unknown command.
+		"""
+		credential = self.authenticate(authorization, source)
+		if not credential.mayRun(action):
+			_metrics.AUTH_REFUSED.inc(reason="forbidden")
+			raise Forbidden("%s may not %s" % (credential.name, action))
+		if not credential.within(_clock.clock.time()):
+			_metrics.AUTH_REFUSED.inc(reason="forbidden")
+			raise Forbidden("%s may not run commands at this time" % credential.name)
+		return credential
+
+	def _match(self, authorization):
+		scheme, _, secret = authorization.strip().partition(" ")
+		scheme = scheme.lower()
+		secret = secret.strip()
+		if scheme == BEARER:
+			name, _, secret = secret.rpartition(".")
+			with self._lock:
+				credential = self._credentials.get(name)
+			if credential is None or credential.token is None:
+				return None
+			salt, digest = credential.token
+			return credential if hmac.compare_digest(hashToken(secret, salt), digest) else None
+		if scheme == PIN and secret and self._key is not None:
+			digest = hashPin(secret, self._key)
+			with self._lock:
+				return self._pins.get(digest)
+		return None
+
+	def _recentFailures(self, source, now, window):
+		# caller holds _lock; forgets failures older than window seconds
+		failures = self._failures.get(source)
+		if failures is None:
+			return []
+		failures[:] = [at for at in failures if at > now - window]
+		if not failures:
+			del self._failures[source]
+		return failures
@@ -0,0 +1,90 @@
+"""Time source for everything that waits: the servo, buzzer and LED timings,
+the scheduler and the simulated GPIO timestamps all go through clock.
+
+Modules look clock up on every call, so use() swaps it everywhere, e.g. a
+VirtualClock to run whole lock timelines in simulated time.
+"""
+import time
+import heapq
+import itertools
+import threading
+
+class RealClock(object):
+	"""Wall-clock time."""
+
+	virtual = False
+
+	def time(self):
+		return time.time()
+
+	def sleep(self, seconds):
+		time.sleep(seconds)
+
+class VirtualClock(object):
+	"""Deterministic simulated time starting at start seconds. sleep() moves
+	time forward and returns at once, first running the timers that fall due
+	on the way, each at exactly its deadline.
+
+	Parallel work is simulated with runForked: the forked function sees time
+	start from the given point and its sleeps only move its own time, so
+	channels running side by side get exact, overlapping timestamps.
+	"""
+
+	virtual = True
+
+	def __init__(self, start=0.0):
+		self._now = start
+		self._timers = []
+		self._counter = itertools.count()
+		self._lock = threading.RLock()
+		self._forks = threading.local()
+
+	def time(self):
+		forked = getattr(self._forks, "now", None)
+		return self._now if forked is None else forked
+
+	def sleep(self, seconds):
+		if getattr(self._forks, "now", None) is not None:
+			self._forks.now += seconds
+		else:
+			self.advance(seconds)
+
+	def advance(self, seconds):
+		self.advanceTo(self._now + seconds)
+
+	def advanceTo(self, target):
+		"""Moves time to target, running the timers due by then in order."""
+		while True:
+			with self._lock:
+				if not self._timers or self._timers[0][0] > target:
+					self._now = max(self._now, target)
+					return
+				deadline, _, callback, args = heapq.heappop(self._timers)
+				self._now = max(self._now, deadline)
+			callback(*args) # may sleep, which advances time again
+
+	def callAt(self, deadline, callback, *args):
+		"""Runs callback(*args) once time reaches deadline."""
+		with self._lock:
+			heapq.heappush(self._timers, (deadline, next(self._counter), callback, args))
+
+	def runForked(self, start, function):
+		"""Runs function with time starting at start and returns the time it
+		finished at, leaving the clock's own time untouched.
+		"""
+		outer = getattr(self._forks, "now", None)
+		self._forks.now = start
+		try:
+			function()
+			return self._forks.now
+		finally:
+			self._forks.now = outer
+
+clock = RealClock()
+
+def use(new_clock):
+	"""Makes new_clock the clock for every module and returns the old one."""
+	global clock
+	old_clock = clock
+	clock = new_clock
+	return old_clock
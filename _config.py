@@ -0,0 +1,351 @@
+"""Settings and pins from a file, checked before they are used and reloaded
+when the file changes.
+
+settings.CONFIG_FILE is a JSON object overriding the constants in
+settings.py and pins.py by name, e.g.
+
+	{"BUZZ_DURATION": 2, "SERVO_LOCKED_POSITION": 8.5, "BUZZER_PIN": 37}
+
+load() merges it over the defaults and checks the result as a whole: names,
+types, servo positions within 2.5 - 10.5, pins that exist and are used once,
+the same for each door's overrides in DOORS, sequences and rules that
+parse. What passes becomes a read-only Config, and use() makes it current
+and puts its values on the settings and pins modules, where the rest of the
+code reads them.
+
+The lock daemon watches the file with inotify, without polling, and hands
+every version that passes to LockEngine.reconfigure, which swaps it in
+between commands. A version that does not pass is logged and the running
+config stays. Names in RESTART only take effect when the daemon starts.
+"""
+import os
+import json
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+import _rules
+import _sequences
+import pins
+import settings
+
+log = logging.getLogger(__name__)
+
+# names only read while a process starts up
+RESTART = frozenset([
+	"STATE_BACKEND", "PERSISTENT_STATE_FILE", "PERSISTENT_STATE_JOURNAL_FILE",
+	"DAEMON_SOCKET_FILE", "METRICS_ADDRESS", "METRICS_PORT", "HTTP_API_ADDRESS", "HTTP_API_PORT",
+	"SERVO_PWM_BACKEND", "PIGPIO_HOST", "PIGPIO_PORT", "SERVO_PROFILE_FILE", "ACTUATION_LOCK_FILE",
+	"SHARED_STATE_FILE", "HISTORY_FILE", "HISTORY_WRITE_DELAY", "HISTORY_BATCH_SIZE",
+	"DOORS", "DOOR_WORKERS", "TOGGLE_LOCK_PIN", "DELAY_LOCK_PIN", "BUTTON_BOUNCE_TIME",
+	"STATE_WRITE_DELAY", "STATE_JOURNAL_COMPACT_RECORDS", "CREDENTIALS_FILE", "AUTH_KEY_FILE",
+])
+# pins the engine sets up again when they move, as outputs and as inputs
+OUTPUT_PINS = ("SERVO_PIN", "LOCK_STATUS_LED_PIN", "BUZZER_PIN")
+INPUT_PINS = ("DOOR_SENSOR_PIN",)
+# board pin numbers of the Pi's GPIOs
+BOARD_PINS = frozenset([3, 5, 7, 8, 10, 11, 12, 13, 15, 16, 18, 19, 21, 22, 23, 24, 26, 27, 28, 29,
+	31, 32, 33, 35, 36, 37, 38, 40])
+SERVO_POSITIONS = (2.5, 10.5) # duty cycles, 0 - 180 degrees
+# the door _control_lock and the lock daemon drive, see _doors
+MAIN_DOOR = "main"
+# names a door in DOORS can override, the rest comes from pins.py and settings.py
+DOOR_PINS = ("SERVO_PIN", "LOCK_STATUS_LED_PIN", "BUZZER_PIN", "DOOR_SENSOR_PIN")
+DOOR_SETTINGS = ("SERVO_ROTATION_DURATION", "BUZZ_DURATION", "SERVO_LOCKED_POSITION",
+	"SERVO_UNLOCKED_POSITION", "DELAYED_LOCK_DELAY")
+# state keys of the journal backend are at most 16 bytes, see _state_journal
+_MAX_STATE_KEY_LENGTH = 16
+# names taking whole numbers
+_WHOLE = frozenset(["DELAYED_LOCK_DELAY", "BUTTON_BOUNCE_TIME", "STATE_JOURNAL_COMPACT_RECORDS",
+	"METRICS_PORT", "HTTP_API_PORT", "PIGPIO_PORT", "DOOR_WORKERS", "SERVO_RAMP_STEPS", "HISTORY_BATCH_SIZE",
+	"AUTH_FAILURES"])
+_AT_LEAST_ONE = frozenset(["STATE_JOURNAL_COMPACT_RECORDS", "DOOR_WORKERS", "HISTORY_BATCH_SIZE", "AUTH_FAILURES"])
+_PORTS = frozenset(["METRICS_PORT", "HTTP_API_PORT", "PIGPIO_PORT"])
+_CHOICES = {
+	"GPIO_BACKEND": ("rpi", "sim"),
+	"STATE_BACKEND": ("json", "journal"),
+	"SERVO_PWM_BACKEND": ("software", "pigpio"),
+}
+# not settable from the file: read before it, on import of _gpio; use the
+# DOOR_LOCK_GPIO environment variable instead of GPIO_BACKEND
+_FIXED = frozenset(["CONFIG_FILE", "GPIO_BACKEND"])
+
+class ConfigError(ValueError):
+	pass
+
+def _moduleValues(module):
+	return dict((name, value) for name, value in vars(module).items() if name.isupper() and not name.startswith("_"))
+
+class Config(object):
+	"""Values by name, read as attributes and never changed. Only load() and
+	check() say whether they are valid.
+	"""
+
+	def __init__(self, values):
+		object.__setattr__(self, "_values", dict(values))
+		# pin number -> name, for telling where a pin went
+		object.__setattr__(self, "pins", dict((value, name) for name, value in self._values.items()
+			if name.endswith("_PIN") and value is not None))
+
+	def __getattr__(self, name):
+		try:
+			return self._values[name]
+		except KeyError:
+			raise AttributeError(name)
+
+	def __setattr__(self, name, value):
+		raise AttributeError("a Config does not change, load another one")
+
+	def values(self):
+		return dict(self._values)
+
+	def replace(self, **values):
+		"""A Config like this one with values changed, not checked."""
+		merged = dict(self._values)
+		merged.update(values)
+		return Config(merged)
+
+	def changed(self, other):
+		"""Names whose values differ in other."""
+		return set(name for name in set(self._values) | set(other._values)
+			if self._values.get(name) != other._values.get(name))
+
+def defaults():
+	"""The values in pins.py and settings.py as they were imported."""
+	return Config(_DEFAULTS)
+
+def load(path=None):
+	"""The defaults overridden by the file at path, settings.CONFIG_FILE by
+	default, checked. Without a file it is the defaults. Raises ConfigError.
+	"""
+	path = settings.CONFIG_FILE if path is None else path
+	try:
+		with open(path) as f:
+			overrides = json.load(f)
+	except IOError as e:
+		if e.errno != errno.ENOENT:
+			raise ConfigError("cannot read %s: %s" % (path, e))
+		overrides = {}
+	except ValueError as e:
+		raise ConfigError("%s is not JSON: %s" % (path, e))
+	if not isinstance(overrides, dict):
+		raise ConfigError("%s holds a JSON object of names and values" % path)
+	for name in overrides:
+		if name not in _DEFAULTS:
+			raise ConfigError("%s: unknown name %s" % (path, name))
+		if name in _FIXED:
+			raise ConfigError("%s: %s cannot be set here" % (path, name))
+	config = defaults().replace(**overrides)
+	check(config)
+	return config
+
+def check(config):
+	"""Raises ConfigError naming the first value of config that cannot be used."""
+	for name in sorted(_DEFAULTS):
+		_checkValue(name, getattr(config, name), _DEFAULTS[name])
+	used = {}
+	for name in sorted(config.values()):
+		if name.endswith("_PIN") and getattr(config, name) is not None:
+			pin = getattr(config, name)
+			if pin not in BOARD_PINS:
+				raise ConfigError("%s: board pin %d is not a GPIO" % (name, pin))
+			if pin in used:
+				raise ConfigError("%s and %s are both on pin %d" % (used[pin], name, pin))
+			used[pin] = name
+	_checkDoors(config, dict((pin, ("", name)) for pin, name in used.items()))
+	try:
+		_sequences.compiled(config.SEQUENCES) # kept for lookups once config is used
+	except _sequences.SequenceError as e:
+		raise ConfigError(str(e))
+	try:
+		_rules.Holidays(config.HOLIDAYS)
+		for name, spec in sorted(config.RULES.items()):
+			_rules.parse(name, spec, config.SEQUENCES)
+	except _rules.RuleError as e:
+		raise ConfigError(str(e))
+
+def _checkDoors(config, used):
+	"""Checks each door's overrides like the names they override. A door's
+	pin can be another door's or the main one's under the same name, e.g. a
+	shared buzzer, never under another name. used maps pins to (door, name).
+	"""
+	for door, overrides in sorted(config.DOORS.items()):
+		if not isinstance(overrides, dict):
+			raise ConfigError("DOORS: %s is a JSON object" % door)
+		unknown = set(overrides).difference(DOOR_PINS + DOOR_SETTINGS)
+		if unknown:
+			raise ConfigError("DOORS: unknown names for %s: %s" % (door, ", ".join(sorted(unknown))))
+		doorStateKey(door, config.LOCKED_STATE_KEY)
+		for name, value in sorted(overrides.items()):
+			try:
+				_checkValue(name, value, _DEFAULTS[name])
+			except ConfigError as e:
+				raise ConfigError("DOORS: %s %s" % (door, e))
+		for name in DOOR_PINS:
+			pin = overrides.get(name, None if name == "DOOR_SENSOR_PIN" and door != MAIN_DOOR else getattr(config, name))
+			if pin is None:
+				continue
+			if pin not in BOARD_PINS:
+				raise ConfigError("DOORS: %s %s: board pin %d is not a GPIO" % (door, name, pin))
+			other, other_name = used.setdefault(pin, (door, name))
+			if other_name != name:
+				raise ConfigError("DOORS: %s %s and %s %s are both on pin %d" % (other or "the main", other_name, door, name, pin))
+
+def doorStateKey(door, locked_state_key):
+	"""The state key door keeps its lock state under: locked_state_key for
+	the main door, the door's name before it for the others. Raises
+	ConfigError when it is too long.
+	"""
+	key = locked_state_key if door == MAIN_DOOR else "%s.%s" % (door, locked_state_key)
+	if len(key.encode("utf-8")) > _MAX_STATE_KEY_LENGTH:
+		raise ConfigError("door name %r is too long for its state key" % door)
+	return key
+
+def _checkValue(name, value, default):
+	if isinstance(default, bool):
+		if not isinstance(value, bool):
+			raise ConfigError("%s is true or false" % name)
+	elif isinstance(default, (int, float)) or name.endswith("_PIN"):
+		if name.endswith("_PIN") and value is None and default is None:
+			return # optional pin
+		if isinstance(value, bool) or not isinstance(value, (int, float)):
+			raise ConfigError("%s is a number" % name)
+		if (name in _WHOLE or name.endswith("_PIN")) and not isinstance(value, int):
+			raise ConfigError("%s is a whole number" % name)
+		if value < (1 if name in _AT_LEAST_ONE or name in _PORTS else 0):
+			raise ConfigError("%s is too small: %r" % (name, value))
+		if name in _PORTS and value > 65535:
+			raise ConfigError("%s is not a port: %r" % (name, value))
+		if name.startswith("SERVO_") and name.endswith("_POSITION") and \
+				not SERVO_POSITIONS[0] <= value <= SERVO_POSITIONS[1]:
+			raise ConfigError("%s is a duty cycle from %g to %g, not %r" % ((name,) + SERVO_POSITIONS + (value,)))
+	elif isinstance(default, (str, type(u""))):
+		if not isinstance(value, (str, type(u""))):
+			raise ConfigError("%s is text" % name)
+		if name in _CHOICES and value not in _CHOICES[name]:
+			raise ConfigError("%s is one of %s" % (name, ", ".join(_CHOICES[name])))
+	elif isinstance(default, (dict, list)) and not isinstance(value, type(default)):
+		raise ConfigError("%s is a JSON %s" % (name, "object" if isinstance(default, dict) else "array"))
+
+def use(config):
+	"""Makes config current and puts its values on the settings and pins
+	modules. Returns the config it replaced.
+
+	current changes in one assignment. Code reading several values that
+	belong together outside LockEngine, which reconfigures between commands,
+	takes them from one _config.current, so it sees one config or the other
+	and never a mix: two reads of a module can fall on either side of use.
+	"""
+	global current
+	with _use_lock:
+		old, changed = current, current.changed(config)
+		current = config
+		for module in (pins, settings):
+			values = dict((name, getattr(config, name)) for name in changed
+				if (name in _PIN_NAMES) == (module is pins))
+			vars(module).update(values)
+	return old
+
+def setUp():
+	"""Uses settings.CONFIG_FILE when there is one, for processes starting.
+	Raises ConfigError.
+	"""
+	if os.path.exists(settings.CONFIG_FILE):
+		use(load())
+
+def peek(name):
+	"""The value settings.CONFIG_FILE sets name to, or the current one,
+	without checking the rest of the file.
+	"""
+	try:
+		with open(settings.CONFIG_FILE) as f:
+			overrides = json.load(f)
+	except (IOError, ValueError):
+		overrides = {}
+	if isinstance(overrides, dict) and name in overrides and name not in _FIXED:
+		return overrides[name]
+	return getattr(pins if name in _PIN_NAMES else settings, name)
+
+def forReload(new):
+	"""new, with the names in RESTART kept at their current values, checked
+	again, and the names left out. Raises ConfigError.
+	"""
+	kept = set(name for name in RESTART if getattr(new, name) != getattr(current, name))
+	if not kept:
+		return new, kept
+	config = new.replace(**dict((name, getattr(current, name)) for name in kept))
+	check(config)
+	return config, kept
+
+# inotify(7)
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII") # wd, mask, cookie, name length
+
+class Watcher(object):
+	"""Calls on_change() from its own thread whenever the file at path is
+	written, replaced or removed. The thread sleeps in select() on the
+	inotify descriptor until then. Raises OSError where there is no inotify.
+	"""
+
+	def __init__(self, path, on_change):
+		self._name = os.path.basename(path).encode("utf-8")
+		self._on_change = on_change
+		libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+		if not hasattr(libc, "inotify_init1"):
+			raise OSError(errno.ENOSYS, "no inotify")
+		self._fd = libc.inotify_init1(_IN_CLOEXEC)
+		if self._fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+		# the directory, editors replace files by renaming over them
+		directory = os.path.dirname(os.path.abspath(path)).encode("utf-8")
+		mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_MOVED_FROM | _IN_CREATE | _IN_DELETE
+		if libc.inotify_add_watch(self._fd, directory, mask) < 0:
+			error = ctypes.get_errno()
+			os.close(self._fd)
+			raise OSError(error, "cannot watch %s" % directory)
+		self._stop_read, self._stop_write = os.pipe() # written by close
+		self._thread = threading.Thread(target=self._run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def _run(self):
+		while True:
+			readable = select.select([self._fd, self._stop_read], [], [])[0]
+			if self._stop_read in readable:
+				return
+			data = os.read(self._fd, 4096)
+			changed = False
+			offset = 0
+			while offset < len(data):
+				wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+				offset += _EVENT.size
+				name = data[offset:offset + length].rstrip(b"\0")
+				offset += length
+				changed = changed or name == self._name
+			if changed:
+				try:
+					self._on_change()
+				except Exception:
+					log.exception("reacting to a changed config failed")
+
+	def close(self):
+		os.write(self._stop_write, b"x")
+		self._thread.join()
+		for fd in (self._fd, self._stop_read, self._stop_write):
+			os.close(fd)
+
+_PIN_NAMES = frozenset(_moduleValues(pins))
+_DEFAULTS = _moduleValues(pins)
+_DEFAULTS.update(_moduleValues(settings))
+# the config the modules hold now, see use
+current = defaults()
+_use_lock = threading.Lock() # one use at a time
@@ -1,124 +1,228 @@
-import RPi.GPIO as GPIO
-import time
-import threading
-import json
+from _gpio import GPIO
+import logging
+import sqlite3
+import functools
 
+import _clock
+import _actuation
+import _metrics
+import _event_bus
+import _servo_pwm
+import _servo_motion
+import _arbiter
+import _sequences
+import _history
+import _door_sensor
+from _state_store import StateStore, JsonStateFile
+from _state_journal import StateJournal
 import pins
 import commands
 import settings
 
+log = logging.getLogger(__name__)
+
+# created on first use, see _getStateStore
+_state_store = None
+
 def main(action):
+	outcome = "error"
+	servo = None
+	# other processes driving the lock wait, or make a delayed lock give up
+	actuation_lock = _arbiter.actuationLock(action)
+	actuation_lock.acquire()
 	try:
-		servo = _setup()
-		if action == commands.LOCK:
-			_lock(servo)
-		elif action == commands.UNLOCK:
-			_unlock(servo)
-		elif action == commands.BUZZ:
-			# buzz_thread = threading.Thread(target=_buzz)
-			# buzz_thread.start()
-			_buzz()
-		elif action == commands.BUZZ_AND_UNLOCK:
-			_buzzAndUnlock(servo)
-		elif action == commands.TOGGLE:
-			_toggleLock(servo)
-		elif action == commands.DELAY_LOCK:
-			_delayLock(servo)
-		else:
-			raise NotImplementedError
+		with _metrics.PHASE_SECONDS.time(phase="setup"):
+			servo = _setup()
+		with _metrics.PHASE_SECONDS.time(phase="actuation"):
+			_dispatch(servo, action)
+		outcome = "ok"
+	except Exception as e:
+		outcome = _outcomeOf(e)
+		raise
 	finally:
-		_tearDown(servo)
+		try:
+			if servo is not None:
+				with _metrics.PHASE_SECONDS.time(phase="teardown"):
+					_tearDown(servo)
+			_countCommand(action, outcome)
+			_recordScript(action, outcome)
+		finally:
+			actuation_lock.release()
+
+def _recordScript(action, outcome):
+	# a history that cannot be written must not hide how the command went
+	try:
+		history = _history.getHistory()
+		history.record(action, _history.SCRIPT, outcome)
+		history.flush() # before the process exits
+	except sqlite3.Error:
+		log.exception("recording %s in the history failed", action)
+
+def _outcomeOf(error):
+	# the outcome a command failing with error is counted and recorded with
+	if isinstance(error, NotImplementedError):
+		return "unknown"
+	if isinstance(error, _arbiter.Preempted):
+		return "preempted" # the waiting process's command decides how the door ends up
+	if isinstance(error, _door_sensor.DoorOpen):
+		return "door_open"
+	return "error"
+
+def _countCommand(action, outcome):
+	# any string can come in, keep the label values to the known commands
+	command = action if action in commands.ALL else "other"
+	_metrics.COMMANDS.inc(command=command, outcome=outcome)
+
+def _dispatch(servo, action):
+	_runSequence(servo, _sequences.lookup(action))
+
+# The functions below drive the main door from pins.py and settings.py, or
+# with door, a _doors.Door, that door from its options and state key.
+
+def _runSequence(servo, sequence, door=None):
+	if len(sequence.channels) == 1:
+		_runChannel(servo, sequence.channels[0], door)
+		return
+	try:
+		# channels are independent, e.g. let the door open while buzzing
+		_actuation.run(dict((i, functools.partial(_runChannel, servo, channel, door))
+			for i, channel in enumerate(sequence.channels)))
+	finally:
+		if sequence.uses(_sequences.BUZZ):
+			GPIO.output(_option(door, "BUZZER_PIN"),GPIO.LOW) # also if the buzzer never started
+
+def _runChannel(servo, steps, door=None):
+	for step in steps:
+		_runStep(servo, step, door)
 
-def _setup():
+def _runStep(servo, step, door=None):
+	if step.name == _sequences.LOCK:
+		_lock(servo, door)
+	elif step.name == _sequences.UNLOCK:
+		_unlock(servo, door)
+	elif step.name == _sequences.TOGGLE:
+		_toggleLock(servo, door)
+	elif step.name == _sequences.BUZZ:
+		_buzz(step.seconds, door)
+	elif step.name == _sequences.BLINK:
+		_blinkingSleep(_option(door, "DELAYED_LOCK_DELAY") if step.seconds is None else step.seconds, door)
+	elif step.name == _sequences.WAIT:
+		_clock.clock.sleep(step.seconds)
+	else:
+		raise NotImplementedError
+
+def _option(door, name):
+	# a pin from pins.py or a setting from settings.py, or door's own
+	if door is not None:
+		return door.options[name]
+	return getattr(pins if name.endswith("_PIN") else settings, name)
+
+def _stateKey(door):
+	return settings.LOCKED_STATE_KEY if door is None else door.state_key
+
+def _publish(event, door, **fields):
+	if door is not None:
+		fields["door"] = door.name
+	_event_bus.bus.publish(event, **fields)
+
+def _setup(door=None):
 	# servo
 	GPIO.setwarnings(False)
 	GPIO.setmode(GPIO.BOARD)
-	GPIO.setup(pins.SERVO_PIN, GPIO.OUT)
-	servo = GPIO.PWM(pins.SERVO_PIN, 50) # 50Hz
+	GPIO.setup(_option(door, "SERVO_PIN"), GPIO.OUT)
+	servo = _servo_pwm.open(GPIO, _option(door, "SERVO_PIN"), 50) # 50Hz
 	# lock status LED
-	GPIO.setup(pins.LOCK_STATUS_LED_PIN, GPIO.OUT)
+	GPIO.setup(_option(door, "LOCK_STATUS_LED_PIN"), GPIO.OUT)
 	# buzzer pin
-	GPIO.setup(pins.BUZZER_PIN, GPIO.OUT)
-	GPIO.output(pins.BUZZER_PIN,GPIO.LOW)
+	GPIO.setup(_option(door, "BUZZER_PIN"), GPIO.OUT)
+	GPIO.output(_option(door, "BUZZER_PIN"),GPIO.LOW)
+	# door sensor, if there is one
+	_door_sensor.setup(GPIO, _option(door, "DOOR_SENSOR_PIN"))
 	return servo
 
 def _tearDown(servo):
 	servo.stop()
+	_getStateStore().flush()
 	# GPIO.cleanup() # disbled in order to keep LED lit
 
-def _lock(servo):
-	servo.start(settings.SERVO_LOCKED_POSITION)
-	GPIO.output(pins.LOCK_STATUS_LED_PIN,GPIO.HIGH)
-	time.sleep(settings.SERVO_ROTATION_DURATION)
-	_setStateValue(settings.LOCKED_STATE_KEY, True)
+def _lock(servo, door=None):
+	if _door_sensor.isOpen(GPIO, _option(door, "DOOR_SENSOR_PIN")):
+		raise _door_sensor.DoorOpen() # the bolt would hit the frame
+	GPIO.output(_option(door, "LOCK_STATUS_LED_PIN"),GPIO.HIGH)
+	_servo_motion.move(servo, _servo_motion.LOCK, None if door is None else door.options)
+	_setStateValue(_stateKey(door), True)
+	_publish(_event_bus.LOCK, door)
 
-def _unlock(servo):
-	servo.start(settings.SERVO_UNLOCKED_POSITION)
-	GPIO.output(pins.LOCK_STATUS_LED_PIN,GPIO.LOW)
-	time.sleep(settings.SERVO_ROTATION_DURATION)
-	_setStateValue(settings.LOCKED_STATE_KEY, False)
+def _unlock(servo, door=None):
+	GPIO.output(_option(door, "LOCK_STATUS_LED_PIN"),GPIO.LOW)
+	_servo_motion.move(servo, _servo_motion.UNLOCK, None if door is None else door.options)
+	_setStateValue(_stateKey(door), False)
+	_publish(_event_bus.UNLOCK, door)
 
-def _buzz():
+def _buzz(duration=None, door=None):
 	try:
-		GPIO.output(pins.BUZZER_PIN,GPIO.HIGH) # start buzzing
-		time.sleep(settings.BUZZ_DURATION)
+		GPIO.output(_option(door, "BUZZER_PIN"),GPIO.HIGH) # start buzzing
+		_publish(_event_bus.BUZZ_START, door)
+		_clock.clock.sleep(_option(door, "BUZZ_DURATION") if duration is None else duration)
 	finally:
-		GPIO.output(pins.BUZZER_PIN,GPIO.LOW) # end buzzing
-
-def _buzzAndUnlock(servo):
-	# buzz_thread = threading.Thread(target=_buzz)
-	# buzz_thread.start()
-	_buzz()
-	_delayLock(servo)
+		GPIO.output(_option(door, "BUZZER_PIN"),GPIO.LOW) # end buzzing
+		_publish(_event_bus.BUZZ_STOP, door)
 
-def _toggleLock(servo):
-	if _isCurrentlyLocked():
-		_unlock(servo)
+def _toggleLock(servo, door=None):
+	if _isCurrentlyLocked(door):
+		_unlock(servo, door)
 	else:
-		_lock(servo)
+		_lock(servo, door)
 
-def _isCurrentlyLocked():
+def _isCurrentlyLocked(door=None):
 	currently_locked = False
 	try:
-		currently_locked = _getStateValue(settings.LOCKED_STATE_KEY)
+		currently_locked = _getStateValue(_stateKey(door))
 	except KeyError:
 		pass # leave currently_locked as default
 	return currently_locked
 
+def _lockedChangedAt():
+	"""When the lock state was last written with a new value, None when it
+	has not been since the state was loaded.
+	"""
+	return _getStateStore().changedAt(settings.LOCKED_STATE_KEY)
+
+def _refreshState():
+	"""Reads the state again if another process, a command script or the
+	daemon, saved it since. Run it holding the actuators, before reading the
+	state to decide what to do.
+	"""
+	return _getStateStore().refresh()
+
 def _getStateValue(key):
-	persistent_state = _getPersistantState()
-	value = persistent_state[key]
-	return value
+	return _getStateStore().get(key)
 
 def _setStateValue(key, value):
-	persistent_state = None
-	# load exisiting state
-	persistent_state = _getPersistantState()
-	# set new state
-	persistent_state[key] = value
-	# save new state
-	with open(settings.PERSISTENT_STATE_FILE, 'w') as f:
-		raw_json = json.dumps(persistent_state)
-		f.write(raw_json)
-
-def _getPersistantState():
-	persistent_state = None
-	try:
-		with open(settings.PERSISTENT_STATE_FILE, 'r') as f:
-			raw_json = f.read()
-			persistent_state = json.loads(raw_json)
-	except ValueError:
-		persistent_state = {}
-	return persistent_state
-
-def _delayLock(servo):
-	_unlock(servo)
-	_blinkingSleep(settings.DELAYED_LOCK_DELAY)
-	_lock(servo)
-
-def _blinkingSleep(totalDuration):
+	_getStateStore().set(key, value)
+
+def _getStateStore():
+	global _state_store
+	if _state_store is None:
+		if settings.STATE_BACKEND == "journal":
+			backend = StateJournal(settings.PERSISTENT_STATE_JOURNAL_FILE,
+				settings.PERSISTENT_STATE_FILE, settings.STATE_JOURNAL_COMPACT_RECORDS)
+		else:
+			backend = JsonStateFile(settings.PERSISTENT_STATE_FILE)
+		_state_store = StateStore(backend, settings.STATE_WRITE_DELAY)
+	return _state_store
+
+def _blinkingSleep(totalDuration, door=None):
+	opened = False
 	for i in range(totalDuration):
-		GPIO.output(pins.LOCK_STATUS_LED_PIN,GPIO.LOW)
-		time.sleep(0.5)
-		GPIO.output(pins.LOCK_STATUS_LED_PIN,GPIO.HIGH)
-		time.sleep(0.5)
\ No newline at end of file
+		if _arbiter.preemptRequested():
+			raise _arbiter.Preempted()
+		if _door_sensor.isOpen(GPIO, _option(door, "DOOR_SENSOR_PIN")):
+			opened = True
+		elif opened:
+			return # the door has been through and is closed again
+		_publish(_event_bus.COUNTDOWN, door, remaining=totalDuration - i)
+		GPIO.output(_option(door, "LOCK_STATUS_LED_PIN"),GPIO.LOW)
+		_clock.clock.sleep(0.5)
+		GPIO.output(_option(door, "LOCK_STATUS_LED_PIN"),GPIO.HIGH)
+		_clock.clock.sleep(0.5)
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""Thins out commands before they reach the servo.
+
+Bursty input, a button pressed over and over or a phone retrying a
+request, would otherwise cost a full servo move and a state write per
+command. A Dispatcher sits in front of LockEngine.run and
+
+- skips a lock or unlock when the door is already that way and neither a
+  delayed lock nor the rest of a sequence is pending, checked once the command holds the actuators and the
+  state was read again, so a command script locking meanwhile counts,
+- runs the first toggle of a burst at once and folds the rest, toggles
+  coming less than TOGGLE_BURST_WINDOW apart, into their net effect: one
+  more toggle when the window closes if their number is odd, none if even,
+  run through LockEngine.execute on a worker thread and recorded as coming
+  from the source of the last toggle folded,
+- answers a repeated request ID with the reply to the first request.
+
+Skipped commands return timings with "skipped" giving the reason and are
+counted with outcome "skipped".
+"""
+import logging
+import threading
+import collections
+
+import _clock
+import _control_lock
+import commands
+import settings
+
+log = logging.getLogger(__name__)
+
+ALREADY_DONE = "already done"
+TOGGLE_BURST = "toggle burst"
+# request IDs remembered for answering retries, at most
+REQUEST_HISTORY_LENGTH = 256
+
+class _Request(object):
+
+	def __init__(self, received):
+		self.received = received
+		self.done = threading.Event()
+		self.reply = None # set once the request succeeded
+
+class Dispatcher(object):
+	"""Passes commands on to engine.run, leaving out the ones with no effect."""
+
+	def __init__(self, engine, scheduler):
+		self._engine = engine
+		self._scheduler = scheduler
+		self._lock = threading.Lock()
+		self._burst = None # event closing the toggle burst window
+		self._burst_toggles = 0 # toggles folded into the running burst
+		self._burst_source = None # source of the latest toggle folded
+		self._requests = collections.OrderedDict() # request ID -> _Request, oldest first
+
+	def execute(self, action, request_id=None, source=None):
+		"""Runs action unless it has no effect, see the module docstring, and
+		returns its timings like LockEngine.run. source is where action came
+		from, see _history.
+		"""
+		if request_id is None:
+			return self._admit(action, source)
+		request, first = self._remember(request_id)
+		if not first:
+			request.done.wait()
+			if request.reply is None:
+				return self.execute(action, request_id, source) # the first attempt failed, retry it
+			log.info("%s: repeated request %s answered from the first", action, request_id)
+			return dict(request.reply, repeated=True)
+		try:
+			request.reply = self._admit(action, source)
+		finally:
+			request.done.set()
+		return request.reply
+
+	def _remember(self, request_id):
+		# the request for request_id and whether it is new
+		now = _clock.clock.time()
+		with self._lock:
+			while self._requests:
+				oldest = next(iter(self._requests.values()))
+				if len(self._requests) < REQUEST_HISTORY_LENGTH and now - oldest.received < settings.REQUEST_ID_MEMORY:
+					break
+				self._requests.popitem(last=False)
+			request = self._requests.get(request_id)
+			if request is not None and (request.reply is not None or not request.done.is_set()):
+				return request, False
+			request = self._requests[request_id] = _Request(now)
+			return request, True
+
+	def _admit(self, action, source):
+		if action == commands.TOGGLE:
+			with self._lock:
+				if self._burst is not None:
+					self._burst_toggles += 1
+					self._burst_source = source
+					if self._burst.pending: # else _burstOver is about to take the count
+						self._scheduler.reschedule(self._burst, settings.TOGGLE_BURST_WINDOW)
+					return self._skip(action, TOGGLE_BURST)
+				self._burst = self._scheduler.scheduleWork(settings.TOGGLE_BURST_WINDOW, self._burstOver)
+		elif action != commands.BUZZ:
+			self._endBurst() # the latest command decides, not the toggles before it
+		if action not in (commands.LOCK, commands.UNLOCK):
+			return self._engine.run(action)
+		reply = self._engine.run(action, self._alreadyDone)
+		if reply is None:
+			return self._skip(action, ALREADY_DONE)
+		return reply
+
+	def _alreadyDone(self, action):
+		# called by engine.run holding the actuators, nothing is on its way elsewhere
+		if self._engine.pending():
+			return False # the door is to move later, the command cancels that
+		return self._engine.state()["locked"] == (action == commands.LOCK)
+
+	def _skip(self, action, reason):
+		_control_lock._countCommand(action, "skipped")
+		now = _clock.clock.time()
+		return {"started": now, "dispatch_latency": 0.0, "duration": 0.0, "skipped": reason}
+
+	def _endBurst(self):
+		with self._lock:
+			if self._burst is not None:
+				self._scheduler.cancel(self._burst)
+			self._burst = None
+			self._burst_toggles = 0
+			self._burst_source = None
+
+	def _burstOver(self):
+		# on a worker thread, see Scheduler.scheduleWork
+		with self._lock:
+			toggles = self._burst_toggles
+			source = self._burst_source
+			self._burst = None
+			self._burst_toggles = 0
+			self._burst_source = None
+		if toggles % 2 == 0:
+			return # the toggles cancelled out
+		try:
+			self._engine.execute(commands.TOGGLE, source=source, dispatch=False)
+		except Exception:
+			log.exception("toggle ending a burst failed")
@@ -0,0 +1,94 @@
+"""Whether the door is closed, from a reed switch or door contact.
+
+The switch sits between pins.DOOR_SENSOR_PIN and ground with the pin pulled
+up, so the pin reads low while the door is closed. A disconnected switch
+reads as an open door, which leaves the door unlocked rather than throwing
+the bolt into the frame.
+
+DoorSensor listens for edges both ways instead of polling. A switch chatters
+as the door swings to, so every edge restarts a DOOR_SENSOR_SETTLE_TIME
+wait, and the door only counts as opened or closed once the pin has read
+the same for that long.
+"""
+import logging
+import threading
+
+import _clock
+import _event_bus
+import settings
+
+log = logging.getLogger(__name__)
+
+class DoorOpen(Exception):
+	"""Raised instead of throwing the bolt while the door is open."""
+
+	def __init__(self):
+		Exception.__init__(self, "the door is open")
+
+def setup(gpio, pin):
+	"""Sets up pin for the switch, if there is one."""
+	if pin is not None:
+		gpio.setup(pin, gpio.IN, pull_up_down=gpio.PUD_UP)
+
+def isOpen(gpio, pin):
+	"""Whether the switch on pin reads open now, False without a switch."""
+	return pin is not None and gpio.input(pin) == gpio.HIGH
+
+class DoorSensor(object):
+	"""Calls on_change(closed, since) from scheduler's thread when the door
+	has opened or closed, since being the time of the first edge on the way.
+	Publishes DOOR_OPENED and DOOR_CLOSED on the event bus as well.
+	"""
+
+	def __init__(self, gpio, pin, scheduler, on_change, settle_time=None):
+		self._gpio = gpio
+		self.pin = pin
+		self._scheduler = scheduler
+		self._on_change = on_change
+		self._settle_time = settings.DOOR_SENSOR_SETTLE_TIME if settle_time is None else settle_time
+		self._lock = threading.Lock()
+		self._settle = None # event reading the pin once the edges stop
+		self._first_edge = None # time of the first edge since the pin last settled
+		setup(gpio, pin)
+		self.closed = not isOpen(gpio, pin)
+		gpio.add_event_detect(pin, gpio.BOTH, callback=self._onEdge)
+
+	def isOpen(self):
+		"""Whether the pin reads open right now, settled or not."""
+		return isOpen(self._gpio, self.pin)
+
+	def _onEdge(self, pin):
+		# runs on the GPIO callback thread, hand over and return straight away
+		now = _clock.clock.time()
+		with self._lock:
+			if self._first_edge is None:
+				self._first_edge = now
+			if self._settle is not None:
+				try:
+					self._scheduler.reschedule(self._settle, self._settle_time)
+					return
+				except ValueError:
+					pass # reading the pin already
+			self._settle = self._scheduler.schedule(self._settle_time, self._settled)
+
+	def _settled(self):
+		with self._lock:
+			if self._settle is not None and self._settle.pending:
+				return # another edge came, the event after it reads the pin
+			self._settle = None
+			since = self._first_edge
+			self._first_edge = None
+			closed = not self.isOpen()
+			if closed == self.closed:
+				return # bounced back
+			self.closed = closed
+		log.info("door %s", "closed" if closed else "opened")
+		_event_bus.bus.publish(_event_bus.DOOR_CLOSED if closed else _event_bus.DOOR_OPENED, since=since)
+		self._on_change(closed, since)
+
+	def close(self):
+		self._gpio.remove_event_detect(self.pin)
+		with self._lock:
+			if self._settle is not None:
+				self._scheduler.cancel(self._settle)
+			self._settle = None
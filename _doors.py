@@ -0,0 +1,199 @@
+"""Several doors driven from one process.
+
+A Door takes its pins and servo settings from pins.py and settings.py, with
+per-door overrides from settings.DOORS, and keeps its lock state under its
+own key in the shared state store. The main door keeps the plain
+LOCKED_STATE_KEY, so it shares its state with _control_lock. Only the main
+door takes DOOR_SENSOR_PIN from pins.py, another door has a sensor when
+its options name one; a door with its sensor reading open is not locked.
+Commands run the steps of _sequences through _control_lock and
+_servo_motion, on the door's pins and with its settings, and are counted in
+the metrics like the main door's.
+
+A DoorController runs commands on a fixed pool of worker threads. Each door
+runs one command at a time, different doors run side by side, so locking
+every door takes one servo rotation as long as there are as many workers as
+doors. The controller holds the actuation lock, see _arbiter, from setting
+up the doors until it is closed, so _control_lock and the lock daemon wait
+for it and it waits for them. Closing it publishes the main door's state,
+see _shared_state, for status.py to read.
+"""
+from _gpio import GPIO
+import threading
+try:
+	import queue
+except ImportError: # python 2
+	import Queue as queue
+
+import _clock
+import _arbiter
+import _config
+import _control_lock
+import _shared_state
+import _sequences
+import pins
+import settings
+from _config import MAIN_DOOR, DOOR_PINS, DOOR_SETTINGS
+
+class Door(object):
+
+	def __init__(self, name, options=None):
+		options = options or {}
+		unknown = set(options).difference(DOOR_PINS + DOOR_SETTINGS)
+		if unknown:
+			raise ValueError("unknown door options for %s: %s" % (name, ", ".join(sorted(unknown))))
+		self.name = name
+		self.options = {}
+		for option in DOOR_PINS:
+			self.options[option] = options.get(option, getattr(pins, option))
+		if name != MAIN_DOOR and "DOOR_SENSOR_PIN" not in options:
+			self.options["DOOR_SENSOR_PIN"] = None # the main door's sensor says nothing about this one
+		for option in DOOR_SETTINGS:
+			self.options[option] = options.get(option, getattr(settings, option))
+		self.state_key = _config.doorStateKey(name, settings.LOCKED_STATE_KEY)
+		self._servo = None
+		self._lock = threading.Lock() # one command at a time
+
+	def setup(self):
+		self._servo = _control_lock._setup(self)
+
+	def execute(self, action):
+		with self._lock:
+			outcome = "error"
+			try:
+				_control_lock._runSequence(self._servo, _sequences.lookup(action), self)
+				outcome = "ok"
+			except Exception as e:
+				outcome = _control_lock._outcomeOf(e)
+				raise
+			finally:
+				self._servo.stop() # stop pulsing, the PWM object is reused
+				_control_lock._countCommand(action, outcome)
+
+	def isLocked(self):
+		return bool(_control_lock._isCurrentlyLocked(self))
+
+	def close(self):
+		self._servo.stop()
+		GPIO.output(self.options["BUZZER_PIN"],GPIO.LOW)
+
+def fromSettings():
+	"""The doors in settings.DOORS, or just the main door when it is empty."""
+	doors = settings.DOORS or {MAIN_DOOR: {}}
+	return [Door(name, options) for name, options in sorted(doors.items())]
+
+class _Job(object):
+
+	def __init__(self, door, action):
+		self.door = door
+		self.action = action
+		self._done = threading.Event()
+		self._error = None
+		self.end = None # simulated time it finished at, virtual clock only
+
+	def _run(self):
+		try:
+			self.door.execute(self.action)
+		except Exception as e:
+			self._error = e
+		finally:
+			self._done.set()
+
+	def wait(self):
+		"""Blocks until the command has run, re-raising its failure."""
+		if self.end is not None:
+			_clock.clock.sleep(max(0, self.end - _clock.clock.time()))
+		self._done.wait()
+		if self._error is not None:
+			raise self._error
+
+class DoorController(object):
+	"""Runs commands on doors with at most workers of them at a time.
+
+	On a virtual clock a command runs as a fork of simulated time when it is
+	submitted, starting once its door and a worker are free, so timestamps
+	come out as they would on the threads.
+	"""
+
+	def __init__(self, doors, workers=None):
+		workers = workers or settings.DOOR_WORKERS
+		self.doors = dict((door.name, door) for door in doors)
+		self._actuation_lock = _arbiter.actuationLock()
+		self._actuation_lock.acquire()
+		try:
+			for door in doors:
+				door.setup()
+		except Exception:
+			self._actuation_lock.release()
+			raise
+		self._clock = _clock.clock
+		if self._clock.virtual:
+			self._worker_free = [self._clock.time()] * workers
+			self._door_free = dict((name, self._clock.time()) for name in self.doors)
+			return
+		self._jobs = queue.Queue()
+		self._workers = [threading.Thread(target=self._work) for i in range(workers)]
+		for worker in self._workers:
+			worker.daemon = True
+			worker.start()
+
+	def submit(self, name, action):
+		"""Queues action for the door called name and returns a job to wait() on."""
+		job = _Job(self.doors[name], action)
+		if self._clock.virtual:
+			self._runForked(job)
+		else:
+			self._jobs.put(job)
+		return job
+
+	def execute(self, name, action):
+		self.submit(name, action).wait()
+
+	def executeAll(self, action):
+		"""Runs action on every door, returning once all have finished."""
+		jobs = [self.submit(name, action) for name in sorted(self.doors)]
+		for job in jobs:
+			job.wait()
+
+	def _runForked(self, job):
+		worker = self._worker_free.index(min(self._worker_free))
+		start = max(self._clock.time(), self._worker_free[worker], self._door_free[job.door.name])
+		job.end = self._clock.runForked(start, job._run)
+		self._worker_free[worker] = job.end
+		self._door_free[job.door.name] = job.end
+
+	def _work(self):
+		while True:
+			job = self._jobs.get()
+			if job is None:
+				return
+			job._run()
+
+	def close(self):
+		if not self._clock.virtual:
+			for worker in self._workers:
+				self._jobs.put(None)
+			for worker in self._workers:
+				worker.join()
+		try:
+			for door in self.doors.values():
+				door.close()
+			_control_lock._getStateStore().flush()
+			if MAIN_DOOR in self.doors:
+				self._publishMainDoor()
+		finally:
+			self._actuation_lock.release()
+
+	def _publishMainDoor(self):
+		# keeps a delayed lock the daemon published, it is still pending
+		reader = _shared_state.SharedStateReader()
+		try:
+			published = reader.read()
+		finally:
+			reader.close()
+		deadline = None if published is None else published["delayed_lock_deadline"]
+		writer = _shared_state.SharedStateWriter()
+		try:
+			writer.publish(self.doors[MAIN_DOOR].isLocked(), deadline, _control_lock._lockedChangedAt())
+		finally:
+			writer.close()
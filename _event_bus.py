@@ -0,0 +1,141 @@
+"""In-process publish/subscribe for lock events, so clients are told about
+changes instead of polling the state file.
+
+Events are dicts with "event" (one of the names below), "time" and extra
+fields. Publishing only puts the event on each subscriber's queue, the cost
+per subscriber is an append, and a pipe write when the subscriber sleeps
+on an empty queue; nothing touches the disk. A subscriber waiting for the
+next event sleeps on a WakePipe, so a wait with a timeout does not poll.
+Listeners are called on the publishing thread instead, for reacting to an
+event at once.
+"""
+import time
+import logging
+import threading
+import collections
+
+import _clock
+from _wake_pipe import WakePipe
+
+LOCK = "lock"
+UNLOCK = "unlock"
+COUNTDOWN = "countdown" # once a second while a delayed lock counts down, with "remaining"
+BUZZ_START = "buzz_start"
+BUZZ_STOP = "buzz_stop"
+# from _door_sensor, with "since" the time the door started opening or closing
+DOOR_OPENED = "door_opened"
+DOOR_CLOSED = "door_closed"
+
+log = logging.getLogger(__name__)
+
+# events a subscriber can fall behind by before the oldest are dropped
+SUBSCRIBER_BACKLOG = 100
+
+class Subscription(object):
+	"""Events published since subscribing, in order. Close it when done."""
+
+	def __init__(self, bus):
+		self._bus = bus
+		self._lock = threading.Lock()
+		self._events = collections.deque()
+		self._wake_pipe = WakePipe()
+		self.dropped = 0
+
+	def get(self, timeout=None):
+		"""The next event, or None when none came within timeout seconds."""
+		deadline = None if timeout is None else time.time() + timeout
+		while True:
+			with self._lock:
+				if self._events:
+					return self._events.popleft()
+			remaining = None if deadline is None else deadline - time.time()
+			if remaining is not None and remaining <= 0:
+				return None
+			self._wake_pipe.wait(remaining)
+
+	def _put(self, event):
+		# never blocks the publisher, a subscriber that fell behind loses its oldest events
+		with self._lock:
+			if len(self._events) >= SUBSCRIBER_BACKLOG:
+				self._events.popleft()
+				self.dropped += 1
+			self._events.append(event)
+			woken = len(self._events) == 1 # else the subscriber has been woken already
+		if woken:
+			self._wake_pipe.wake()
+
+	def close(self):
+		self._bus._unsubscribe(self)
+		self._wake_pipe.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+		return False
+
+class Listener(object):
+	"""Calls a function with every event published until closed, see
+	EventBus.listen.
+	"""
+
+	def __init__(self, bus, callback):
+		self._bus = bus
+		self._callback = callback
+
+	def close(self):
+		self._bus._unlisten(self)
+
+class EventBus(object):
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._subscriptions = []
+		self._listeners = []
+
+	def subscribe(self):
+		subscription = Subscription(self)
+		with self._lock:
+			self._subscriptions.append(subscription)
+		return subscription
+
+	def _unsubscribe(self, subscription):
+		with self._lock:
+			if subscription in self._subscriptions:
+				self._subscriptions.remove(subscription)
+
+	def listen(self, callback):
+		"""Calls callback(event) on the publishing thread for every event from
+		now on, until the returned Listener is closed. callback must return
+		quickly since it holds up the publisher.
+		"""
+		listener = Listener(self, callback)
+		with self._lock:
+			self._listeners.append(listener)
+		return listener
+
+	def _unlisten(self, listener):
+		with self._lock:
+			if listener in self._listeners:
+				self._listeners.remove(listener)
+
+	def subscribers(self):
+		with self._lock:
+			return len(self._subscriptions)
+
+	def publish(self, event, **fields):
+		fields["event"] = event
+		fields["time"] = _clock.clock.time()
+		with self._lock:
+			for subscription in self._subscriptions:
+				subscription._put(fields)
+			listeners = list(self._listeners)
+		for listener in listeners:
+			try:
+				listener._callback(fields)
+			except Exception:
+				log.exception("listener %r failed on %s", listener._callback, event)
+
+# the bus the lock publishes on
+bus = EventBus()
@@ -0,0 +1,18 @@
+"""Picks the GPIO implementation: RPi.GPIO on the Pi, or the simulation in
+_sim_gpio anywhere else. Modules driving pins import GPIO from here.
+
+The DOOR_LOCK_GPIO environment variable overrides settings.GPIO_BACKEND, e.g.
+DOOR_LOCK_GPIO=sim python lock_daemon.py
+"""
+import os
+
+import settings
+
+BACKEND = os.environ.get("DOOR_LOCK_GPIO", settings.GPIO_BACKEND)
+
+if BACKEND == "sim":
+	import _sim_gpio as GPIO
+elif BACKEND == "rpi":
+	import RPi.GPIO as GPIO
+else:
+	raise ValueError("unknown GPIO backend %r, use rpi or sim" % BACKEND)
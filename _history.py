@@ -0,0 +1,187 @@
+"""Every command run, where it came from and how it ended, kept in SQLite.
+
+History.record() queues an event and returns; queued events are written
+behind like the lock state, in one transaction per batch: write_delay
+seconds after the first one, or at once when batch_size are queued. Events
+are indexed by time, and a per-day count by command and outcome is kept up
+to date as they are written, so range queries and daily totals stay fast
+however long the history grows.
+
+Sources name where a command came from: "button:<pin>", "http:<client
+address>" or "http:<credential>@<client address>" with credentials, see
+_auth, "script" for the command scripts, "schedule" for delayed locks
+coming due, "rule:<name>" for the rules in _rules and "sensor:<pin>" for
+locks when the door closed.
+"""
+import time
+import logging
+import sqlite3
+import threading
+
+import _clock
+import settings
+
+log = logging.getLogger(__name__)
+
+BUTTON = "button"
+HTTP = "http"
+SCRIPT = "script"
+SCHEDULE = "schedule"
+RULE = "rule"
+SENSOR = "sensor"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+	id INTEGER PRIMARY KEY,
+	at REAL NOT NULL,
+	command TEXT NOT NULL,
+	source TEXT NOT NULL,
+	outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_at ON events (at);
+CREATE INDEX IF NOT EXISTS events_command_at ON events (command, at);
+CREATE TABLE IF NOT EXISTS daily (
+	day TEXT NOT NULL,
+	command TEXT NOT NULL,
+	outcome TEXT NOT NULL,
+	count INTEGER NOT NULL,
+	PRIMARY KEY (day, command, outcome)
+);
+"""
+
+# the process's history, see getHistory
+_history = None
+
+def source(kind, detail):
+	"""A source naming kind and which one, e.g. source(BUTTON, 11)."""
+	return "%s:%s" % (kind, detail)
+
+def day(at):
+	"""The local date of timestamp at, as the daily counts key it."""
+	return time.strftime("%Y-%m-%d", time.localtime(at))
+
+class History(object):
+
+	def __init__(self, path, write_delay, batch_size):
+		self._write_delay = write_delay
+		self._batch_size = batch_size
+		self._lock = threading.RLock()
+		self._pending = [] # (at, command, source, outcome) not written yet
+		self._timer = None
+		# used from the write-behind timer's thread too, always under _lock
+		self._connection = sqlite3.connect(path, check_same_thread=False)
+		self._connection.execute("PRAGMA journal_mode=WAL") # queries do not wait for writes
+		self._connection.executescript(_SCHEMA)
+
+	def record(self, command, source, outcome, at=None):
+		with self._lock:
+			self._pending.append((_clock.clock.time() if at is None else at, command, source, outcome))
+			if len(self._pending) >= self._batch_size:
+				self._write()
+			elif self._timer is None:
+				self._timer = threading.Timer(self._write_delay, self._writeBehind)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+		"""Writes queued events now."""
+		with self._lock:
+			timer = self._timer
+			self._timer = None
+			if timer is not None:
+				timer.cancel()
+			self._write()
+		if timer is not None and timer is not threading.current_thread():
+			timer.join()
+
+	def _writeBehind(self):
+		with self._lock:
+			if self._timer is not threading.current_thread():
+				return # flushed in the meantime
+			self._timer = None
+			try:
+				self._write()
+			except sqlite3.Error:
+				log.exception("writing the history failed, retrying with the next batch")
+
+	def _write(self):
+		# caller holds _lock
+		if not self._pending:
+			return
+		counts = {}
+		for at, command, source, outcome in self._pending:
+			key = (day(at), command, outcome)
+			counts[key] = counts.get(key, 0) + 1
+		with self._connection: # one transaction
+			self._connection.executemany(
+				"INSERT INTO events (at, command, source, outcome) VALUES (?, ?, ?, ?)", self._pending)
+			self._connection.executemany(
+				"INSERT OR IGNORE INTO daily (day, command, outcome, count) VALUES (?, ?, ?, 0)", list(counts))
+			self._connection.executemany(
+				"UPDATE daily SET count = count + ? WHERE day = ? AND command = ? AND outcome = ?",
+				[(count,) + key for key, count in counts.items()])
+		self._pending = []
+
+	def events(self, since=None, until=None, command=None, source=None, limit=None):
+		"""Events from since up to until, oldest first, as dicts. source
+		matches a whole source or a kind, e.g. "button".
+		"""
+		query, parameters = self._where(since, until, command, source)
+		query = "SELECT at, command, source, outcome FROM events" + query + " ORDER BY at, id"
+		if limit is not None:
+			query += " LIMIT ?"
+			parameters.append(limit)
+		with self._lock:
+			rows = self._connection.execute(query, parameters).fetchall()
+		return [dict(zip(("at", "command", "source", "outcome"), row)) for row in rows]
+
+	def count(self, since=None, until=None, command=None, source=None):
+		query, parameters = self._where(since, until, command, source)
+		with self._lock:
+			return self._connection.execute("SELECT COUNT(*) FROM events" + query, parameters).fetchone()[0]
+
+	def daily(self, first_day=None, last_day=None, command=None):
+		"""Commands per day, command and outcome from first_day to last_day,
+		both "YYYY-MM-DD" and included, as dicts.
+		"""
+		conditions, parameters = [], []
+		for condition, value in (("day >= ?", first_day), ("day <= ?", last_day), ("command = ?", command)):
+			if value is not None:
+				conditions.append(condition)
+				parameters.append(value)
+		query = "SELECT day, command, outcome, count FROM daily"
+		if conditions:
+			query += " WHERE " + " AND ".join(conditions)
+		with self._lock:
+			rows = self._connection.execute(query + " ORDER BY day, command, outcome", parameters).fetchall()
+		return [dict(zip(("day", "command", "outcome", "count"), row)) for row in rows]
+
+	def _where(self, since, until, command, source):
+		conditions, parameters = [], []
+		if since is not None:
+			conditions.append("at >= ?")
+			parameters.append(since)
+		if until is not None:
+			conditions.append("at < ?")
+			parameters.append(until)
+		if command is not None:
+			conditions.append("command = ?")
+			parameters.append(command)
+		if source is not None:
+			conditions.append("(source = ? OR source LIKE ?)")
+			parameters.extend([source, source + ":%"])
+		if not conditions:
+			return "", parameters
+		return " WHERE " + " AND ".join(conditions), parameters
+
+	def close(self):
+		self.flush()
+		with self._lock:
+			self._connection.close()
+
+def getHistory():
+	"""The history in settings.HISTORY_FILE, opened on first use."""
+	global _history
+	if _history is None:
+		_history = History(settings.HISTORY_FILE, settings.HISTORY_WRITE_DELAY, settings.HISTORY_BATCH_SIZE)
+	return _history
@@ -0,0 +1,199 @@
+"""HTTP control API for phones, served by the lock daemon.
+
+	GET  /state				{"locked": ..., "delayed_lock_remaining": ...}, and "door_open" with a door sensor
+	POST /commands/<command>	runs a command from commands.py or settings.SEQUENCES, answers with its timings
+	GET  /events			Server-Sent Events stream, see below
+
+Replies are JSON with "ok" set like the daemon's socket replies. A command
+that lost to a later one, or would lock an open door, is answered with 409.
+With credentials, see _auth, every request needs an Authorization header:
+one without a valid token or PIN is answered with 401, a command its role
+or hours do not allow with 403, and an address with too many failed
+attempts with 429 until they age out. Until there are credentials only
+clients on this host are served, every other address gets 503. Connections
+are kept alive (HTTP/1.1) and every connection gets its own thread, so state
+polls are answered while a command is running.
+
+/events starts with a "state" event holding what GET /state returns and
+then streams every event published on _event_bus.bus as it happens, e.g.
+
+	event: unlock
+	data: {"event": "unlock", "time": 1500000000.0}
+"""
+import json
+import math
+import socket
+import logging
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+	from socketserver import ThreadingMixIn
+except ImportError: # python 2
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+	from SocketServer import ThreadingMixIn
+
+import _auth
+import _event_bus
+import _sequences
+import _history
+from _arbiter import Superseded
+from _door_sensor import DoorOpen
+import settings
+
+COMMANDS_PATH = "/commands/"
+STATE_PATH = "/state"
+EVENTS_PATH = "/events"
+# header a client sets to the same value when it retries a command, see _dispatcher.py
+REQUEST_ID_HEADER = "Idempotency-Key"
+# seconds between comments sent on an idle event stream, to notice dropped clients
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+log = logging.getLogger(__name__)
+
+class _ApiHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1" # keep-alive unless the client says otherwise
+
+	def setup(self):
+		BaseHTTPRequestHandler.setup(self)
+		# replies are small, don't hold them back waiting for more to send
+		self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	def do_GET(self):
+		if self.path in (STATE_PATH, EVENTS_PATH) and not self._authorize():
+			return
+		if self.path == STATE_PATH:
+			reply = self.server.engine.state()
+			reply["ok"] = True
+			self._send(200, reply)
+		elif self.path == EVENTS_PATH:
+			self._streamEvents()
+		elif self.path.startswith(COMMANDS_PATH):
+			self._send(405, {"ok": False, "error": "commands must be POSTed"}, {"Allow": "POST"})
+		else:
+			self._send(404, {"ok": False, "error": "not found: %s" % self.path})
+
+	def do_POST(self):
+		self._discardBody()
+		if not self.path.startswith(COMMANDS_PATH):
+			self._send(404, {"ok": False, "error": "not found: %s" % self.path})
+			return
+		action = self.path[len(COMMANDS_PATH):]
+		if action not in _sequences.definitions():
+			self._send(404, {"ok": False, "error": "unknown command: %s" % action})
+			return
+		if not self._authorize(action):
+			return
+		caller = self.client_address[0] if self.user is None else "%s@%s" % (self.user, self.client_address[0])
+		try:
+			reply = self.server.engine.execute(action, self.headers.get(REQUEST_ID_HEADER),
+				_history.source(_history.HTTP, caller))
+		except Superseded:
+			self._send(409, {"ok": False, "error": "superseded by a later command", "superseded": True})
+			return
+		except DoorOpen as e:
+			self._send(409, {"ok": False, "error": str(e), "door_open": True})
+			return
+		except Exception as e:
+			log.exception("command %r failed", action)
+			self._send(500, {"ok": False, "error": str(e)})
+			return
+		log.info("%s over HTTP: dispatch latency %.1f ms, duration %.3f s",
+			action, reply["dispatch_latency"] * 1000, reply["duration"])
+		reply["ok"] = True
+		self._send(200, reply)
+
+	def _authorize(self, action=None):
+		# whether the request may go on, answered when not; sets self.user to
+		# the name of the credential, None without credentials
+		self.user = None
+		auth = self.server.auth
+		if auth is None:
+			if _fromThisHost(self.client_address[0]):
+				return True
+			log.warning("%s refused, there are no credentials yet", self.client_address[0])
+			self._send(503, {"ok": False, "error": "no credentials yet, add one with credentials.py"})
+			return False
+		authorization = self.headers.get("Authorization")
+		try:
+			if action is None:
+				credential = auth.authenticate(authorization, self.client_address[0])
+			else:
+				credential = auth.authorize(authorization, action, self.client_address[0])
+		except _auth.TooManyAttempts as e:
+			self._send(429, {"ok": False, "error": str(e)}, {"Retry-After": str(int(math.ceil(e.retry_after)))})
+			return False
+		except _auth.Unauthorized as e:
+			self._send(401, {"ok": False, "error": str(e)}, {"WWW-Authenticate": 'Bearer realm="door lock"'})
+			return False
+		except _auth.Forbidden as e:
+			log.warning("%s refused: %s", action, e)
+			self._send(403, {"ok": False, "error": str(e)})
+			return False
+		self.user = credential.name
+		return True
+
+	def _streamEvents(self):
+		# subscribe before reading the state, so no change can fall in between
+		with _event_bus.bus.subscribe() as subscription:
+			state = self.server.engine.state()
+			state["event"] = "state"
+			self.send_response(200)
+			self.send_header("Content-Type", "text/event-stream")
+			self.send_header("Cache-Control", "no-cache")
+			self.send_header("Connection", "close") # the stream has no length, it ends with the connection
+			self.end_headers()
+			self.close_connection = True
+			try:
+				self._sendEvent(state)
+				while True:
+					event = subscription.get(EVENTS_KEEPALIVE_INTERVAL)
+					if event is None:
+						self.wfile.write(b": keep-alive\n\n")
+						self.wfile.flush()
+					else:
+						self._sendEvent(event)
+			except (IOError, OSError):
+				pass # client went away
+
+	def _sendEvent(self, event):
+		self.wfile.write(("event: %s\ndata: %s\n\n" % (event["event"], json.dumps(event))).encode("utf-8"))
+		self.wfile.flush()
+
+	def _discardBody(self):
+		# the body is unused, but has to be read for the next request on the connection
+		length = int(self.headers.get("Content-Length") or 0)
+		if length:
+			self.rfile.read(length)
+
+	def _send(self, status, reply, headers=None):
+		body = json.dumps(reply).encode("utf-8")
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		for name, value in (headers or {}).items():
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		log.debug(format, *args)
+
+def _fromThisHost(address):
+	return address.startswith("127.") or address == "::1" or address.startswith("::ffff:127.")
+
+class _ApiServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, engine, auth):
+		HTTPServer.__init__(self, address, _ApiHandler)
+		self.engine = engine
+		self.auth = auth
+
+def serve(engine, address=None, port=None, auth=None):
+	"""Binds the HTTP API for engine, checking requests with the
+	_auth.Authorizer auth or, without one, serving clients on this host
+	only. Setting auth on the result later applies from the next request on.
+	Call serve_forever() on the result.
+	"""
+	return _ApiServer((address or settings.HTTP_API_ADDRESS,
+		settings.HTTP_API_PORT if port is None else port), engine, auth)
@@ -0,0 +1,113 @@
+"""Named patterns for the status LED, played in the background.
+
+A pattern is a generator of (level, seconds) steps; seconds None holds the
+level until the next pattern. LedPatterns writes each step from a Scheduler
+callback, so showing a pattern never holds up the thread that asked for it,
+and show() writes the new pattern's first level at once, cutting the running
+step short.
+"""
+import threading
+
+SOLID = "solid"
+BLINK = "blink"
+COUNTDOWN = "countdown"
+ERROR = "error"
+
+# countdown blink periods, in seconds: the slowest until COUNTDOWN_SPEEDUP
+# seconds remain, then shrinking towards the fastest as the end nears
+COUNTDOWN_SLOWEST = 1.0
+COUNTDOWN_FASTEST = 0.2
+COUNTDOWN_SPEEDUP = 10.0
+
+def _solid(gpio, level):
+	yield level, None
+
+def _blink(gpio, period=1.0):
+	while True:
+		yield gpio.LOW, period / 2
+		yield gpio.HIGH, period / 2
+
+def _countdown(gpio, seconds):
+	remaining = float(seconds)
+	while remaining > 0:
+		period = max(COUNTDOWN_FASTEST, min(COUNTDOWN_SLOWEST,
+			remaining / COUNTDOWN_SPEEDUP * COUNTDOWN_SLOWEST))
+		for level in (gpio.LOW, gpio.HIGH):
+			step = min(period / 2, remaining)
+			yield level, step
+			remaining -= step
+			if remaining <= 0:
+				break
+
+def _error(gpio, then, flashes=3, repeats=3):
+	for i in range(repeats):
+		for j in range(flashes):
+			yield gpio.HIGH, 0.1
+			yield gpio.LOW, 0.1
+		yield gpio.LOW, 0.5
+	yield then, None
+
+# name -> pattern(gpio, **options)
+PATTERNS = {
+	SOLID: _solid,
+	BLINK: _blink,
+	COUNTDOWN: _countdown,
+	ERROR: _error,
+}
+
+class LedPatterns(object):
+	"""Plays patterns on pin, one at a time, with scheduler's timers."""
+
+	def __init__(self, gpio, pin, scheduler):
+		self._gpio = gpio
+		self._pin = pin
+		self._scheduler = scheduler
+		self._lock = threading.Lock()
+		self._generation = 0 # bumped whenever the playing pattern is replaced
+		self._steps = None
+		self._event = None
+		self.showing = None # name of the playing pattern
+
+	def show(self, name, **options):
+		"""Replaces the playing pattern with pattern name, e.g.
+		show(SOLID, level=GPIO.HIGH) or show(COUNTDOWN, seconds=20).
+		"""
+		steps = PATTERNS[name](self._gpio, **options)
+		with self._lock:
+			generation = self._stop()
+			self._steps = steps
+			self.showing = name
+			self._step(generation)
+
+	def stop(self):
+		"""Stops the playing pattern, leaving the LED as it is."""
+		with self._lock:
+			self._stop()
+
+	def _stop(self):
+		# caller holds _lock
+		if self._event is not None:
+			self._scheduler.cancel(self._event)
+		self._event = None
+		self._steps = None
+		self.showing = None
+		self._generation += 1
+		return self._generation
+
+	def _step(self, generation):
+		# caller holds _lock
+		if generation != self._generation:
+			return
+		try:
+			level, seconds = next(self._steps)
+		except StopIteration:
+			self._event = None
+			self.showing = None
+			return
+		self._gpio.output(self._pin, level)
+		if seconds is not None:
+			self._event = self._scheduler.schedule(seconds, self._due, generation)
+
+	def _due(self, generation):
+		with self._lock:
+			self._step(generation)
@@ -0,0 +1,47 @@
+import json
+import socket
+
+import _config
+import settings
+
+class DaemonError(Exception):
+	pass
+
+class DaemonNotRunning(DaemonError):
+	pass
+
+def send(request, socket_file=None):
+	"""Sends one request to the lock daemon and returns its decoded reply.
+	Raises DaemonNotRunning when no daemon is listening, and socket.error
+	when the connection fails once the request may have reached it.
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		try:
+			sock.connect(socket_file or settings.DAEMON_SOCKET_FILE)
+		except socket.error as e:
+			raise DaemonNotRunning(str(e))
+		sock.sendall((request + "\n").encode("utf-8"))
+		reply = sock.makefile("rb").readline()
+	finally:
+		sock.close()
+	if not reply:
+		raise DaemonError("daemon closed the connection")
+	return json.loads(reply.decode("utf-8"))
+
+def run(action):
+	"""Runs action through the lock daemon, or in this process when the daemon
+	is not running.
+	"""
+	try:
+		# the daemon runs on the config it checked, only its socket is needed here
+		reply = send(action, _config.peek("DAEMON_SOCKET_FILE"))
+	except DaemonNotRunning:
+		# not after the request went out, it may have run
+		_config.setUp()
+		# imported here so the daemon path never pays for RPi.GPIO
+		import _control_lock
+		_control_lock.main(action)
+		return
+	if not reply["ok"]:
+		raise DaemonError(reply["error"])
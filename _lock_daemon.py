@@ -0,0 +1,157 @@
+import os
+import json
+import logging
+import threading
+try:
+	import socketserver
+except ImportError: # python 2
+	import SocketServer as socketserver
+
+import _metrics
+import _http_api
+import _auth
+import _config
+import _history
+import settings
+import program_loop
+from _lock_engine import LockEngine
+from _arbiter import Superseded
+from _door_sensor import DoorOpen
+
+# request asking the daemon for its setup and latency figures instead of an action
+STATS_REQUEST = "stats"
+
+log = logging.getLogger(__name__)
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+	"""Reads one command per line, optionally followed by a request ID a retry
+	repeats, and answers each with one line of JSON.
+	"""
+
+	def handle(self):
+		while True:
+			line = self.rfile.readline()
+			if not line:
+				break
+			request = line.decode("utf-8").strip()
+			if not request:
+				continue
+			reply = self._reply(request)
+			self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+			self.wfile.flush()
+
+	def _reply(self, request):
+		engine = self.server.engine
+		if request == STATS_REQUEST:
+			reply = engine.stats()
+			reply.update(program_loop.pressLatencyStats())
+			reply["ok"] = True
+			return reply
+		# "<command> [<request ID>]"
+		request, _, request_id = request.partition(" ")
+		try:
+			reply = engine.execute(request, request_id or None, _history.SCRIPT)
+		except NotImplementedError:
+			log.warning("unknown command %r", request)
+			return {"ok": False, "error": "unknown command: %s" % request}
+		except Superseded:
+			log.info("%s superseded by a later command", request)
+			return {"ok": False, "error": "superseded by a later command", "superseded": True}
+		except DoorOpen as e:
+			log.info("%s refused, %s", request, e)
+			return {"ok": False, "error": str(e), "door_open": True}
+		except Exception as e:
+			log.exception("command %r failed", request)
+			return {"ok": False, "error": str(e)}
+		log.info("%s: dispatch latency %.1f ms, duration %.3f s",
+			request, reply["dispatch_latency"] * 1000, reply["duration"])
+		reply["ok"] = True
+		return reply
+
+class _CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+	def __init__(self, socket_file, engine):
+		socketserver.UnixStreamServer.__init__(self, socket_file, _CommandHandler)
+		self.engine = engine
+
+def serve(engine, socket_file=None):
+	"""Binds the command socket for engine. Call serve_forever() on the result."""
+	socket_file = socket_file or settings.DAEMON_SOCKET_FILE
+	if os.path.exists(socket_file):
+		os.remove(socket_file) # left over from a previous run
+	return _CommandServer(socket_file, engine)
+
+def _reloadConfig(engine):
+	# from the config watcher's thread
+	try:
+		config, kept = _config.forReload(_config.load())
+	except _config.ConfigError as e:
+		log.error("config not reloaded, keeping the running one: %s", e)
+		return
+	for name in sorted(kept):
+		log.warning("%s takes effect when the daemon restarts", name)
+	changed = engine.reconfigure(config)
+	log.info("config reloaded, changed: %s", ", ".join(sorted(changed)) or "nothing")
+
+def _loadCredentials():
+	# None serves clients on this host only, see _http_api
+	if not os.path.exists(settings.CREDENTIALS_FILE):
+		log.warning("no %s, the HTTP API refuses other hosts until it is written, see credentials.py",
+			settings.CREDENTIALS_FILE)
+		return None
+	auth = _auth.Authorizer(_auth.read(), _auth.readKey())
+	log.info("%d credentials loaded", len(auth))
+	return auth
+
+def _reloadCredentials(api):
+	# from the credentials watcher's thread, the first credentials open the API to other hosts
+	try:
+		specs = _auth.read()
+		if api.auth is None:
+			api.auth = _auth.Authorizer(specs, _auth.readKey())
+			log.info("%d credentials loaded, the HTTP API serves other hosts with them from now on", len(api.auth))
+			return
+		added, changed, removed = api.auth.update(specs)
+	except _auth.CredentialError as e:
+		log.error("credentials not reloaded, keeping the loaded ones: %s", e)
+		return
+	log.info("credentials reloaded: %d added, %d changed, %d removed", len(added), len(changed), len(removed))
+
+def _watch(path, on_change):
+	try:
+		return _config.Watcher(path, on_change)
+	except OSError as e:
+		log.warning("not watching %s, changes need a restart: %s", path, e)
+		return None
+
+def main():
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+	_config.use(_config.load()) # refuse to start on a config, sequence or rule that does not check
+	auth = _loadCredentials()
+	engine = LockEngine()
+	log.info("GPIO setup took %.1f ms", engine.setup_duration * 1000)
+	# the push buttons share the daemon's engine
+	program_loop._setup()
+	buttons = threading.Thread(target=program_loop._loop, args=(engine,))
+	buttons.daemon = True
+	buttons.start()
+	_metrics.serve(settings.METRICS_ADDRESS, settings.METRICS_PORT)
+	api = _http_api.serve(engine, auth=auth)
+	api_thread = threading.Thread(target=api.serve_forever)
+	api_thread.daemon = True
+	api_thread.start()
+	server = serve(engine)
+	watchers = [_watch(settings.CONFIG_FILE, lambda: _reloadConfig(engine)),
+		_watch(settings.CREDENTIALS_FILE, lambda: _reloadCredentials(api))]
+	try:
+		server.serve_forever()
+	finally:
+		for watcher in watchers:
+			if watcher is not None:
+				watcher.close()
+		server.server_close()
+		api.shutdown()
+		api.server_close()
+		os.remove(settings.DAEMON_SOCKET_FILE)
+		engine.close()
@@ -0,0 +1,509 @@
+from _gpio import GPIO
+import threading
+import functools
+import collections
+
+import _clock
+import _actuation
+import _metrics
+import _event_bus
+import _led_patterns
+import _arbiter
+import _dispatcher
+import _history
+import _rules
+import _door_sensor
+import _sequences
+import _config
+from _shared_state import SharedStateWriter
+import _control_lock
+import pins
+import commands
+import settings
+from _scheduler import Scheduler
+
+# number of recent commands kept for latency reporting
+LATENCY_HISTORY_LENGTH = 100
+# seconds between countdown events while a delayed lock counts down
+COUNTDOWN_INTERVAL = 1.0
+# names whose change starts the rules over
+RULE_SETTINGS = ("RULES", "HOLIDAYS", "SEQUENCES")
+
+class LockEngine(object):
+	"""Owns the GPIO pins and servo PWM object for the lifetime of a resident
+	process, so commands skip the per-process setup done by _control_lock.main.
+
+	Delayed locks are scheduled instead of slept through, so other commands
+	are served during the countdown. Any lock, unlock or toggle pre-empts a
+	pending delayed lock, and a new delayed lock restarts it. The buzzer runs
+	as its own channel and does not hold up other commands. Commands waiting
+	for the actuators are arbitrated by _arbiter, a later one can supersede them.
+	Commands from outside come through execute, where _dispatcher leaves out
+	the ones that would change nothing. The state is published to other
+	processes through _shared_state. The rules in settings.RULES run on the
+	same scheduler, see _rules. With a door sensor, a pending delayed lock
+	locks as soon as the door has closed, and one coming due while the door
+	is open waits for it to close. Locks the scheduler sets off run on worker
+	threads, see Scheduler.scheduleWork, not to hold up its other events.
+
+	A sequence from settings.SEQUENCES runs the same way: its steps up to a
+	wait or blink run at once, and the steps after it are a tail scheduled
+	for when the wait or blink is over, which takes the actuators again.
+	A blink shows the countdown meanwhile, and closing the door cuts it short.
+	Commands in between run, and the ones cancelling a delayed lock drop
+	the tails too. A channel that only buzzes carries on by itself.
+	"""
+
+	def __init__(self):
+		self._arbiter = _arbiter.Arbiter() # one command on the actuators at a time
+		# guards the delayed lock bookkeeping below, never held while actuating
+		self._delay_lock = threading.Lock()
+		self._delay_generation = 0 # bumped whenever the pending delayed lock is superseded
+		self._pending_lock = None
+		self._tails = [] # scheduled rests of the running sequence
+		self._blink_tail = None # the one of them a blink step waits for
+		self._countdown_event = None
+		self._blinking = False # status LED shows the countdown
+		self._buzzing = None # actuation whose buzzer channel is running
+		self._lock_on_close = False # a delayed lock came due with the door open
+		self._clock = _clock.clock
+		self._scheduler = Scheduler(self._clock)
+		self.led = _led_patterns.LedPatterns(GPIO, pins.LOCK_STATUS_LED_PIN, self._scheduler)
+		self._dispatcher = _dispatcher.Dispatcher(self, self._scheduler)
+		self._rules = _rules.Rules(self, self._scheduler)
+		self._shared_state = SharedStateWriter()
+		self.dispatch_latencies = collections.deque(maxlen=LATENCY_HISTORY_LENGTH)
+		self.close_to_lock_latencies = collections.deque(maxlen=LATENCY_HISTORY_LENGTH)
+		setup_start = self._clock.time()
+		with _metrics.PHASE_SECONDS.time(phase="setup"):
+			self._servo = _control_lock._setup()
+		self.setup_duration = self._clock.time() - setup_start
+		self._door_sensor = None
+		if pins.DOOR_SENSOR_PIN is not None:
+			self._door_sensor = _door_sensor.DoorSensor(GPIO, pins.DOOR_SENSOR_PIN,
+				self._scheduler, self._doorChanged)
+		with self._delay_lock:
+			self._publishState()
+		self._rules.start()
+
+	def execute(self, action, request_id=None, source=_history.SCRIPT, dispatch=True):
+		"""Runs action unless _dispatcher finds it would change nothing or
+		repeats request_id, and returns its timings like run. The command is
+		recorded in the history as coming from source. Without dispatch it
+		goes straight to run, for the toggle _dispatcher runs after a burst.
+		"""
+		outcome = "error"
+		try:
+			if dispatch:
+				reply = self._dispatcher.execute(action, request_id, source)
+			else:
+				reply = self.run(action)
+			if reply.get("repeated"):
+				outcome = "repeated"
+			elif "skipped" in reply:
+				outcome = "skipped"
+			else:
+				outcome = "ok"
+			return reply
+		except NotImplementedError:
+			outcome = "unknown"
+			raise
+		except _arbiter.Superseded:
+			outcome = "superseded"
+			raise
+		except _door_sensor.DoorOpen:
+			outcome = "door_open"
+			raise
+		finally:
+			_history.getHistory().record(action, source, outcome)
+
+	def run(self, action, skip=None):
+		"""Runs action and returns its timings in seconds: started is the time
+		the action started, dispatch_latency is the time from the call until
+		then and duration is the time the action itself took. skip, when
+		given, is called with action once the actuators are held and the state
+		read again, see _control_lock._refreshState; when it returns true
+		action is left out and run returns None.
+		"""
+		received = self._clock.time()
+		outcome = "error"
+		try:
+			self._arbiter.acquire(action)
+		except _arbiter.Superseded:
+			_control_lock._countCommand(action, "superseded")
+			raise
+		try:
+			_control_lock._refreshState() # a command script may have moved the lock
+			if skip is not None and skip(action):
+				return None
+			dispatched = self._clock.time()
+			if self.led.showing == _led_patterns.ERROR:
+				self.led.show(_led_patterns.SOLID, level=self._ledLevel())
+			try:
+				with _metrics.PHASE_SECONDS.time(phase="actuation"):
+					self._dispatch(action)
+				outcome = "ok"
+			except NotImplementedError:
+				outcome = "unknown"
+				raise
+			except Exception as e:
+				if isinstance(e, _door_sensor.DoorOpen):
+					outcome = "door_open"
+				# flash for a few seconds, then show the lock state again
+				self.led.show(_led_patterns.ERROR, then=self._ledLevel())
+				raise
+			finally:
+				self._servo.stop() # stop pulsing, the PWM object is reused
+				_control_lock._countCommand(action, outcome)
+				with self._delay_lock:
+					self._publishState()
+			finished = self._clock.time()
+		finally:
+			self._arbiter.release()
+		dispatch_latency = dispatched - received
+		self.dispatch_latencies.append(dispatch_latency)
+		return {
+			"started": dispatched,
+			"dispatch_latency": dispatch_latency,
+			"duration": finished - dispatched,
+		}
+
+	def reconfigure(self, config):
+		"""Makes config current, see _config, once the running command is done,
+		ahead of the waiting ones, so none of them sees old and new values mixed.
+		Pins that moved are set up again and the rules start over when they
+		changed. Returns the names that changed.
+		"""
+		self._arbiter.acquire(_arbiter.RECONFIGURE, supersede=False)
+		try:
+			changed = _config.current.changed(config)
+			names = _config.OUTPUT_PINS + _config.INPUT_PINS
+			old_pins = dict((name, getattr(pins, name)) for name in names)
+			_config.use(config)
+			moved = [name for name in names if getattr(pins, name) != old_pins[name]]
+			if moved:
+				self._movePins(old_pins, moved)
+			if changed.intersection(RULE_SETTINGS):
+				self._rules.close()
+				self._rules = _rules.Rules(self, self._scheduler)
+				self._rules.start()
+			return changed
+		finally:
+			self._arbiter.release()
+
+	def _movePins(self, old_pins, moved):
+		# caller holds the actuators
+		self.led.stop()
+		self._servo.stop()
+		if self._door_sensor is not None:
+			self._door_sensor.close()
+			self._door_sensor = None
+		for name in moved:
+			if old_pins[name] is not None:
+				GPIO.cleanup(old_pins[name]) # back to an input
+		with _metrics.PHASE_SECONDS.time(phase="setup"):
+			self._servo = _control_lock._setup()
+		self.led = _led_patterns.LedPatterns(GPIO, pins.LOCK_STATUS_LED_PIN, self._scheduler)
+		with self._delay_lock:
+			if self._blinking:
+				self.led.show(_led_patterns.COUNTDOWN, seconds=self._pending_lock.remaining())
+			else:
+				self.led.show(_led_patterns.SOLID, level=self._ledLevel())
+		if pins.DOOR_SENSOR_PIN is not None:
+			self._door_sensor = _door_sensor.DoorSensor(GPIO, pins.DOOR_SENSOR_PIN,
+				self._scheduler, self._doorChanged)
+
+	def _ledLevel(self):
+		return GPIO.HIGH if _control_lock._isCurrentlyLocked() else GPIO.LOW
+
+	def _dispatch(self, action):
+		if action in settings.SEQUENCES:
+			self.cancelDelayedLock()
+			with self._delay_lock:
+				generation = self._delay_generation
+			self._runSequence(action, _sequences.lookup(action), generation)
+		elif action == commands.DELAY_LOCK:
+			self.cancelDelayedLock() # not to fire while unlocking
+			_control_lock._unlock(self._servo)
+			self.scheduleLock(settings.DELAYED_LOCK_DELAY, blink=True)
+		elif action == commands.BUZZ_AND_UNLOCK:
+			self.cancelDelayedLock()
+			actuation = self._buzzAlongside({
+				"servo": functools.partial(_control_lock._unlock, self._servo),
+			})
+			actuation.wait("servo") # the buzzer carries on by itself
+			self.scheduleLock(settings.DELAYED_LOCK_DELAY, blink=True)
+		elif action == commands.BUZZ:
+			self._buzzAlongside({})
+		elif action in (commands.LOCK, commands.UNLOCK, commands.TOGGLE):
+			self.cancelDelayedLock()
+			_control_lock._dispatch(self._servo, action)
+		else:
+			raise NotImplementedError
+
+	def _runSequence(self, action, sequence, generation):
+		# runs sequence up to its waits and blinks and schedules the rest
+		tails = []
+		channels = {}
+		for i, channel in enumerate(sequence.channels):
+			if all(step.name == _sequences.BUZZ for step in channel):
+				self._buzzAlongside({}, functools.partial(_control_lock._runChannel, self._servo, channel))
+			else:
+				channels[i] = functools.partial(self._runUntilWait, channel, tails)
+		# tails are scheduled once every channel is done, on a virtual clock
+		# one coming due while another channel runs would run in place
+		_actuation.run(channels)
+		with self._delay_lock:
+			if generation == self._delay_generation:
+				for reached, step, rest in tails:
+					self._scheduleTail(action, reached, step, rest, generation)
+
+	def _runUntilWait(self, steps, tails):
+		# runs steps up to the first wait or blink, adding (time reached, that
+		# step, the steps after it) to tails
+		for i, step in enumerate(steps):
+			if step.name in (_sequences.WAIT, _sequences.BLINK):
+				tails.append((self._clock.time(), step, steps[i + 1:]))
+				return
+			_control_lock._runStep(self._servo, step)
+
+	def _scheduleTail(self, action, reached, step, rest, generation):
+		# caller holds _delay_lock
+		delay = max(0.0, reached + step.duration() - self._clock.time())
+		if step.name == _sequences.BLINK:
+			self._blink_tail = self._scheduler.scheduleWork(delay, self._tailDue, action, rest, generation)
+			self._tails.append(self._blink_tail)
+			self._countdown_event = self._scheduler.schedule(0, self._countdownTick, generation)
+			self.led.show(_led_patterns.COUNTDOWN, seconds=delay)
+			self._blinking = True
+		elif rest:
+			self._tails.append(self._scheduler.scheduleWork(delay, self._tailDue, action, rest, generation))
+
+	def _tailDue(self, action, steps, generation):
+		# on a worker thread, see Scheduler.scheduleWork
+		if not steps:
+			with self._delay_lock:
+				self._tailStarted(generation) # a blink the sequence ends with is over
+			return
+		self._arbiter.acquire(action, supersede=False)
+		try:
+			_control_lock._refreshState()
+			with self._delay_lock:
+				if not self._tailStarted(generation):
+					return # superseded while waiting for the actuators
+			outcome = "error"
+			tails = []
+			try:
+				self._runUntilWait(steps, tails)
+				outcome = "ok"
+			except Exception as e:
+				outcome = _control_lock._outcomeOf(e)
+				self.led.show(_led_patterns.ERROR, then=self._ledLevel())
+				raise
+			finally:
+				self._servo.stop()
+				with self._delay_lock:
+					if generation == self._delay_generation:
+						for reached, step, rest in tails:
+							self._scheduleTail(action, reached, step, rest, generation)
+					self._publishState()
+				_history.getHistory().record(action, _history.SCHEDULE, outcome)
+		finally:
+			self._arbiter.release()
+
+	def _tailStarted(self, generation):
+		# caller holds _delay_lock, returns whether the tail of generation goes on
+		if generation != self._delay_generation:
+			return False
+		self._tails = [tail for tail in self._tails if tail.pending]
+		if self._blink_tail is not None and not self._blink_tail.pending:
+			self._blink_tail = None
+			self._blinking = False # the countdown pattern has run out
+		return True
+
+	def _buzzAlongside(self, steps, buzz=None):
+		# starts steps next to a buzzer channel running buzz, _control_lock's
+		# by default, unless one is still buzzing
+		if self._buzzing is None or self._buzzing.finished("buzzer"):
+			steps = dict(steps, buzzer=buzz or _control_lock._buzz)
+		actuation = _actuation.start(steps)
+		if "buzzer" in steps:
+			self._buzzing = actuation
+		return actuation
+
+	def scheduleLock(self, delay, blink=False):
+		"""Locks delay seconds from now without blocking, replacing any pending
+		delayed lock. With blink the status LED shows the countdown.
+		"""
+		with self._delay_lock:
+			generation = self._supersedeDelayedLock()
+			self._pending_lock = self._scheduler.scheduleWork(delay, self._delayedLockDue, generation)
+			self._countdown_event = self._scheduler.schedule(0, self._countdownTick, generation)
+			if blink:
+				self.led.show(_led_patterns.COUNTDOWN, seconds=delay)
+				self._blinking = True
+			self._publishState()
+
+	def cancelDelayedLock(self):
+		"""Drops the pending delayed lock, if any. Returns whether there was one."""
+		with self._delay_lock:
+			pending = self._pending_lock is not None or self._lock_on_close
+			blinking = self._blinking
+			self._supersedeDelayedLock()
+			if blinking:
+				# stop on the unlocked LED level
+				self.led.show(_led_patterns.SOLID, level=GPIO.LOW)
+			if pending:
+				self._publishState()
+		return pending
+
+	def extendDelayedLock(self, delay):
+		"""Moves the pending delayed lock to delay seconds from now. Returns
+		whether there was one to move.
+		"""
+		with self._delay_lock:
+			if self._pending_lock is None:
+				return False
+			self._scheduler.reschedule(self._pending_lock, delay)
+			if self._blinking:
+				self.led.show(_led_patterns.COUNTDOWN, seconds=delay)
+			self._publishState()
+			return True
+
+	def delayedLockRemaining(self):
+		"""Seconds until the pending delayed lock, None when there is none and
+		0 while one that came due waits for the door to close.
+		"""
+		with self._delay_lock:
+			if self._lock_on_close:
+				return 0.0
+			if self._pending_lock is None:
+				return None
+			return self._pending_lock.remaining()
+
+	def pending(self):
+		"""Whether a delayed lock or the rest of a sequence is yet to run."""
+		with self._delay_lock:
+			return self._pending_lock is not None or self._lock_on_close or bool(self._tails)
+
+	def _supersedeDelayedLock(self):
+		# caller holds _delay_lock
+		for event in [self._pending_lock, self._countdown_event] + self._tails:
+			if event is not None:
+				self._scheduler.cancel(event)
+		if self._blinking:
+			self.led.stop()
+		self._pending_lock = None
+		self._tails = []
+		self._blink_tail = None
+		self._countdown_event = None
+		self._blinking = False
+		self._lock_on_close = False
+		self._delay_generation += 1
+		return self._delay_generation
+
+	def _publishState(self):
+		# caller holds _delay_lock
+		pending = self._pending_lock
+		self._shared_state.publish(_control_lock._isCurrentlyLocked(),
+			None if pending is None else pending.deadline, _control_lock._lockedChangedAt())
+
+	def _delayedLockDue(self, generation, source=_history.SCHEDULE):
+		# returns whether it locked
+		self._arbiter.acquire(commands.LOCK, supersede=False)
+		try:
+			_control_lock._refreshState()
+			with self._delay_lock:
+				if generation != self._delay_generation:
+					return False # pre-empted while waiting for the servo
+				self._supersedeDelayedLock()
+				if self._door_sensor is not None and self._door_sensor.isOpen():
+					self._lock_on_close = True # see _doorChanged
+					self._publishState()
+					return False
+			outcome = "error"
+			try:
+				_control_lock._lock(self._servo)
+				outcome = "ok"
+			except _door_sensor.DoorOpen:
+				outcome = "door_open" # opened just now
+				raise
+			finally:
+				self._servo.stop()
+				with self._delay_lock:
+					self._publishState()
+				_history.getHistory().record(commands.LOCK, source, outcome)
+			return True
+		finally:
+			self._arbiter.release()
+
+	def _doorChanged(self, closed, since):
+		# from the door sensor on the scheduler's thread, locks on a worker
+		# when a delayed lock is waiting on the door
+		if not closed:
+			return
+		with self._delay_lock:
+			if self._blink_tail is not None and self._blink_tail.pending:
+				self._scheduler.reschedule(self._blink_tail, 0) # the door has been through
+			if self._pending_lock is None and not self._lock_on_close:
+				return
+			generation = self._delay_generation
+		source = _history.source(_history.SENSOR, self._door_sensor.pin)
+		self._scheduler.scheduleWork(0, self._lockOnClose, generation, source, since)
+
+	def _lockOnClose(self, generation, source, since):
+		if self._delayedLockDue(generation, source):
+			latency = self._clock.time() - since
+			self.close_to_lock_latencies.append(latency)
+			_metrics.CLOSE_TO_LOCK_SECONDS.observe(latency)
+
+	def _countdownTick(self, generation):
+		with self._delay_lock:
+			counting = self._pending_lock if self._pending_lock is not None else self._blink_tail
+			if generation != self._delay_generation or counting is None or not counting.pending:
+				return
+			remaining = counting.remaining()
+			_event_bus.bus.publish(_event_bus.COUNTDOWN, remaining=int(round(remaining)))
+			if remaining > COUNTDOWN_INTERVAL:
+				self._countdown_event = self._scheduler.schedule(COUNTDOWN_INTERVAL, self._countdownTick, generation)
+
+	def state(self):
+		"""Whether the door is locked and the seconds until a pending delayed
+		lock. Does not wait for a running command.
+		"""
+		_control_lock._refreshState()
+		state = {
+			"locked": bool(_control_lock._isCurrentlyLocked()),
+			"delayed_lock_remaining": self.delayedLockRemaining(),
+		}
+		if self._door_sensor is not None:
+			state["door_open"] = self._door_sensor.isOpen()
+		return state
+
+	def stats(self):
+		latencies = sorted(self.dispatch_latencies)
+		summary = {
+			"setup_duration": self.setup_duration,
+			"commands": len(latencies),
+		}
+		if latencies:
+			summary["dispatch_latency_max"] = latencies[-1]
+			summary["dispatch_latency_median"] = latencies[len(latencies) // 2]
+		latencies = sorted(self.close_to_lock_latencies)
+		if latencies:
+			summary["locks_on_close"] = len(latencies)
+			summary["close_to_lock_max"] = latencies[-1]
+			summary["close_to_lock_median"] = latencies[len(latencies) // 2]
+		return summary
+
+	def close(self):
+		self._rules.close()
+		if self._door_sensor is not None:
+			self._door_sensor.close()
+		self.cancelDelayedLock()
+		self._scheduler.close()
+		GPIO.output(pins.BUZZER_PIN,GPIO.LOW)
+		with _metrics.PHASE_SECONDS.time(phase="teardown"):
+			_control_lock._tearDown(self._servo)
+		self._shared_state.close()
+		_history.getHistory().flush()
@@ -0,0 +1,172 @@
+"""Process-wide counters and latency histograms, exported in the Prometheus
+text format by serve(). Recording takes a lock and a few dict operations,
+microseconds against the milliseconds to seconds a command takes.
+"""
+import time
+import bisect
+import logging
+import threading
+try:
+	from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError: # python 2
+	from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+# seconds, upper bounds of the histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+log = logging.getLogger(__name__)
+
+_registry = []
+
+class _Metric(object):
+
+	def __init__(self, name, description, label_names):
+		self.name = name
+		self.description = description
+		self._label_names = tuple(label_names)
+		self._lock = threading.Lock()
+		_registry.append(self)
+
+	def _key(self, labels):
+		if set(labels) != set(self._label_names):
+			raise ValueError("%s takes labels %s" % (self.name, ", ".join(self._label_names)))
+		return tuple(str(labels[name]) for name in self._label_names)
+
+	def _labelText(self, key, extra=()):
+		pairs = list(zip(self._label_names, key)) + list(extra)
+		if not pairs:
+			return ""
+		return "{%s}" % ",".join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+class Counter(_Metric):
+
+	def __init__(self, name, description, label_names=()):
+		_Metric.__init__(self, name, description, label_names)
+		self._values = {}
+
+	def inc(self, amount=1, **labels):
+		key = self._key(labels)
+		with self._lock:
+			self._values[key] = self._values.get(key, 0) + amount
+
+	def value(self, **labels):
+		with self._lock:
+			return self._values.get(self._key(labels), 0)
+
+	def render(self):
+		lines = ["# HELP %s %s" % (self.name, self.description), "# TYPE %s counter" % self.name]
+		with self._lock:
+			for key, value in sorted(self._values.items()):
+				lines.append("%s%s %s" % (self.name, self._labelText(key), _number(value)))
+		return lines
+
+class Histogram(_Metric):
+
+	def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+		_Metric.__init__(self, name, description, label_names)
+		self._buckets = tuple(buckets)
+		self._series = {} # labels -> [count per bucket plus +Inf, sum]
+
+	def observe(self, value, **labels):
+		key = self._key(labels)
+		index = bisect.bisect_left(self._buckets, value)
+		with self._lock:
+			series = self._series.get(key)
+			if series is None:
+				series = self._series[key] = [[0] * (len(self._buckets) + 1), 0.0]
+			series[0][index] += 1
+			series[1] += value
+
+	def time(self, **labels):
+		"""Context manager observing how long its block takes."""
+		return _Timer(self, labels)
+
+	def count(self, **labels):
+		with self._lock:
+			series = self._series.get(self._key(labels))
+			return sum(series[0]) if series else 0
+
+	def render(self):
+		lines = ["# HELP %s %s" % (self.name, self.description), "# TYPE %s histogram" % self.name]
+		with self._lock:
+			for key, (counts, total) in sorted(self._series.items()):
+				cumulative = 0
+				for bound, count in zip(self._buckets + (float("inf"),), counts):
+					cumulative += count
+					le = "+Inf" if bound == float("inf") else _number(bound)
+					lines.append("%s_bucket%s %d" % (self.name, self._labelText(key, [("le", le)]), cumulative))
+				lines.append("%s_sum%s %s" % (self.name, self._labelText(key), _number(total)))
+				lines.append("%s_count%s %d" % (self.name, self._labelText(key), cumulative))
+		return lines
+
+class _Timer(object):
+
+	def __init__(self, histogram, labels):
+		self._histogram = histogram
+		self._labels = labels
+
+	def __enter__(self):
+		self._started = time.time()
+		return self
+
+	def __exit__(self, *exc_info):
+		self._histogram.observe(time.time() - self._started, **self._labels)
+		return False
+
+def _number(value):
+	return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+	return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def render():
+	"""All metrics in the Prometheus text exposition format."""
+	lines = []
+	for metric in _registry:
+		lines.extend(metric.render())
+	return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if self.path != "/metrics":
+			self.send_error(404)
+			return
+		body = render().encode("utf-8")
+		self.send_response(200)
+		self.send_header("Content-Type", "text/plain; version=0.0.4")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		log.debug(format, *args)
+
+def serve(address, port):
+	"""Starts serving GET /metrics on a background thread and returns the server."""
+	server = HTTPServer((address, port), _MetricsHandler)
+	thread = threading.Thread(target=server.serve_forever)
+	thread.daemon = True
+	thread.start()
+	return server
+
+COMMANDS = Counter("door_lock_commands_total",
+	"Commands run, by command and outcome.", ("command", "outcome"))
+PHASE_SECONDS = Histogram("door_lock_phase_seconds",
+	"Time spent in each phase of running commands.", ("phase",))
+PRESS_LATENCY_SECONDS = Histogram("door_lock_press_latency_seconds",
+	"Time from a button press until its action starts.")
+STATE_PARSE_FAILURES = Counter("door_lock_state_parse_failures_total",
+	"Times the state file could not be parsed and the state was reset.")
+STATE_WRITE_FAILURES = Counter("door_lock_state_write_failures_total",
+	"Times saving the state failed.")
+ACTUATION_WAIT_SECONDS = Histogram("door_lock_actuation_wait_seconds",
+	"Time commands waited for the servo, buzzer and LED.")
+ACTUATION_CONTENDED = Counter("door_lock_actuation_contended_total",
+	"Commands that had to wait for another, by where the other one ran.", ("holder",))
+STATE_LOCK_WAIT_SECONDS = Histogram("door_lock_state_lock_wait_seconds",
+	"Time state saves waited for other processes saving the state.")
+CLOSE_TO_LOCK_SECONDS = Histogram("door_lock_close_to_lock_seconds",
+	"Time from the door closing until it is locked, for locks waiting on the door.")
+AUTH_REFUSED = Counter("door_lock_auth_refused_total",
+	"HTTP API requests refused, by reason.", ("reason",))
@@ -0,0 +1,269 @@
+"""Commands run at a time of day, or some time after a lock event.
+
+settings.RULES names the rules, each a dict:
+
+	{"at": "23:00", "command": "lock"}
+	{"after": "unlock", "delay": 300, "command": "lock", "days": "mon-fri"}
+
+An "at" rule runs its command every day at that local time, an "after" rule
+delay seconds after each event of that kind on _event_bus, a later event
+restarting the wait. "days" limits a rule to some weekdays, e.g. "mon-fri"
+or "sat,sun", and "holidays" is "skip" to leave out the days listed in
+settings.HOLIDAYS ("YYYY-MM-DD", or "MM-DD" for every year) or "only" to
+run on them alone.
+
+Rules are parsed once, when the engine starts. Each rule has at most one
+event on the engine's Scheduler: an "at" rule the next time it is due,
+worked out when it runs, an "after" rule the deadline of its latest event.
+In between, the Scheduler's thread sleeps in select() until the earliest
+deadline, and scheduling a rule is a push on the timer heap, O(log n) in
+the number of rules. A rule's command runs on a worker thread, see
+Scheduler.scheduleWork, so it holds up no other event.
+"""
+import re
+import time
+import logging
+import datetime
+import threading
+
+import _clock
+import _event_bus
+import _history
+import commands
+import settings
+
+log = logging.getLogger(__name__)
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# events an "after" rule can follow
+EVENTS = (_event_bus.LOCK, _event_bus.UNLOCK, _event_bus.BUZZ_START, _event_bus.BUZZ_STOP,
+	_event_bus.DOOR_OPENED, _event_bus.DOOR_CLOSED)
+SKIP = "skip"
+ONLY = "only"
+# days looked ahead for the next run of an "at" rule, enough for a rule
+# running only on a 29 February holiday
+LOOKAHEAD_DAYS = 8 * 366
+
+_KEYS = ("at", "after", "delay", "command", "days", "holidays")
+_TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+_HOLIDAY = re.compile(r"^(\d{4}-)?\d{2}-\d{2}$")
+
+class RuleError(ValueError):
+	pass
+
+class Holidays(object):
+	"""The days in a list of "YYYY-MM-DD" dates and yearly "MM-DD" ones."""
+
+	def __init__(self, days):
+		self._dates = set()
+		self._yearly = set()
+		for text in days:
+			if not _HOLIDAY.match(str(text)):
+				raise RuleError("holiday %r is not YYYY-MM-DD or MM-DD" % text)
+			try:
+				# a leap year, so 02-29 is a day
+				datetime.datetime.strptime(text if len(text) > 5 else "2000-" + text, "%Y-%m-%d")
+			except ValueError:
+				raise RuleError("holiday %r is not a day" % text)
+			(self._dates if len(text) > 5 else self._yearly).add(text)
+
+	def __contains__(self, date):
+		day = date.isoformat()
+		return day in self._dates or day[5:] in self._yearly
+
+class Rule(object):
+
+	def __init__(self, name, command, at=None, after=None, delay=None, days=None, holidays=None):
+		self.name = name
+		self.command = command
+		self.at = at # (hour, minute) of an "at" rule
+		self.after = after # event of an "after" rule
+		self.delay = delay
+		self.days = days # weekdays it runs on, 0 is Monday, None for all
+		self.holidays = holidays # None, SKIP or ONLY
+
+	def appliesOn(self, date, holidays):
+		"""Whether the rule runs on date, holidays being the Holidays."""
+		if self.days is not None and date.weekday() not in self.days:
+			return False
+		if self.holidays == SKIP:
+			return date not in holidays
+		if self.holidays == ONLY:
+			return date in holidays
+		return True
+
+	def nextRun(self, now, holidays):
+		"""The first time after now an "at" rule is due, None if it never is."""
+		start = datetime.date.fromtimestamp(now)
+		hour, minute = self.at
+		for offset in range(LOOKAHEAD_DAYS):
+			date = start + datetime.timedelta(offset)
+			if not self.appliesOn(date, holidays):
+				continue
+			due = time.mktime((date.year, date.month, date.day, hour, minute, 0, 0, 0, -1))
+			if due > now:
+				return due
+		return None
+
+	def __repr__(self):
+		if self.at is not None:
+			return "%s at %02d:%02d" % (self.command, self.at[0], self.at[1])
+		return "%s %gs after %s" % (self.command, self.delay, self.after)
+
+def parse(name, spec, sequences=None):
+	"""The Rule called name written as spec, raises RuleError when it is not one.
+	sequences are the commands defined in settings.SEQUENCES by default.
+	"""
+	if not isinstance(spec, dict):
+		raise RuleError("rule %s is not a dict" % name)
+	unknown = set(spec).difference(_KEYS)
+	if unknown:
+		raise RuleError("rule %s: unknown keys %s" % (name, ", ".join(sorted(unknown))))
+	command = spec.get("command")
+	if command not in commands.ALL and command not in (settings.SEQUENCES if sequences is None else sequences):
+		raise RuleError("rule %s: unknown command %r" % (name, command))
+	if ("at" in spec) == ("after" in spec):
+		raise RuleError("rule %s needs either at or after" % name)
+	rule = Rule(name, command, days=_parseDays(name, spec.get("days")), holidays=spec.get("holidays"))
+	if rule.holidays not in (None, SKIP, ONLY):
+		raise RuleError("rule %s: holidays is %r or %r" % (name, SKIP, ONLY))
+	if "at" in spec:
+		match = _TIME.match(str(spec["at"]))
+		if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+			raise RuleError("rule %s: at %r is not HH:MM" % (name, spec["at"]))
+		if "delay" in spec:
+			raise RuleError("rule %s: delay goes with after" % name)
+		rule.at = (int(match.group(1)), int(match.group(2)))
+	else:
+		if spec["after"] not in EVENTS:
+			raise RuleError("rule %s: after is one of %s" % (name, ", ".join(EVENTS)))
+		delay = spec.get("delay")
+		if isinstance(delay, bool) or not isinstance(delay, (int, float)) or delay < 0:
+			raise RuleError("rule %s: delay is seconds" % name)
+		rule.after = spec["after"]
+		rule.delay = delay
+	return rule
+
+def _parseDays(name, text):
+	if text is None:
+		return None
+	try:
+		return parseDays(text)
+	except RuleError as e:
+		raise RuleError("rule %s: %s" % (name, e))
+
+def parseDays(text):
+	"""The weekdays in text like "mon-fri" or "sat,sun", 0 being Monday.
+	Raises RuleError.
+	"""
+	if not isinstance(text, (str, type(u""))):
+		raise RuleError("days is text like \"mon-fri\"")
+	days = set()
+	for part in text.lower().split(","):
+		first, _, last = part.strip().partition("-")
+		if first not in WEEKDAYS or (last and last not in WEEKDAYS):
+			raise RuleError("%r is not a weekday or range of them" % part.strip())
+		day = WEEKDAYS.index(first)
+		days.add(day)
+		while last and WEEKDAYS[day] != last: # "fri-mon" wraps around the weekend
+			day = (day + 1) % len(WEEKDAYS)
+			days.add(day)
+	return days
+
+def check():
+	"""Parses settings.RULES and settings.HOLIDAYS, raising RuleError on the
+	first mistake.
+	"""
+	Holidays(settings.HOLIDAYS)
+	for name, spec in sorted(settings.RULES.items()):
+		parse(name, spec)
+
+class Rules(object):
+	"""Runs rules on engine, each due one a command from source "rule:<name>",
+	timed by scheduler. Events from the doors in _doors, which carry a "door",
+	are not the engine's and trigger nothing.
+	"""
+
+	def __init__(self, engine, scheduler, rules=None, holidays=None):
+		self._engine = engine
+		self._scheduler = scheduler
+		if rules is None:
+			rules = settings.RULES
+		self._rules = [parse(name, spec) for name, spec in sorted(rules.items())]
+		self._holidays = Holidays(settings.HOLIDAYS if holidays is None else holidays)
+		self._after = {} # event -> "after" rules following it
+		for rule in self._rules:
+			if rule.after is not None:
+				self._after.setdefault(rule.after, []).append(rule)
+		self._lock = threading.Lock()
+		self._scheduled = {} # rule name -> its pending ScheduledEvent
+		self._listener = None
+		self._closed = False
+
+	def start(self):
+		now = _clock.clock.time()
+		with self._lock:
+			for rule in self._rules:
+				if rule.at is not None:
+					self._scheduleNext(rule, now)
+		if self._after:
+			self._listener = _event_bus.bus.listen(self._onEvent)
+
+	def upcoming(self):
+		"""(time, rule name) of the rules waiting to run, soonest first."""
+		with self._lock:
+			return sorted((event.deadline, name) for name, event in self._scheduled.items() if event.pending)
+
+	def _scheduleNext(self, rule, now):
+		# caller holds _lock
+		due = rule.nextRun(now, self._holidays)
+		if due is None:
+			log.warning("rule %s never runs again", rule.name)
+			self._scheduled.pop(rule.name, None)
+			return
+		self._scheduled[rule.name] = self._scheduler.scheduleWork(due - _clock.clock.time(), self._due, rule, due)
+
+	def _onEvent(self, event):
+		# runs on the publishing thread, see EventBus.listen
+		rules = self._after.get(event["event"])
+		if not rules or "door" in event:
+			return
+		date = datetime.date.fromtimestamp(event["time"])
+		with self._lock:
+			if self._closed:
+				return
+			for rule in rules:
+				if not rule.appliesOn(date, self._holidays):
+					continue
+				pending = self._scheduled.get(rule.name)
+				if pending is not None:
+					try:
+						self._scheduler.reschedule(pending, rule.delay)
+						continue
+					except ValueError:
+						pass # ran in the meantime
+				self._scheduled[rule.name] = self._scheduler.scheduleWork(rule.delay, self._due, rule, None)
+
+	def _due(self, rule, due):
+		# on a worker thread
+		with self._lock:
+			if self._closed:
+				return
+			if rule.at is not None:
+				self._scheduleNext(rule, due)
+			elif not self._scheduled[rule.name].pending: # else an event came since
+				del self._scheduled[rule.name]
+		log.info("rule %s: %r", rule.name, rule)
+		try:
+			self._engine.execute(rule.command, source=_history.source(_history.RULE, rule.name))
+		except Exception:
+			log.exception("rule %s: %s failed", rule.name, rule.command)
+
+	def close(self):
+		if self._listener is not None:
+			self._listener.close()
+		with self._lock:
+			self._closed = True
+			for event in self._scheduled.values():
+				self._scheduler.cancel(event)
+			self._scheduled = {}
@@ -0,0 +1,157 @@
+import heapq
+import logging
+import itertools
+import threading
+
+import _clock
+from _wake_pipe import WakePipe
+
+log = logging.getLogger(__name__)
+
+class ScheduledEvent(object):
+	"""Handle returned by Scheduler.schedule, pass it back to cancel or
+	reschedule the event.
+	"""
+
+	def __init__(self, clock, deadline, callback, args):
+		self._clock = clock
+		self.deadline = deadline
+		self.callback = callback
+		self.args = args
+		self.pending = True # False once cancelled or run
+
+	def remaining(self):
+		return max(0.0, self.deadline - self._clock.time())
+
+class Scheduler(object):
+	"""Runs callbacks at their deadlines from a timer heap on a single worker
+	thread, which sleeps until the earliest deadline. Callbacks should return
+	quickly since they delay every event due after them.
+
+	The thread sleeps on a WakePipe until the earliest deadline, and an event
+	pushed ahead of it or close wakes it, so it never polls.
+
+	On a virtual clock there is no worker thread, events run as the clock's
+	timers when simulated time reaches them.
+	"""
+
+	def __init__(self, clock=None):
+		self._clock = clock or _clock.clock
+		self._heap = []
+		self._counter = itertools.count() # keeps equal deadlines in schedule order
+		self._lock = threading.Lock() # guards the heap, _closed and _workers
+		self._closed = False
+		self._workers = set() # threads running scheduleWork callbacks
+		self._thread = None
+		if not self._clock.virtual:
+			self._wake_pipe = WakePipe()
+			self._thread = threading.Thread(target=self._run)
+			self._thread.daemon = True
+			self._thread.start()
+
+	def schedule(self, delay, callback, *args):
+		event = ScheduledEvent(self._clock, self._clock.time() + delay, callback, args)
+		with self._lock:
+			self._push(event)
+		return event
+
+	def scheduleWork(self, delay, callback, *args):
+		"""Like schedule, but callback runs on a thread of its own, for work
+		like actuating that would hold up the events due after it. close
+		waits for it to finish. On a virtual clock it runs in place.
+		"""
+		return self.schedule(delay, self._startWork, callback, args)
+
+	def cancel(self, event):
+		with self._lock:
+			event.pending = False
+
+	def reschedule(self, event, delay):
+		"""Moves a pending event to delay seconds from now, earlier or later."""
+		with self._lock:
+			if not event.pending:
+				raise ValueError("event was cancelled or has run")
+			event.deadline = self._clock.time() + delay
+			self._push(event)
+
+	def close(self):
+		with self._lock:
+			closing, self._closed = not self._closed, True
+		if self._thread is not None and closing:
+			self._wake_pipe.wake()
+			self._thread.join()
+			self._wake_pipe.close()
+		with self._lock:
+			workers = list(self._workers)
+		for worker in workers:
+			worker.join()
+
+	def _push(self, event):
+		if self._thread is None:
+			self._clock.callAt(event.deadline, self._runVirtual, event, event.deadline)
+			return
+		# superseded heap entries are skipped when they come up, see _popDue
+		heapq.heappush(self._heap, (event.deadline, next(self._counter), event))
+		if self._heap[0][2] is event and not self._closed:
+			self._wake_pipe.wake() # sooner than the thread sleeps for
+
+	def _runVirtual(self, event, deadline):
+		with self._lock:
+			if not event.pending or deadline != event.deadline or self._closed:
+				return
+			event.pending = False
+		self._call(event)
+
+	def _run(self):
+		while True:
+			with self._lock:
+				if self._closed:
+					return
+				event = self._popDue()
+				if event is not None:
+					event.pending = False
+				elif self._heap:
+					timeout = max(0.0, self._heap[0][0] - self._clock.time())
+				else:
+					timeout = None
+			if event is not None:
+				self._call(event)
+			else:
+				self._wake_pipe.wait(timeout)
+
+	def _call(self, event):
+		try:
+			event.callback(*event.args)
+		except Exception:
+			log.exception("scheduled %r failed", event.callback)
+
+	def _startWork(self, callback, args):
+		if self._thread is None:
+			self._work(callback, args)
+			return
+		thread = threading.Thread(target=self._work, args=(callback, args))
+		thread.daemon = True
+		with self._lock:
+			self._workers.add(thread)
+		thread.start()
+
+	def _work(self, callback, args):
+		try:
+			callback(*args)
+		except Exception:
+			log.exception("scheduled %r failed", callback)
+		finally:
+			with self._lock:
+				self._workers.discard(threading.current_thread())
+
+	def _popDue(self):
+		while self._heap:
+			deadline, _, event = self._heap[0]
+			if not event.pending or deadline != event.deadline:
+				heapq.heappop(self._heap)
+			elif deadline <= self._clock.time():
+				heapq.heappop(self._heap)
+				return event
+			else:
+				return None
+		return None
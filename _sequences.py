@@ -0,0 +1,185 @@
+"""Commands written as sequences of steps instead of Python call chains.
+
+A sequence is one or more channels run side by side, separated by "||" (or
+U+2016), each a list of steps run one after another, separated by ";":
+
+	buzz 4s || unlock; blink 20s; lock
+
+buzzes for four seconds while unlocking, blinking for twenty seconds and
+locking. The steps are lock, unlock, toggle, buzz [seconds], blink [seconds]
+(a countdown on the status LED, cut short once the door sensor has seen the
+door open and close again) and wait seconds; buzz and blink without seconds
+last BUZZ_DURATION and DELAYED_LOCK_DELAY. Seconds are written 4, 4s, 1.5s
+or 500ms, blink takes whole seconds only. Channels side by side cannot
+share an output: lock, unlock and toggle drive the servo and the status
+LED, buzz the buzzer and blink the LED, so "lock || unlock" is refused.
+
+The commands in commands.py are the built-in sequences in BUILTINS;
+settings.SEQUENCES adds more by name, or redefines a built-in one.
+_control_lock runs a sequence with the hardware it set up once, see
+_control_lock._runSequence.
+
+The sequences are parsed once, when _config checks a config, and kept
+for as long as settings.SEQUENCES is that config's, see compiled; a
+command only looks its sequence up.
+"""
+import re
+
+import commands
+import settings
+
+LOCK = "lock"
+UNLOCK = "unlock"
+TOGGLE = "toggle"
+BUZZ = "buzz"
+BLINK = "blink"
+WAIT = "wait"
+# step name -> whether it takes seconds: None never, False optionally, True always
+STEPS = {LOCK: None, UNLOCK: None, TOGGLE: None, BUZZ: False, BLINK: False, WAIT: True}
+# step name -> the outputs it drives
+OUTPUTS = {LOCK: ("servo", "LED"), UNLOCK: ("servo", "LED"), TOGGLE: ("servo", "LED"),
+	BUZZ: ("buzzer",), BLINK: ("LED",), WAIT: ()}
+
+PARALLEL = "||"
+SERIAL = ";"
+
+BUILTINS = {
+	commands.LOCK: "lock",
+	commands.UNLOCK: "unlock",
+	commands.TOGGLE: "toggle",
+	commands.BUZZ: "buzz",
+	commands.DELAY_LOCK: "unlock; blink; lock",
+	commands.BUZZ_AND_UNLOCK: "buzz || unlock; blink; lock",
+}
+
+# (SEQUENCES dict, name -> Sequence parsed from it), see compiled
+_compiled = (None, None)
+
+_SECONDS = re.compile(r"^(\d+(?:\.\d*)?|\.\d+)(s|ms)?$")
+
+class SequenceError(ValueError):
+	pass
+
+class Step(object):
+
+	def __init__(self, name, seconds=None):
+		self.name = name
+		self.seconds = seconds # None for the step's default
+
+	def duration(self):
+		"""Seconds a buzz, blink or wait step lasts."""
+		if self.seconds is not None:
+			return self.seconds
+		return settings.BUZZ_DURATION if self.name == BUZZ else settings.DELAYED_LOCK_DELAY
+
+	def __repr__(self):
+		if self.seconds is None:
+			return self.name
+		return "%s %gs" % (self.name, self.seconds)
+
+class Sequence(object):
+
+	def __init__(self, channels):
+		self.channels = channels # lists of Steps, run side by side
+
+	def uses(self, name):
+		return any(step.name == name for channel in self.channels for step in channel)
+
+	def __repr__(self):
+		return (" %s " % PARALLEL).join("; ".join(repr(step) for step in channel)
+			for channel in self.channels)
+
+def parse(text):
+	"""The Sequence written in text, raises SequenceError when it is not one."""
+	if not isinstance(text, type(u"")):
+		text = text.decode("utf-8") # python 2 str
+	text = text.replace(u"\u2016", PARALLEL)
+	channels = []
+	for channel_text in text.split(PARALLEL):
+		channel = [_parseStep(step_text) for step_text in channel_text.split(SERIAL)]
+		channels.append(channel)
+	_checkOutputs(channels)
+	return Sequence(channels)
+
+def _checkOutputs(channels):
+	# no two channels drive the same output
+	users = {} # output -> step name of the channel driving it
+	for channel in channels:
+		mine = {}
+		for step in channel:
+			for output in OUTPUTS[step.name]:
+				if output in users:
+					raise SequenceError("%s and %s side by side both drive the %s" % (users[output], step.name, output))
+				mine.setdefault(output, step.name)
+		users.update(mine)
+
+def _parseStep(text):
+	words = text.split()
+	if not words:
+		raise SequenceError("empty step")
+	name = str(words[0].lower())
+	if name not in STEPS:
+		raise SequenceError("unknown step %r" % name)
+	takes_seconds = STEPS[name]
+	if len(words) > 2 or (len(words) == 2 and takes_seconds is None):
+		raise SequenceError("too many arguments to %s: %r" % (name, text.strip()))
+	if len(words) == 1:
+		if takes_seconds:
+			raise SequenceError("%s needs seconds" % name)
+		return Step(name)
+	match = _SECONDS.match(words[1])
+	if not match:
+		raise SequenceError("%s: %r is not a duration" % (name, words[1]))
+	seconds = float(match.group(1))
+	if match.group(2) == "ms":
+		seconds /= 1000
+	if name == BLINK:
+		if seconds != int(seconds):
+			raise SequenceError("blink takes whole seconds")
+		seconds = int(seconds)
+	return Step(name, seconds)
+
+def definitions():
+	"""Sequence text by command name, the built-in ones and settings.SEQUENCES."""
+	sequences = dict(BUILTINS)
+	sequences.update(settings.SEQUENCES)
+	return sequences
+
+def names():
+	return sorted(definitions())
+
+def compiled(sequences):
+	"""name -> Sequence for the built-in sequences and sequences, a dict like
+	settings.SEQUENCES. Raises SequenceError naming the first one that does
+	not parse. The result for the latest dict is kept, so asking again for
+	the same one parses nothing; a Config's values never change.
+	"""
+	global _compiled
+	cached_sequences, table = _compiled
+	if cached_sequences is sequences:
+		return table
+	definitions = dict(BUILTINS)
+	definitions.update(sequences)
+	table = {}
+	for name, text in sorted(definitions.items()):
+		try:
+			table[name] = parse(text)
+		except SequenceError as e:
+			raise SequenceError("sequence %s: %s" % (name, e))
+	_compiled = (sequences, table) # one assignment, readers see both or neither
+	return table
+
+def lookup(name):
+	"""The Sequence run for command name. Raises NotImplementedError for an
+	unknown command.
+	"""
+	sequence = compiled(settings.SEQUENCES).get(name)
+	if sequence is None:
+		raise NotImplementedError
+	return sequence
+
+def check():
+	"""Parses every defined sequence, raising SequenceError naming the first
+	one that does not parse.
+	"""
+	compiled(settings.SEQUENCES)
@@ -0,0 +1,152 @@
+"""Servo moves that wait only as long as the bolt needs.
+
+A motion profile per direction, measured by calibrate_servo.py and kept in
+settings.SERVO_PROFILE_FILE, gives the seconds the servo takes per unit of
+duty cycle plus a settling margin. A move waits for the distance it covers;
+without a profile it waits the fixed SERVO_ROTATION_DURATION as before.
+
+The servo's position is only known from the lock state, and the bolt may
+have been turned by hand since, so a move is always timed for the full
+distance between the locked and unlocked positions. With SERVO_RAMP_STEPS
+the duty cycle steps towards the target over the move instead of jumping,
+for a gentler start.
+
+A move takes the servo's positions and SERVO_ROTATION_DURATION from
+settings, or from options overriding them for one door's servo, see _doors.
+"""
+import os
+import json
+
+import _clock
+import settings
+
+LOCK = "lock"
+UNLOCK = "unlock"
+DIRECTIONS = (LOCK, UNLOCK)
+
+# direction -> MotionProfile, loaded on first use, see profiles()
+_profiles = None
+
+class MotionProfile(object):
+
+	def __init__(self, seconds_per_duty, settle):
+		if seconds_per_duty < 0 or settle < 0:
+			raise ValueError("motion profile times cannot be negative")
+		self.seconds_per_duty = seconds_per_duty
+		self.settle = settle
+
+	def travelTime(self, distance):
+		"""Seconds for a move over distance units of duty cycle, settling included."""
+		return self.seconds_per_duty * abs(distance) + self.settle
+
+	def toJson(self):
+		return {"seconds_per_duty": self.seconds_per_duty, "settle": self.settle}
+
+	@classmethod
+	def fromTravelTime(cls, seconds, distance, settle):
+		"""The profile of a servo measured to cover distance in seconds."""
+		return cls(float(seconds) / abs(distance), settle)
+
+def loadProfiles(path):
+	"""direction -> MotionProfile from path, empty when there is no such file."""
+	if not os.path.exists(path):
+		return {}
+	with open(path, "r") as f:
+		data = json.loads(f.read())
+	profiles = {}
+	for direction, profile in data.items():
+		if direction not in DIRECTIONS:
+			raise ValueError("%s: unknown direction %r" % (path, direction))
+		profiles[direction] = MotionProfile(profile["seconds_per_duty"], profile["settle"])
+	return profiles
+
+def saveProfiles(path, profiles):
+	data = dict((direction, profile.toJson()) for direction, profile in profiles.items())
+	with open(path + ".tmp", "w") as f:
+		f.write(json.dumps(data, indent=2, sort_keys=True))
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(path + ".tmp", path)
+
+def profiles():
+	global _profiles
+	if _profiles is None:
+		_profiles = loadProfiles(settings.SERVO_PROFILE_FILE)
+	return _profiles
+
+def travelTime(direction, options=None):
+	"""Seconds a move in direction waits for."""
+	profile = profiles().get(direction)
+	if profile is None:
+		return _setting(options, "SERVO_ROTATION_DURATION")
+	start, target = _ends(direction, options)
+	return profile.travelTime(target - start)
+
+def move(servo, direction, options=None):
+	"""Drives servo to the locked or unlocked position and returns once it is there."""
+	start, target = _ends(direction, options)
+	duration = travelTime(direction, options)
+	steps = settings.SERVO_RAMP_STEPS
+	if steps <= 1:
+		servo.start(target)
+		_clock.clock.sleep(duration)
+		return
+	# steps spread over the whole move, the last one leaves the settling time
+	interval = duration / steps
+	servo.start(start + (target - start) / float(steps))
+	for step in range(2, steps + 1):
+		_clock.clock.sleep(interval)
+		servo.ChangeDutyCycle(start + (target - start) * step / float(steps))
+	_clock.clock.sleep(interval)
+
+def _ends(direction, options=None):
+	# duty cycles a move in direction starts from and goes to
+	locked = _setting(options, "SERVO_LOCKED_POSITION")
+	unlocked = _setting(options, "SERVO_UNLOCKED_POSITION")
+	if direction == LOCK:
+		return unlocked, locked
+	return locked, unlocked
+
+def _setting(options, name):
+	if options is not None and name in options:
+		return options[name]
+	return getattr(settings, name)
+
+def _toStart(servo, direction):
+	servo.start(_ends(direction)[0])
+	_clock.clock.sleep(settings.SERVO_ROTATION_DURATION)
+
+def measureWithSwitch(servo, gpio, switch_pin, direction, timeout=None):
+	"""Seconds the bolt takes to move in direction, timed by a bolt switch on
+	switch_pin that pulls it LOW while the bolt is thrown.
+	"""
+	timeout = timeout or 2 * settings.SERVO_ROTATION_DURATION
+	_toStart(servo, direction)
+	thrown = gpio.LOW if direction == LOCK else gpio.HIGH
+	started = _clock.clock.time()
+	servo.start(_ends(direction)[1])
+	try:
+		while gpio.input(switch_pin) != thrown:
+			if _clock.clock.time() - started > timeout:
+				raise IOError("bolt switch on pin %d did not change within %.1f s" % (switch_pin, timeout))
+			_clock.clock.sleep(0.001)
+		return _clock.clock.time() - started
+	finally:
+		servo.stop()
+
+def bisectTravelTime(servo, direction, confirm, tolerance=0.02):
+	"""Shortest seconds a move in direction needs, found by trying moves cut
+	off after a trial time and asking confirm(seconds) whether the bolt made it.
+	"""
+	low, high = 0.0, settings.SERVO_ROTATION_DURATION
+	while high - low > tolerance:
+		trial = (low + high) / 2
+		_toStart(servo, direction)
+		servo.start(_ends(direction)[1])
+		_clock.clock.sleep(trial)
+		servo.stop()
+		if confirm(trial):
+			high = trial
+		else:
+			low = trial
+	return high
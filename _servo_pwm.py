@@ -0,0 +1,77 @@
+"""Opens the servo's PWM output on the backend in settings.SERVO_PWM_BACKEND.
+
+"software" is RPi.GPIO's PWM, timed by a thread that keeps a core busy and
+jitters when the Pi is loaded. "pigpio" has the pigpiod daemon time the
+pulses with DMA, steady under load and without CPU cost in this process.
+It needs pigpiod running (sudo pigpiod) and the pigpio module; with the
+simulated GPIO backend the stand-in in _sim_pigpio is used instead.
+
+Both return an object with RPi.GPIO's PWM methods, so the lock code does not
+care which one drives the servo.
+"""
+import settings
+
+# pigpio numbers pins the Broadcom way, the lock uses the board's pin numbers
+BOARD_TO_BCM = {
+	3: 2, 5: 3, 7: 4, 8: 14, 10: 15, 11: 17, 12: 18, 13: 27, 15: 22, 16: 23,
+	18: 24, 19: 10, 21: 9, 22: 25, 23: 11, 24: 8, 26: 7, 27: 0, 28: 1, 29: 5,
+	31: 6, 32: 12, 33: 13, 35: 19, 36: 16, 37: 26, 38: 20, 40: 21,
+}
+# the only frequency pigpio sends servo pulses at
+PIGPIO_SERVO_FREQUENCY = 50
+
+# connection to pigpiod, made on first use
+_pi = None
+
+def open(gpio, pin, frequency):
+	"""The servo PWM on board pin. gpio is the caller's GPIO module, used by
+	the software backend.
+	"""
+	if settings.SERVO_PWM_BACKEND == "software":
+		return gpio.PWM(pin, frequency)
+	elif settings.SERVO_PWM_BACKEND == "pigpio":
+		return PigpioServo(_connect(), pin, frequency)
+	raise ValueError("unknown servo PWM backend %r, use software or pigpio" % settings.SERVO_PWM_BACKEND)
+
+def _connect():
+	global _pi
+	if _pi is None:
+		import _gpio
+		if _gpio.BACKEND == "sim":
+			import _sim_pigpio as pigpio
+		else:
+			import pigpio # only needed for this backend
+		pi = pigpio.pi(settings.PIGPIO_HOST, settings.PIGPIO_PORT)
+		if not pi.connected:
+			raise IOError("cannot reach pigpiod at %s:%d, start it with sudo pigpiod" %
+				(settings.PIGPIO_HOST, settings.PIGPIO_PORT))
+		_pi = pi
+	return _pi
+
+class PigpioServo(object):
+	"""RPi.GPIO PWM look-alike sending servo pulses through pigpiod. A duty
+	cycle is turned into the pulse width it stands for at frequency.
+	"""
+
+	def __init__(self, pi, pin, frequency):
+		if frequency != PIGPIO_SERVO_FREQUENCY:
+			raise ValueError("pigpio servo pulses are %d Hz" % PIGPIO_SERVO_FREQUENCY)
+		if pin not in BOARD_TO_BCM:
+			raise ValueError("board pin %d is not a GPIO" % pin)
+		self._pi = pi
+		self.gpio = BOARD_TO_BCM[pin]
+		self.frequency = frequency
+
+	def start(self, dutycycle):
+		self.ChangeDutyCycle(dutycycle)
+
+	def ChangeDutyCycle(self, dutycycle):
+		# percent of the period, in microseconds
+		self._pi.set_servo_pulsewidth(self.gpio, int(round(dutycycle * 10000.0 / self.frequency)))
+
+	def ChangeFrequency(self, frequency):
+		if frequency != PIGPIO_SERVO_FREQUENCY:
+			raise ValueError("pigpio servo pulses are %d Hz" % PIGPIO_SERVO_FREQUENCY)
+
+	def stop(self):
+		self._pi.set_servo_pulsewidth(self.gpio, 0)
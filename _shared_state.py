@@ -0,0 +1,116 @@
+"""The lock state in shared memory, for other processes to read cheaply.
+
+The lock daemon publishes whether the door is locked, when that state was
+last written with a new value (unknown until it is, after the daemon
+starts), the deadline of a pending delayed lock and the publishing pid in a
+small memory-mapped file, settings.SHARED_STATE_FILE (under /dev/shm, so it
+never touches the SD card). A reader maps it once and then reads without
+system calls, e.g. status.py.
+
+Writes follow a seqlock: the writer makes the sequence number odd, writes
+the fields and makes it even again. A reader copies the fields between two
+reads of the sequence number and retries when they differ or are odd, so it
+never sees half a write and never holds up the writer. Sequence number / 2
+is the number of updates published. The state file written through
+_state_store stays the durable copy.
+"""
+import os
+import mmap
+import fcntl
+import struct
+
+import settings
+
+MAGIC = b"DLK1"
+# magic, sequence, pid, locked, changed_at (NaN when unknown), delayed lock deadline (NaN for none)
+RECORD = struct.Struct("<4sIIB3xdd")
+SEQUENCE = struct.Struct("<I")
+SEQUENCE_OFFSET = 4
+# reads retried while a write is in progress, before giving up
+READ_ATTEMPTS = 1000
+
+class SharedStateWriter(object):
+	"""Publishes the state to path, creating it if needed."""
+
+	def __init__(self, path=None):
+		self._fd = os.open(path or settings.SHARED_STATE_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+		if os.fstat(self._fd).st_size < RECORD.size:
+			os.ftruncate(self._fd, RECORD.size)
+		self._map = mmap.mmap(self._fd, RECORD.size)
+
+	def publish(self, locked, deadline=None, changed_at=None):
+		"""Publishes locked, the delayed lock deadline and the time locked
+		changed, in _clock time. deadline is None when no delayed lock is
+		pending, changed_at when the time is not known.
+		"""
+		# another process may publish too, e.g. a command script run while the daemon is down
+		fcntl.flock(self._fd, fcntl.LOCK_EX)
+		try:
+			magic, sequence = RECORD.unpack_from(self._map, 0)[:2]
+			if magic != MAGIC:
+				sequence = 0
+			SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, (sequence + 1) & 0xffffffff)
+			RECORD.pack_into(self._map, 0, MAGIC, (sequence + 1) & 0xffffffff, os.getpid(), bool(locked),
+				_orNan(changed_at), _orNan(deadline))
+			SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, (sequence + 2) & 0xffffffff)
+		finally:
+			fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+	def close(self):
+		self._map.close()
+		os.close(self._fd)
+
+class SharedStateReader(object):
+	"""Reads the state published to path, mapping it on first use."""
+
+	def __init__(self, path=None):
+		self._path = path or settings.SHARED_STATE_FILE
+		self._map = None
+
+	def read(self):
+		"""{"locked", "changed_at", "delayed_lock_deadline", "pid", "sequence"},
+		or None when nothing was published yet.
+		"""
+		if self._map is None and not self._open():
+			return None
+		for attempt in range(READ_ATTEMPTS):
+			before = SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0]
+			if before % 2:
+				continue # write in progress
+			magic, sequence, pid, locked, changed_at, deadline = RECORD.unpack_from(self._map, 0)
+			if SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0] != before:
+				continue
+			if magic != MAGIC:
+				return None
+			return {
+				"locked": bool(locked),
+				"changed_at": _orNone(changed_at),
+				"delayed_lock_deadline": _orNone(deadline),
+				"pid": pid,
+				"sequence": sequence,
+			}
+		raise IOError("%s kept changing while being read" % self._path)
+
+	def _open(self):
+		try:
+			fd = os.open(self._path, os.O_RDONLY)
+		except OSError:
+			return False # not published yet
+		try:
+			if os.fstat(fd).st_size < RECORD.size:
+				return False
+			self._map = mmap.mmap(fd, RECORD.size, access=mmap.ACCESS_READ)
+		finally:
+			os.close(fd) # the mapping stays valid
+		return True
+
+	def close(self):
+		if self._map is not None:
+			self._map.close()
+			self._map = None
+
+def _orNan(value):
+	return float("nan") if value is None else value
+
+def _orNone(value):
+	return None if value != value else value # NaN
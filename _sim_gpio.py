@@ -0,0 +1,174 @@
+"""Pure-Python stand-in for RPi.GPIO, for running the lock without a Pi.
+
+Implements the part of the RPi.GPIO API the lock uses and records every
+output level and PWM duty cycle change in events, timed by _clock.clock.
+Input pins are driven with setInput or press, which run edge callbacks on
+the calling thread.
+"""
+import threading
+
+import _clock
+
+BOARD = 10
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+# (time, pin, "level" or "duty", value) in the order they were recorded, which
+# is not time order for channels simulated side by side, see outputHistory
+events = []
+# pin -> current level, for inputs and outputs
+levels = {}
+
+_lock = threading.RLock()
+_mode = None
+_directions = {}
+_edge_detects = {} # pin -> [edge, callbacks, bouncetime in seconds, last edge time]
+
+def _record(pin, kind, value):
+	events.append((_clock.clock.time(), pin, kind, value))
+
+def _checkSetUp(channel, direction):
+	if _directions.get(channel) != direction:
+		raise RuntimeError("The GPIO channel has not been set up as an %s" %
+			("OUTPUT" if direction == OUT else "INPUT"))
+
+def setwarnings(flag):
+	pass
+
+def setmode(mode):
+	global _mode
+	if mode not in (BOARD, BCM):
+		raise ValueError("An invalid mode was passed to setmode()")
+	_mode = mode
+
+def getmode():
+	return _mode
+
+def setup(channel, direction, pull_up_down=PUD_OFF, initial=-1):
+	with _lock:
+		if _mode is None:
+			raise RuntimeError("Please set pin numbering mode using GPIO.setmode(GPIO.BOARD) or GPIO.setmode(GPIO.BCM)")
+		_directions[channel] = direction
+		if direction == IN:
+			levels[channel] = HIGH if pull_up_down == PUD_UP else LOW
+		elif initial != -1:
+			output(channel, initial)
+
+def output(channel, value):
+	with _lock:
+		_checkSetUp(channel, OUT)
+		level = HIGH if value else LOW
+		levels[channel] = level
+		_record(channel, "level", level)
+
+def input(channel):
+	with _lock:
+		if channel not in _directions:
+			raise RuntimeError("You must setup() the GPIO channel first")
+		return levels[channel]
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+	with _lock:
+		_checkSetUp(channel, IN)
+		if channel in _edge_detects:
+			raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+		callbacks = [callback] if callback else []
+		_edge_detects[channel] = [edge, callbacks, (bouncetime or 0) / 1000.0, None]
+
+def add_event_callback(channel, callback):
+	with _lock:
+		_edge_detects[channel][1].append(callback)
+
+def remove_event_detect(channel):
+	with _lock:
+		_edge_detects.pop(channel, None)
+
+def cleanup(channel=None):
+	global _mode
+	with _lock:
+		channels = [channel] if channel is not None else list(_directions)
+		for pin in channels:
+			_directions.pop(pin, None)
+			_edge_detects.pop(pin, None)
+		if channel is None:
+			_mode = None
+
+class PWM(object):
+
+	def __init__(self, channel, frequency):
+		_checkSetUp(channel, OUT)
+		self.channel = channel
+		self.frequency = frequency
+		self.duty_cycle = None # None while stopped
+
+	def start(self, dutycycle):
+		self.ChangeDutyCycle(dutycycle)
+
+	def ChangeDutyCycle(self, dutycycle):
+		if not 0.0 <= dutycycle <= 100.0:
+			raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+		with _lock:
+			self.duty_cycle = dutycycle
+			_record(self.channel, "duty", dutycycle)
+
+	def ChangeFrequency(self, frequency):
+		self.frequency = frequency
+
+	def stop(self):
+		with _lock:
+			if self.duty_cycle is not None:
+				self.duty_cycle = None
+				_record(self.channel, "duty", None)
+
+def setInput(channel, value):
+	"""Drives input channel to value, running its edge callbacks when the
+	change matches the detected edge and falls outside the bounce time.
+	"""
+	with _lock:
+		_checkSetUp(channel, IN)
+		old = levels[channel]
+		new = HIGH if value else LOW
+		levels[channel] = new
+		detect = _edge_detects.get(channel)
+		if old == new or detect is None:
+			return
+		edge, callbacks, bouncetime, last = detect
+		if edge != BOTH and edge != (RISING if new == HIGH else FALLING):
+			return
+		now = _clock.clock.time()
+		if last is not None and now - last < bouncetime:
+			return
+		detect[3] = now
+		callbacks = list(callbacks)
+	for callback in callbacks:
+		callback(channel)
+
+def press(channel):
+	"""Simulates a push button pulling channel low, then releasing it."""
+	setInput(channel, LOW)
+	setInput(channel, HIGH)
+
+def outputHistory(channel, kind="level"):
+	"""Returns the (time, value) changes recorded for channel in time order."""
+	with _lock:
+		return sorted([(t, value) for t, pin, k, value in events if pin == channel and k == kind],
+			key=lambda change: change[0])
+
+def reset():
+	"""Forgets all pin setup and recorded events."""
+	global _mode
+	with _lock:
+		del events[:]
+		levels.clear()
+		_directions.clear()
+		_edge_detects.clear()
+		_mode = None
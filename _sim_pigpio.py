@@ -0,0 +1,50 @@
+"""Pure-Python stand-in for the pigpio module's connection to pigpiod, for
+running the pigpio servo backend without a Pi.
+
+Implements the part of pigpio.pi the servo uses and records every servo
+pulse width change in events, timed by _clock.clock. Pins are BCM numbers,
+as in pigpio.
+"""
+import threading
+
+import _clock
+
+# (time, gpio, pulse width in microseconds, 0 once stopped) in recording order
+events = []
+# gpio -> current servo pulse width
+pulse_widths = {}
+
+_lock = threading.Lock()
+
+class error(Exception):
+	pass
+
+class pi(object):
+
+	def __init__(self, host="localhost", port=8888):
+		self.connected = True
+
+	def set_servo_pulsewidth(self, user_gpio, pulsewidth):
+		if not 0 <= user_gpio <= 31:
+			raise error("GPIO not 0-31")
+		if pulsewidth != 0 and not 500 <= pulsewidth <= 2500:
+			raise error("pulsewidth not 0 or 500-2500")
+		with _lock:
+			pulse_widths[user_gpio] = pulsewidth
+			events.append((_clock.clock.time(), user_gpio, pulsewidth))
+		return 0
+
+	def get_servo_pulsewidth(self, user_gpio):
+		with _lock:
+			if not pulse_widths.get(user_gpio):
+				raise error("GPIO is not in use for servo pulses")
+			return pulse_widths[user_gpio]
+
+	def stop(self):
+		self.connected = False
+
+def reset():
+	"""Forgets all recorded pulse widths."""
+	with _lock:
+		del events[:]
+		pulse_widths.clear()
@@ -0,0 +1,208 @@
+import os
+import time
+import zlib
+import struct
+import numbers
+
+import _clock
+import _metrics
+from _arbiter import ProcessLock
+from _state_store import JsonStateFile
+
+# sequence number, timestamp, key, value kind, value, crc32 of the fields before it
+RECORD = struct.Struct("<Qd16sB8sI")
+_VALUE = struct.Struct("<q")
+_FLOAT_VALUE = struct.Struct("<d")
+
+# value kinds, the header record holds the number of keys in the snapshot
+_HEADER = 0
+_BOOL = 1
+_INT = 2
+_FLOAT = 3
+_NONE = 4
+
+class CorruptJournalError(Exception):
+	pass
+
+class StateJournal(object):
+	"""StateStore backend appending one fixed-size record per changed key,
+	instead of rewriting the whole state.
+
+	The journal starts with a snapshot: a header record giving the number of
+	keys, then one record per key. Compaction rewrites it as a fresh snapshot,
+	when it reaches compact_after records or a new key appears, so every key
+	is in the snapshot. Loading therefore reads backwards from the end of the
+	file only until each key has been seen, and drops a record torn by a power
+	cut. A missing journal is created from the JSON state file at json_path.
+
+	Processes sharing the journal load and save one at a time, under a lock
+	on the file named like it plus .lock, like JsonStateFile. A save that
+	finds the journal changed by another process since this one last read or
+	wrote it reads it again first, so an append goes to the current file and
+	a compaction keeps what the other process saved.
+	"""
+
+	def __init__(self, path, json_path=None, compact_after=1000):
+		self._path = path
+		self._json_path = json_path
+		self._compact_after = compact_after
+		self._keys = set()
+		self._records = 0
+		self._sequence = 0
+		self._file = None
+		self._version = None # the journal as this process last left it, see _stat
+
+	def load(self):
+		with ProcessLock(self._path + ".lock"):
+			return self._load()
+
+	def save(self, state, changes):
+		started = _clock.clock.time()
+		with ProcessLock(self._path + ".lock"):
+			_metrics.STATE_LOCK_WAIT_SECONDS.observe(_clock.clock.time() - started)
+			if self.stale():
+				state = self._load() # another process saved since
+				state.update(changes)
+			if set(changes).difference(self._keys) or self._records + len(changes) > self._compact_after:
+				self._compact(state)
+				return
+			self._append(changes)
+
+	def stale(self):
+		return self._stat() != self._version
+
+	def compact(self, state):
+		"""Replaces the journal with a snapshot of state."""
+		with ProcessLock(self._path + ".lock"):
+			self._compact(state)
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def _stat(self):
+		# tells the journal's versions apart: a compaction replaces the file, a save appends to it
+		try:
+			stat = os.stat(self._path)
+		except OSError:
+			return None
+		return stat.st_ino, stat.st_size, getattr(stat, "st_mtime_ns", stat.st_mtime)
+
+	def _load(self):
+		self.close() # the file may have been replaced
+		if not os.path.exists(self._path):
+			state = JsonStateFile(self._json_path).load() if self._json_path else {}
+			self._compact(state)
+			return state
+		with open(self._path, 'rb') as f:
+			f.seek(0, os.SEEK_END)
+			size = f.tell()
+			records = size // RECORD.size
+			header = _readRecord(f, 0) if records else None
+			if header is None or header[3] != _HEADER:
+				raise CorruptJournalError("%s has no valid header" % self._path)
+			key_count = header[4]
+			self._sequence = header[0]
+			state = {}
+			valid_records = None
+			index = records - 1
+			while index > 0 and len(state) < key_count:
+				record = _readRecord(f, index)
+				index -= 1
+				if record is None:
+					continue # torn or damaged, its key is found further back
+				if valid_records is None:
+					valid_records = index + 2
+					self._sequence = record[0]
+				key, kind, value = record[2:]
+				if key not in state:
+					state[key] = value
+			if len(state) < key_count:
+				raise CorruptJournalError("%s lost %d keys" % (self._path, key_count - len(state)))
+		self._keys = set(state)
+		self._records = valid_records or 1 # only the header when there are no keys
+		if self._records * RECORD.size < size:
+			with open(self._path, 'r+b') as f:
+				f.truncate(self._records * RECORD.size) # appends stay record aligned
+		self._version = self._stat()
+		return state
+
+	def _append(self, changes):
+		if self._file is None:
+			self._file = open(self._path, 'ab')
+		now = time.time()
+		data = []
+		for key, value in changes.items():
+			self._sequence += 1
+			data.append(_packRecord(self._sequence, now, key, value))
+		self._file.write(b"".join(data))
+		self._file.flush()
+		os.fsync(self._file.fileno())
+		self._records += len(changes)
+		self._version = self._stat()
+
+	def _compact(self, state):
+		self.close()
+		now = time.time()
+		self._sequence += 1
+		data = [_packRecord(self._sequence, now, "", len(state), _HEADER)]
+		for key, value in state.items():
+			self._sequence += 1
+			data.append(_packRecord(self._sequence, now, key, value))
+		temporary_path = self._path + ".tmp"
+		with open(temporary_path, 'wb') as f:
+			f.write(b"".join(data))
+			f.flush()
+			os.fsync(f.fileno())
+		os.rename(temporary_path, self._path) # atomic replace
+		self._keys = set(state)
+		self._records = len(data)
+		self._version = self._stat()
+
+def _packRecord(sequence, timestamp, key, value, kind=None):
+	encoded_key = key.encode("utf-8")
+	if len(encoded_key) > 16:
+		raise ValueError("journal keys are at most 16 bytes: %r" % key)
+	if kind is None:
+		kind = _kindOf(value)
+	if kind == _FLOAT:
+		packed = _FLOAT_VALUE.pack(value)
+	elif kind == _NONE:
+		packed = _VALUE.pack(0)
+	else:
+		packed = _VALUE.pack(int(value))
+	fields = RECORD.pack(sequence, timestamp, encoded_key, kind, packed, 0)[:-4]
+	return fields + struct.pack("<I", zlib.crc32(fields) & 0xffffffff)
+
+def _kindOf(value):
+	if value is None:
+		return _NONE
+	if isinstance(value, bool):
+		return _BOOL
+	if isinstance(value, numbers.Integral):
+		return _INT
+	if isinstance(value, float):
+		return _FLOAT
+	raise TypeError("the journal stores booleans and numbers, not %r" % (value,))
+
+def _readRecord(f, index):
+	"""Returns (sequence, timestamp, key, kind, value) or None when the record
+	fails its checksum.
+	"""
+	f.seek(index * RECORD.size)
+	data = f.read(RECORD.size)
+	if len(data) < RECORD.size:
+		return None
+	sequence, timestamp, key, kind, packed, crc = RECORD.unpack(data)
+	if zlib.crc32(data[:-4]) & 0xffffffff != crc:
+		return None
+	if kind == _FLOAT:
+		value = _FLOAT_VALUE.unpack(packed)[0]
+	elif kind == _NONE:
+		value = None
+	elif kind == _BOOL:
+		value = bool(_VALUE.unpack(packed)[0])
+	else:
+		value = _VALUE.unpack(packed)[0]
+	return sequence, timestamp, key.rstrip(b"\0").decode("utf-8"), kind, value
@@ -0,0 +1,159 @@
+import os
+import json
+import logging
+import threading
+
+import _clock
+import _metrics
+from _arbiter import ProcessLock
+
+log = logging.getLogger(__name__)
+
+class StateStore(object):
+	"""Keeps the persistent state in memory. The backend is read on first
+	use, and again by refresh once another process has saved to it, and
+	written behind: changes made within write_delay seconds of each other go
+	out as a single save. The time each key last took a new value is kept
+	as well, see changedAt.
+
+	A backend has load(), save(state, changes) and stale(), which tells
+	whether another process saved since this one last loaded or saved.
+	"""
+
+	def __init__(self, backend, write_delay):
+		self._backend = backend
+		self._write_delay = write_delay
+		self._lock = threading.RLock()
+		self._state = None
+		self._changes = {} # keys set since the last save
+		self._changed_at = {} # key -> _clock time it last took a new value
+		self._timer = None
+
+	def get(self, key):
+		with self._lock:
+			return self._loaded()[key]
+
+	def set(self, key, value):
+		with self._lock:
+			state = self._loaded()
+			if key not in state or state[key] != value:
+				self._changed_at[key] = _clock.clock.time()
+			state[key] = value
+			self._changes[key] = value
+			if self._timer is None:
+				self._timer = threading.Timer(self._write_delay, self._writeBehind)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def refresh(self):
+		"""Reads the backend again if another process saved to it since, keeping
+		the changes not saved yet. Costs a stat otherwise. Returns whether it
+		read the backend.
+		"""
+		with self._lock:
+			if self._state is None or not self._backend.stale():
+				return False
+			state = self._backend.load()
+			state.update(self._changes)
+			now = _clock.clock.time()
+			for key, value in state.items():
+				if key not in self._state or self._state[key] != value:
+					self._changed_at[key] = now # when this process learnt of it
+			self._state = state
+			return True
+
+	def changedAt(self, key):
+		"""The _clock time set last gave key a new value, None when it has not
+		since the state was loaded.
+		"""
+		with self._lock:
+			return self._changed_at.get(key)
+
+	def flush(self):
+		"""Writes pending changes now."""
+		with self._lock:
+			timer = self._timer
+			self._timer = None
+			if timer is not None:
+				timer.cancel()
+			if self._changes:
+				self._write()
+		if timer is not None:
+			timer.join() # gone before a one-shot process exits
+
+	def _loaded(self):
+		if self._state is None:
+			self._state = self._backend.load()
+		return self._state
+
+	def _writeBehind(self):
+		with self._lock:
+			if self._timer is not threading.current_thread():
+				return # flushed in the meantime
+			self._timer = None
+			try:
+				self._write()
+			except (IOError, OSError):
+				_metrics.STATE_WRITE_FAILURES.inc()
+				log.exception("saving state failed, retrying on the next change")
+
+	def _write(self):
+		with _metrics.PHASE_SECONDS.time(phase="persistence"):
+			self._backend.save(self._state, self._changes)
+		self._changes = {}
+
+class JsonStateFile(object):
+	"""The state as one JSON object, rewritten in full by each save. Saves go
+	to a temporary file that is renamed over the state file, so a power cut
+	leaves either the old or the new state, never a partial one.
+
+	Processes sharing the file save one at a time, under a lock on the file
+	named like it plus .lock, and a save only changes the keys that changed,
+	keeping what other processes saved in the meantime.
+	"""
+
+	def __init__(self, path):
+		self._path = path
+		self._version = None # the file as this process last read or wrote it, see _version
+
+	def load(self):
+		self._version = _version(self._path) # before reading, a save in between reads again
+		return _read(self._path)
+
+	def stale(self):
+		return _version(self._path) != self._version
+
+	def save(self, state, changes):
+		started = _clock.clock.time()
+		with ProcessLock(self._path + ".lock"):
+			_metrics.STATE_LOCK_WAIT_SECONDS.observe(_clock.clock.time() - started)
+			saved = _read(self._path)
+			saved.update(changes)
+			temporary_path = self._path + ".tmp"
+			with open(temporary_path, 'w') as f:
+				f.write(json.dumps(saved))
+				f.flush()
+				os.fsync(f.fileno())
+			os.rename(temporary_path, self._path) # atomic replace
+			self._version = _version(self._path)
+
+def _version(path):
+	# tells versions of the file at path apart, every save renames a new file over it
+	try:
+		stat = os.stat(path)
+	except OSError:
+		return None
+	return stat.st_ino, stat.st_size, getattr(stat, "st_mtime_ns", stat.st_mtime)
+
+def _read(path):
+	try:
+		with open(path, 'r') as f:
+			return json.loads(f.read())
+	except ValueError:
+		_metrics.STATE_PARSE_FAILURES.inc()
+		log.warning("%s is not valid JSON, starting from an empty state", path)
+		return {}
+	except (IOError, OSError):
+		if os.path.exists(path):
+			raise
+		return {} # not written yet
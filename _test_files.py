@@ -0,0 +1,106 @@
+"""Keeps tests off the lock's real files and pins. TempFiles points the
+files the command scripts and the engine write, FILES, into a temporary
+directory and starts the state store and history over there:
+
+	self.files = _test_files.TempFiles()
+	self.files.start() # in setUp
+	self.files.stop() # in tearDown
+
+SimulatedLock does that too, and runs the lock on the pins of _sim_gpio
+and a VirtualClock, see its docstring.
+"""
+import os
+import mock
+import shutil
+import tempfile
+
+import _clock
+import _sim_gpio as GPIO
+import _control_lock
+import _history
+import _lock_engine
+from _clock import VirtualClock
+
+FILES = ("HISTORY_FILE", "ACTUATION_LOCK_FILE", "SHARED_STATE_FILE", "PERSISTENT_STATE_FILE")
+# modules driving pins through the GPIO module they imported
+GPIO_MODULES = ("_control_lock", "_lock_engine", "_doors", "program_loop")
+
+class TempFiles(object):
+
+	def __init__(self):
+		self.directory = None
+		self._patches = []
+
+	def start(self):
+		"""Patches settings and returns the temporary directory."""
+		self.directory = tempfile.mkdtemp()
+		self._patches = [mock.patch("settings." + name, os.path.join(self.directory, name.lower()))
+			for name in FILES]
+		for patch in self._patches:
+			patch.start()
+		_control_lock._state_store = None
+		_history._history = None
+		return self.directory
+
+	def stop(self):
+		if _control_lock._state_store is not None:
+			_control_lock._state_store.flush()
+		if _history._history is not None:
+			_history._history.close()
+		_control_lock._state_store = None
+		_history._history = None
+		for patch in self._patches:
+			patch.stop()
+		shutil.rmtree(self.directory)
+
+class SimulatedLock(object):
+	"""The lock on simulated pins, with its files in a temporary directory:
+
+		self.lock = _test_files.SimulatedLock()
+		self.clock = self.lock.start() # in setUp
+		self.lock.stop() # in tearDown
+
+	Time is clock, a VirtualClock starting at 0 unless given. overrides
+	patches names, e.g. {"pins.DOOR_SENSOR_PIN": 29}, before anything is set
+	up. With engine, start makes a LockEngine, self.engine, which stop closes.
+	The files are in self.files.directory.
+	"""
+
+	def __init__(self, clock=None, engine=False, overrides=None):
+		self.clock = VirtualClock() if clock is None else clock
+		self.files = TempFiles()
+		self.engine = None
+		self._make_engine = engine
+		self._overrides = overrides or {}
+		self._patches = []
+		self._old_clock = None
+
+	def start(self):
+		"""Sets the lock up and returns the clock."""
+		GPIO.reset()
+		self._old_clock = _clock.use(self.clock)
+		self._patches = [mock.patch(module + ".GPIO", GPIO) for module in GPIO_MODULES]
+		self._patches.extend(mock.patch(name, value) for name, value in sorted(self._overrides.items()))
+		for patch in self._patches:
+			patch.start()
+		self.files.start()
+		if self._make_engine:
+			try:
+				self.engine = _lock_engine.LockEngine()
+			except BaseException:
+				self.stop()
+				raise
+		return self.clock
+
+	def stop(self):
+		try:
+			if self.engine is not None:
+				self.engine.close()
+				self.engine = None
+			self.files.stop()
+		finally:
+			for patch in reversed(self._patches):
+				patch.stop()
+			self._patches = []
+			_clock.use(self._old_clock)
+			GPIO.reset()
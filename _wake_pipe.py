@@ -0,0 +1,52 @@
+"""Sleeping until woken or a timeout, without polling.
+
+threading.Condition.wait and queue.Queue.get with a timeout poll in short
+sleeps on python 2. A WakePipe sleeps in select() on a pipe instead, and
+wake() writes a byte to it. A wake-up that comes while nobody waits makes
+the next wait() return at once, so a waiter checks what it waits for
+before each wait() and wakes up spuriously at most once.
+"""
+import os
+import errno
+import fcntl
+import select
+
+class WakePipe(object):
+
+	def __init__(self):
+		self._read, self._write = os.pipe()
+		for fd in (self._read, self._write):
+			fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+		self._closed = False
+
+	def wait(self, timeout=None):
+		"""Sleeps until wake() or for timeout seconds, forever when None.
+		Returns whether it was woken.
+		"""
+		try:
+			readable = select.select([self._read], [], [], timeout)[0]
+		except (select.error, OSError) as e:
+			if e.args[0] != errno.EINTR:
+				raise
+			return False # a signal, the caller looks again
+		if not readable:
+			return False
+		try:
+			os.read(self._read, 4096) # every wake-up so far
+		except OSError as e:
+			if e.errno != errno.EAGAIN:
+				raise
+		return True
+
+	def wake(self):
+		try:
+			os.write(self._write, b"x")
+		except OSError as e:
+			if e.errno != errno.EAGAIN:
+				raise # else the pipe is full of wake-ups already
+
+	def close(self):
+		if not self._closed:
+			self._closed = True
+			os.close(self._read)
+			os.close(self._write)
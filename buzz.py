@@ -1,4 +1,4 @@
-import _control_lock
+import _lock_client
 import commands
 
-_control_lock.main(commands.BUZZ)
\ No newline at end of file
+_lock_client.run(commands.BUZZ)
\ No newline at end of file
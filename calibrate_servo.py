@@ -0,0 +1,55 @@
+"""Measures how long the servo takes to lock and unlock and saves the motion
+profiles _servo_motion times its moves with.
+
+	python calibrate_servo.py [--switch PIN] [--samples N]
+
+With --switch, a bolt switch on board pin PIN (closed to ground while the
+bolt is thrown) times each move. Without it, moves are cut off after trial
+times and you answer whether the bolt got all the way.
+Stop the lock daemon first, it holds the servo.
+"""
+import argparse
+try:
+	input = raw_input # python 2
+except NameError:
+	pass
+
+from _gpio import GPIO
+import _config
+import _control_lock
+import _servo_motion
+import settings
+
+def _confirm(seconds):
+	return input("moved for %.3f s, did the bolt go all the way? [y/n] " % seconds).strip().lower().startswith("y")
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--switch", type=int, help="board pin of a bolt switch")
+	parser.add_argument("--samples", type=int, default=5, help="moves timed per direction with --switch")
+	arguments = parser.parse_args()
+	_config.setUp()
+	servo = _control_lock._setup()
+	if arguments.switch:
+		GPIO.setup(arguments.switch, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+	distance = settings.SERVO_LOCKED_POSITION - settings.SERVO_UNLOCKED_POSITION
+	profiles = {}
+	try:
+		for direction in _servo_motion.DIRECTIONS:
+			if arguments.switch:
+				times = sorted(_servo_motion.measureWithSwitch(servo, GPIO, arguments.switch, direction)
+					for i in range(arguments.samples))
+				seconds = times[-1] # the slowest, the bolt has to make it every time
+			else:
+				print("calibrating %s" % direction)
+				seconds = _servo_motion.bisectTravelTime(servo, direction, _confirm)
+			profiles[direction] = _servo_motion.MotionProfile.fromTravelTime(seconds, distance,
+				settings.SERVO_SETTLE_TIME)
+			print("%s: %.3f s" % (direction, profiles[direction].travelTime(distance)))
+	finally:
+		servo.stop()
+	_servo_motion.saveProfiles(settings.SERVO_PROFILE_FILE, profiles)
+	print("saved to %s" % settings.SERVO_PROFILE_FILE)
+
+if __name__ == '__main__':
+	main()
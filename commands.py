@@ -3,4 +3,7 @@ UNLOCK = "unlock"
 BUZZ = "buzz"
 BUZZ_AND_UNLOCK = "buzz_and_unlock"
 TOGGLE = "toggle"
-DELAY_LOCK = "delay_lock"
\ No newline at end of file
+DELAY_LOCK = "delay_lock"
+
+# every command above
+ALL = (LOCK, UNLOCK, BUZZ, BUZZ_AND_UNLOCK, TOGGLE, DELAY_LOCK)
\ No newline at end of file
@@ -0,0 +1,83 @@
+"""Adds, removes and lists who may use the HTTP API.
+
+	python credentials.py add NAME ROLE [--pin DIGITS] [--hours HH:MM-HH:MM] [--days DAYS]
+	python credentials.py remove NAME
+	python credentials.py list
+
+ROLE is lock, buzz or unlock, see _auth.py. Without --pin, add prints a new
+token for NAME's phone to send as "Authorization: Bearer <token>"; it is
+shown this once. Adding a name that exists replaces its credential, e.g.
+
+	python credentials.py add cleaner unlock --pin 4711 --hours 09:00-12:00 --days mon,thu
+
+The lock daemon picks up changes as they are saved. Until the first
+credential is added the HTTP API only serves clients on the Pi itself.
+"""
+import os
+import re
+import sys
+import argparse
+
+import _config
+import _auth
+import settings
+
+_DIGITS = re.compile(r"^\d{4,12}$")
+
+def _pin(text):
+	if not _DIGITS.match(text):
+		raise argparse.ArgumentTypeError("a PIN is 4 to 12 digits")
+	return text
+
+def _add(specs, arguments):
+	spec = {"role": arguments.role}
+	if arguments.hours:
+		spec["hours"] = arguments.hours
+	if arguments.days:
+		spec["days"] = arguments.days
+	token = None
+	if arguments.pin is None:
+		token, spec["token"] = _auth.newToken(arguments.name)
+	else:
+		spec["pin"] = _auth.hashPin(arguments.pin, _auth.readKey(create=True))
+	specs[arguments.name] = spec
+	return token
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	commands = parser.add_subparsers(dest="command")
+	commands.required = True
+	add = commands.add_parser("add", help="add or replace a credential")
+	add.add_argument("name")
+	add.add_argument("role", choices=sorted(_auth.ROLES))
+	add.add_argument("--pin", type=_pin, help="a keypad PIN instead of a phone token")
+	add.add_argument("--hours", help="daily window for commands, e.g. 07:00-22:00")
+	add.add_argument("--days", help="weekdays for commands, e.g. mon-fri")
+	remove = commands.add_parser("remove", help="remove a credential")
+	remove.add_argument("name")
+	commands.add_parser("list", help="list the credentials")
+	arguments = parser.parse_args()
+	_config.setUp()
+	specs = _auth.read() if os.path.exists(settings.CREDENTIALS_FILE) else {}
+	if arguments.command == "list":
+		for name, spec in sorted(specs.items()):
+			sys.stdout.write("%-20s %-7s %-6s %s %s\n" % (name, spec.get("role"), "pin" if "pin" in spec else "token",
+				spec.get("hours", "all day"), spec.get("days", "")))
+		return
+	token = None
+	if arguments.command == "remove":
+		if arguments.name not in specs:
+			sys.exit("no credential %s" % arguments.name)
+		del specs[arguments.name]
+	else:
+		token = _add(specs, arguments)
+	try:
+		_auth.Authorizer(specs, _auth.readKey()) # checks them all, a PIN taken already included
+	except _auth.CredentialError as e:
+		sys.exit(str(e))
+	_auth.write(specs)
+	if token is not None:
+		sys.stdout.write(token + "\n")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,69 @@
+"""Lists the commands run on the lock, or counts them per day.
+
+	python history.py [--since TIME] [--until TIME] [--command C] [--source S] [--limit N]
+	python history.py --daily [--since DAY] [--until DAY] [--command C]
+
+TIME is local time as "YYYY-MM-DD" or "YYYY-MM-DD HH:MM", e.g. who unlocked
+the door between 2 and 4 am:
+
+	python history.py --since "2024-03-02 02:00" --until "2024-03-02 04:00" --command unlock
+
+--since takes what happened from then on and --until what happened before
+then, in both modes. --daily counts whole days, those with part of them
+in that range, so "--daily --until 2024-03-02" ends with 1 March.
+
+--source takes a whole source ("button:11") or a kind ("button", "http",
+"script", "schedule", "rule"). Commands recorded in the last HISTORY_WRITE_DELAY
+seconds may not be written yet.
+"""
+import sys
+import json
+import time
+import argparse
+
+import _config
+import _history
+
+def _timestamp(text):
+	for pattern in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+		try:
+			return time.mktime(time.strptime(text, pattern))
+		except ValueError:
+			pass
+	raise argparse.ArgumentTypeError("%r is not YYYY-MM-DD [HH:MM]" % text)
+
+def _parser():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--since", type=_timestamp, help="from this local time on")
+	parser.add_argument("--until", type=_timestamp, help="before this local time")
+	parser.add_argument("--command")
+	parser.add_argument("--source")
+	parser.add_argument("--limit", type=int)
+	parser.add_argument("--daily", action="store_true", help="count per day, command and outcome")
+	parser.add_argument("--json", action="store_true", help="print JSON lines")
+	return parser
+
+def _rows(history, arguments):
+	# the rows to print and the line format for them
+	if arguments.daily:
+		rows = history.daily(
+			None if arguments.since is None else _history.day(arguments.since),
+			# the last day starting before until, TIME has whole minutes
+			None if arguments.until is None else _history.day(arguments.until - 1),
+			arguments.command)
+		return rows, "%(day)s  %(command)-16s %(outcome)-10s %(count)d"
+	rows = history.events(arguments.since, arguments.until, arguments.command,
+		arguments.source, arguments.limit)
+	for row in rows:
+		row["time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["at"]))
+	return rows, "%(time)s  %(command)-16s %(outcome)-10s %(source)s"
+
+def main():
+	arguments = _parser().parse_args()
+	_config.setUp()
+	rows, line = _rows(_history.getHistory(), arguments)
+	for row in rows:
+		sys.stdout.write((json.dumps(row, sort_keys=True) if arguments.json else line % row) + "\n")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,10 @@
+import _doors
+import _config
+import commands
+
+_config.setUp()
+controller = _doors.DoorController(_doors.fromSettings())
+try:
+	controller.executeAll(commands.LOCK)
+finally:
+	controller.close()
@@ -0,0 +1,3 @@
+import _lock_daemon
+
+_lock_daemon.main()
@@ -2,4 +2,7 @@ SERVO_PIN = 7 # pin controlling the servo controlling the door lock
 LOCK_STATUS_LED_PIN = 11
 BUZZER_PIN = 35
 TOGGLE_LOCK_PIN = 13
-DELAY_LOCK_PIN = 15
\ No newline at end of file
+DELAY_LOCK_PIN = 15
+# reed switch or door contact to ground, closed while the door is, see
+# _door_sensor.py; None without one
+DOOR_SENSOR_PIN = None
\ No newline at end of file
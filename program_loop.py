@@ -1,25 +1,106 @@
-import RPi.GPIO as GPIO
-import time
-import threading
-import _control_lock
+from _gpio import GPIO
+import logging
+import collections
+try:
+	import queue
+except ImportError: # python 2
+	import Queue as queue
 
+import _clock
+import _metrics
+import _arbiter
+import _history
+import _config
+import _door_sensor
 import pins
 import commands
 import settings
+from _lock_engine import LockEngine
+
+# seconds the delay lock button leaves the door unlocked
+DELAY_BUTTON_LOCK_DELAY = 15
+# number of recent presses kept for latency reporting
+LATENCY_HISTORY_LENGTH = 100
+
+# seconds between press and actuation start, most recent last
+press_latencies = collections.deque(maxlen=LATENCY_HISTORY_LENGTH)
+
+log = logging.getLogger(__name__)
+
+# (pin, time) for each press, filled from the GPIO edge detection thread
+_presses = queue.Queue()
+
+def _lock(engine, source):
+	return engine.execute(commands.LOCK, source=source)
+
+def _unlockThenLock(engine, source):
+	timings = engine.execute(commands.UNLOCK, source=source)
+	engine.scheduleLock(DELAY_BUTTON_LOCK_DELAY)
+	return timings
+
+# push button pin in pins.py -> action run on the engine when it is pressed
+BUTTON_ACTIONS = {
+	"TOGGLE_LOCK_PIN": _lock,
+	"DELAY_LOCK_PIN": _unlockThenLock,
+}
+
+def _buttons():
+	# pin number -> action, the pins as configured now
+	return dict((getattr(pins, name), action) for name, action in BUTTON_ACTIONS.items())
+
+def main():
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+	_config.setUp()
+	engine = LockEngine()
+	try:
+		_setup()
+		_loop(engine)
+	finally:
+		engine.close()
 
 def _setup():
 	GPIO.setwarnings(False)
 	GPIO.setmode(GPIO.BOARD)
-	# push buttons
-	GPIO.setup(pins.TOGGLE_LOCK_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-	GPIO.setup(pins.DELAY_LOCK_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+	# push buttons, pressed pulls the pin low
+	for pin in _buttons():
+		GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+		GPIO.add_event_detect(pin, GPIO.FALLING, callback=_onPress,
+			bouncetime=settings.BUTTON_BOUNCE_TIME)
 
-def _loop():
+def _onPress(pin):
+	# runs on the GPIO callback thread, hand over and return straight away
+	_presses.put((pin, _clock.clock.time()))
+
+def _loop(engine):
+	buttons = _buttons()
 	while True:
-		time.sleep(0.2)
-		if GPIO.input(pins.TOGGLE_LOCK_PIN) == False:
-			_control_lock.main(commands.LOCK)
-		if GPIO.input(pins.DELAY_LOCK_PIN) == False:
-			_control_lock.main(commands.UNLOCK)
-			time.sleep(15)
-			_control_lock.main(commands.LOCK)
\ No newline at end of file
+		pin, pressed = _presses.get() # blocks without polling until a press
+		try:
+			timings = buttons[pin](engine, _history.source(_history.BUTTON, pin))
+		except _arbiter.Superseded:
+			log.info("pin %d: superseded by a later command", pin)
+			continue
+		except _door_sensor.DoorOpen as e:
+			log.info("pin %d: refused, %s", pin, e)
+			continue
+		except Exception:
+			log.exception("pin %d: failed", pin) # the buttons keep working
+			continue
+		if "skipped" in timings:
+			log.info("pin %d: skipped, %s", pin, timings["skipped"])
+			continue
+		latency = timings["started"] - pressed
+		press_latencies.append(latency)
+		_metrics.PRESS_LATENCY_SECONDS.observe(latency)
+		log.info("pin %d: press to actuation %.1f ms", pin, latency * 1000)
+
+def pressLatencyStats():
+	latencies = sorted(press_latencies)
+	summary = {"presses": len(latencies)}
+	if latencies:
+		summary["press_latency_max"] = latencies[-1]
+		summary["press_latency_median"] = latencies[len(latencies) // 2]
+	return summary
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,6 @@
+import sys
+
+import _lock_client
+
+# python run_sequence.py <name>, for sequences added in settings.SEQUENCES
+_lock_client.run(sys.argv[1])
@@ -1,8 +1,80 @@
+import os
+
+# directory holding this checkout, /home/pi/DIY-Smart-Door-Lock on the Pi
+_HERE = os.path.dirname(os.path.abspath(__file__))
+# overrides for the names below and in pins.py, checked and reloaded while the
+# daemon runs, see _config.py
+CONFIG_FILE = os.path.join(_HERE, "config.json")
+
 SERVO_ROTATION_DURATION = 1.0 # seconds
 BUZZ_DURATION = 4.0 # seconds
 # servo angles: [2.5 - 10.5] = [0 - 180 deg]
 SERVO_LOCKED_POSITION = 8
 SERVO_UNLOCKED_POSITION = 3.5
-PERSISTENT_STATE_FILE = "/home/pi/DIY-Smart-Door-Lock/_persistent_state.json"
+PERSISTENT_STATE_FILE = os.path.join(_HERE, "_persistent_state.json")
 LOCKED_STATE_KEY = "locked"
-DELAYED_LOCK_DELAY = 20 # seconds
\ No newline at end of file
+DELAYED_LOCK_DELAY = 20 # seconds
+DAEMON_SOCKET_FILE = os.path.join(_HERE, "_lock_daemon.sock")
+BUTTON_BOUNCE_TIME = 200 # milliseconds, presses closer together are ignored
+STATE_WRITE_DELAY = 0.2 # seconds, state changes closer together are written once
+# "json" rewrites PERSISTENT_STATE_FILE on every change, "journal" appends to
+# PERSISTENT_STATE_JOURNAL_FILE and migrates from PERSISTENT_STATE_FILE on first use
+STATE_BACKEND = "json"
+PERSISTENT_STATE_JOURNAL_FILE = os.path.join(_HERE, "_persistent_state.journal")
+STATE_JOURNAL_COMPACT_RECORDS = 1000 # journal length that triggers a compaction
+# "rpi" drives the Pi's pins, "sim" the simulation in _sim_gpio; the
+# DOOR_LOCK_GPIO environment variable overrides it
+GPIO_BACKEND = "rpi"
+# Prometheus metrics of the lock daemon, at http://METRICS_ADDRESS:METRICS_PORT/metrics
+METRICS_ADDRESS = "127.0.0.1"
+METRICS_PORT = 9180
+# HTTP control API of the lock daemon, see _http_api.py
+HTTP_API_ADDRESS = "0.0.0.0"
+HTTP_API_PORT = 8080
+# doors driven by _doors.DoorController: name -> pins and settings differing
+# from the ones above, e.g. {"main": {}, "back": {"SERVO_PIN": 12, ...}}; empty
+# means only the main door
+DOORS = {}
+DOOR_WORKERS = 4 # doors actuated at the same time
+# "software" pulses the servo from RPi.GPIO's PWM thread, "pigpio" has the
+# pigpiod daemon time the pulses in hardware, see _servo_pwm.py
+SERVO_PWM_BACKEND = "software"
+PIGPIO_HOST = "localhost"
+PIGPIO_PORT = 8888
+# measured servo travel times, written by calibrate_servo.py; without it every
+# move waits SERVO_ROTATION_DURATION
+SERVO_PROFILE_FILE = os.path.join(_HERE, "_servo_profile.json")
+SERVO_SETTLE_TIME = 0.05 # seconds added to a calibrated move before stopping the servo
+SERVO_RAMP_STEPS = 0 # duty cycle steps a move is spread over, 0 or 1 jumps straight there
+# locked by whichever process drives the servo, buzzer and LED, see _arbiter.py
+ACTUATION_LOCK_FILE = os.path.join(_HERE, "_actuation.lock")
+# toggles coming less than this many seconds apart make a burst, run as its net effect
+TOGGLE_BURST_WINDOW = 1.0
+# seconds a request ID is remembered, so a retry gets the first reply instead of running again
+REQUEST_ID_MEMORY = 60
+# commands defined as sequences of steps, name -> sequence, see _sequences.py;
+# e.g. {"let_in": "buzz 2s || unlock; blink 60s; lock"}, a built-in name redefines it
+SEQUENCES = {}
+# lock state the daemon publishes in shared memory for other processes, see _shared_state.py
+SHARED_STATE_FILE = "/dev/shm/door_lock_state" if os.path.isdir("/dev/shm") else os.path.join(_HERE, "_shared_state")
+# every command run, see _history.py and history.py
+HISTORY_FILE = os.path.join(_HERE, "_history.sqlite")
+HISTORY_WRITE_DELAY = 5.0 # seconds, events recorded closer together are written in one batch
+HISTORY_BATCH_SIZE = 100 # events written at once, without waiting for HISTORY_WRITE_DELAY
+# commands run at times of day or after lock events by the lock daemon, name ->
+# rule, see _rules.py; e.g. {"night": {"at": "23:00", "command": "lock"},
+# "auto_lock": {"after": "unlock", "delay": 300, "command": "lock"}}
+RULES = {}
+# days rules can skip or be limited to, "YYYY-MM-DD" or "MM-DD" for every year
+HOLIDAYS = []
+# seconds the door sensor has to read the same before the door counts as opened
+# or closed; a door closing while a delayed lock is pending locks this long after
+DOOR_SENSOR_SETTLE_TIME = 0.2
+# who may use the HTTP API, name -> credential, written by credentials.py, see
+# _auth.py; without the file HTTP_API_PORT only serves clients on this host
+CREDENTIALS_FILE = os.path.join(_HERE, "_credentials.json")
+AUTH_KEY_FILE = os.path.join(_HERE, "_auth.key") # key PINs are hashed with, kept apart from the credentials
+# failed attempts from one address within AUTH_FAILURE_WINDOW seconds after
+# which it is refused until they age out
+AUTH_FAILURES = 5
+AUTH_FAILURE_WINDOW = 60 # seconds
@@ -0,0 +1,63 @@
+"""Prints whether the door is locked, without going through the lock daemon.
+
+	python status.py [--json]
+
+Reads the state the daemon publishes in shared memory, see _shared_state.py,
+or the state file when the daemon is not running.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import argparse
+
+import settings
+import _config
+import _state_store
+from _shared_state import SharedStateReader
+
+def state():
+	"""The published state if its publisher is still running, else the
+	locked flag from the state file.
+	"""
+	published = SharedStateReader().read()
+	if published is not None and _alive(published["pid"]):
+		return published
+	saved = _state_store._read(settings.PERSISTENT_STATE_FILE)
+	return {
+		"locked": bool(saved.get(settings.LOCKED_STATE_KEY, False)),
+		"changed_at": None,
+		"delayed_lock_deadline": None,
+		"pid": None,
+		"sequence": None,
+	}
+
+def _alive(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError as e:
+		return e.errno == errno.EPERM # running as another user
+	return True
+
+def describe(state, now):
+	text = "locked" if state["locked"] else "unlocked"
+	if state["changed_at"] is not None:
+		text += " since %s" % time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(state["changed_at"]))
+	if state["delayed_lock_deadline"] is not None:
+		text += ", locking in %.0f s" % max(0, state["delayed_lock_deadline"] - now)
+	return text
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--json", action="store_true", help="print the state as JSON")
+	arguments = parser.parse_args()
+	_config.setUp()
+	current = state()
+	if arguments.json:
+		sys.stdout.write(json.dumps(current, sort_keys=True) + "\n")
+	else:
+		sys.stdout.write(describe(current, time.time()) + "\n")
+
+if __name__ == '__main__':
+	main()